@@ -3,6 +3,7 @@ Interactive chat-like test client for MCP M365 Management Server
 Test your MCP tools without Claude Desktop
 """
 
+import asyncio
 import json
 import sys
 from datetime import datetime
@@ -17,6 +18,13 @@ from mcp_m365_mgmt import (
     create_file_in_onedrive, create_file_in_sharepoint
 )
 
+# Tools are async; a single loop keeps the shared Graph connection pool alive between commands
+loop = asyncio.new_event_loop()
+
+def run(coro):
+    """Run a tool coroutine on the console's event loop."""
+    return loop.run_until_complete(coro)
+
 def print_table(headers, rows, title=None):
     """Print data in a formatted table."""
     if title:
@@ -234,12 +242,12 @@ def handle_command(command):
         
         elif cmd == 'users':
             print("\n🔄 Fetching users...")
-            result = list_users()
+            result = run(list_users())
             pretty_print(result, "All Users", data_type='users')
         
         elif cmd == 'groups':
             print("\n🔄 Fetching groups...")
-            result = list_groups()
+            result = run(list_groups())
             pretty_print(result, "All Groups", data_type='groups')
         
         elif cmd == 'group' and len(parts) >= 3:
@@ -248,103 +256,103 @@ def handle_command(command):
             
             if action == 'details':
                 print(f"\n🔄 Fetching group details for {group_id}...")
-                result = get_group_details(group_id)
+                result = run(get_group_details(group_id))
                 pretty_print(result, "Group Details", data_type='details')
             elif action == 'members':
                 print(f"\n🔄 Fetching group members for {group_id}...")
-                result = get_group_members(group_id)
+                result = run(get_group_members(group_id))
                 pretty_print(result, "Group Members", data_type='users')
         
         elif cmd == 'user' and len(parts) >= 3:
             if parts[1] == 'info':
                 user_id = parts[2]
                 print(f"\n🔄 Fetching user info for {user_id}...")
-                result = get_user_info(user_id)
+                result = run(get_user_info(user_id))
                 pretty_print(result, "User Information", data_type='details')
         
         elif cmd == 'devices':
             print("\n🔄 Fetching Intune devices...")
-            result = list_intune_devices()
+            result = run(list_intune_devices())
             pretty_print(result, "Intune Managed Devices", data_type='devices')
         
         elif cmd == 'compliance':
             print("\n🔄 Fetching compliance policies...")
-            result = list_intune_compliance_policies()
+            result = run(list_intune_compliance_policies())
             pretty_print(result, "Compliance Policies")
         
         elif cmd == 'configs':
             print("\n🔄 Fetching configuration policies...")
-            result = list_intune_configuration_policies()
+            result = run(list_intune_configuration_policies())
             pretty_print(result, "Configuration Policies")
         
         elif cmd == 'filters':
             print("\n🔄 Fetching assignment filters...")
-            result = list_intune_filters()
+            result = run(list_intune_filters())
             pretty_print(result, "Assignment Filters")
         
         elif cmd == 'scripts':
             print("\n🔄 Fetching scripts...")
-            result = list_intune_scripts()
+            result = run(list_intune_scripts())
             pretty_print(result, "PowerShell & Shell Scripts")
         
         elif cmd == 'apps':
             print("\n🔄 Fetching applications...")
-            result = list_intune_applications()
+            result = run(list_intune_applications())
             pretty_print(result, "Mobile Applications")
         
         elif cmd == 'autopilot' and len(parts) >= 2:
             if parts[1] == 'profiles':
                 print("\n🔄 Fetching Autopilot profiles...")
-                result = list_autopilot_profiles()
+                result = run(list_autopilot_profiles())
                 pretty_print(result, "Autopilot Deployment Profiles")
             elif parts[1] == 'devices':
                 print("\n🔄 Fetching Autopilot devices...")
-                result = list_autopilot_devices()
+                result = run(list_autopilot_devices())
                 pretty_print(result, "Autopilot Registered Devices")
         
         elif cmd == 'esp':
             print("\n🔄 Fetching ESP profiles...")
-            result = list_enrollment_status_page_profiles()
+            result = run(list_enrollment_status_page_profiles())
             pretty_print(result, "Enrollment Status Page Profiles")
         
         elif cmd == 'android':
             print("\n🔄 Fetching Android profiles...")
-            result = list_android_management_profiles()
+            result = run(list_android_management_profiles())
             pretty_print(result, "Android Management Profiles")
         
         elif cmd == 'ios':
             print("\n🔄 Fetching iOS profiles...")
-            result = list_ios_management_profiles()
+            result = run(list_ios_management_profiles())
             pretty_print(result, "iOS Management Profiles")
         
         elif cmd == 'mam':
             print("\n🔄 Fetching app protection policies...")
-            result = list_app_protection_policies()
+            result = run(list_app_protection_policies())
             pretty_print(result, "App Protection Policies (MAM)")
         
         elif cmd == 'tunnel' and len(parts) >= 2:
             if parts[1] == 'sites':
                 print("\n🔄 Fetching Microsoft Tunnel sites...")
-                result = list_microsoft_tunnel_sites()
+                result = run(list_microsoft_tunnel_sites())
                 pretty_print(result, "Microsoft Tunnel Sites")
             elif parts[1] == 'servers':
                 print("\n🔄 Fetching Microsoft Tunnel servers...")
-                result = list_microsoft_tunnel_servers()
+                result = run(list_microsoft_tunnel_servers())
                 pretty_print(result, "Microsoft Tunnel Servers")
         
         elif cmd == 'ad' and len(parts) >= 2 and parts[1] == 'connectors':
             print("\n🔄 Fetching AD connectors...")
-            result = list_intune_ad_connectors()
+            result = run(list_intune_ad_connectors())
             pretty_print(result, "Active Directory Connectors")
         
         elif cmd == 'cert' and len(parts) >= 2 and parts[1] == 'connectors':
             print("\n🔄 Fetching certificate connectors...")
-            result = list_intune_certificate_connectors()
+            result = run(list_intune_certificate_connectors())
             pretty_print(result, "Certificate Connectors")
         
         elif cmd == 'sites':
             print("\n🔄 Fetching SharePoint sites...")
-            result = list_sharepoint_sites()
+            result = run(list_sharepoint_sites())
             pretty_print(result, "SharePoint Sites", data_type='sites')
         
         else:
@@ -1,8 +1,38 @@
 from mcp.server.fastmcp import FastMCP
 import asyncio
-from azure.identity import DefaultAzureCredential, InteractiveBrowserCredential, ClientSecretCredential
-import requests
+import base64
+import codecs
+import copy
+import csv
+import io
+import hashlib
+import heapq
+import inspect
+import json
+import math
+import multiprocessing
+import random
+import re
+import secrets
+import sqlite3
+import string
+import tempfile
+import threading
+import time
+import zipfile
+from array import array
+from collections import Counter, OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
+from functools import lru_cache
+from itertools import islice, zip_longest
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+import httpx
 import os
+from typing import Optional
 from dotenv import load_dotenv
 
 # Load environment variables
@@ -11,26 +41,73 @@ load_dotenv()
 # Create MCP server instance
 mcp = FastMCP("entra-server")
 
+GRAPH_SCOPE = "https://graph.microsoft.com/.default"
+
+def token_cache_options():
+    """Returns persistence options for the MSAL token cache, or None when disabled.
+
+    The cache is encrypted with the platform keyring (DPAPI, Keychain, libsecret);
+    TOKEN_CACHE_ALLOW_UNENCRYPTED permits a plain file where none is available.
+    """
+    if os.getenv("TOKEN_CACHE_PERSISTENCE", "false").lower() != "true":
+        return None
+    from azure.identity import TokenCachePersistenceOptions
+    return TokenCachePersistenceOptions(
+        name="mcp-m365-mgmt",
+        allow_unencrypted_storage=os.getenv("TOKEN_CACHE_ALLOW_UNENCRYPTED", "false").lower() == "true"
+    )
+
+def authentication_record_path():
+    return os.path.expanduser(os.getenv("AUTH_RECORD_PATH", "~/.mcp-m365-mgmt/authentication_record.json"))
+
+def load_authentication_record():
+    """Loads the saved account of a previous interactive sign-in, if any."""
+    from azure.identity import AuthenticationRecord
+    try:
+        with open(authentication_record_path(), encoding="utf-8") as record_file:
+            return AuthenticationRecord.deserialize(record_file.read())
+    except (OSError, ValueError):
+        return None
+
 # Initialize authentication
 def get_credential():
-    """Get Azure credential for authentication."""
+    """Get Azure credential for authentication.
+
+    App mode uses the async azure-identity credentials so token requests never
+    block the event loop. InteractiveBrowserCredential has no async variant, so
+    user mode keeps the sync credential and get_access_token runs it in a thread.
+    Called on the first token request; azure-identity is only imported then.
+    """
+    from azure.identity import InteractiveBrowserCredential
+    from azure.identity.aio import DefaultAzureCredential, ClientSecretCredential
+
     # Check authentication mode from environment
     auth_mode = os.getenv("AUTH_MODE", "app")  # 'app' or 'user'
+    cache_options = token_cache_options()
     
     if auth_mode == "user":
         # Interactive user authentication
         tenant_id = os.getenv("AZURE_TENANT_ID")
         client_id = os.getenv("AZURE_CLIENT_ID")
         
+        # With a persisted cache and the saved account, a restart signs in silently
+        options = {}
+        if cache_options:
+            options["cache_persistence_options"] = cache_options
+            record = load_authentication_record()
+            if record:
+                options["authentication_record"] = record
+        
         if client_id and tenant_id:
             # Use InteractiveBrowserCredential with custom app registration
             return InteractiveBrowserCredential(
                 tenant_id=tenant_id,
-                client_id=client_id
+                client_id=client_id,
+                **options
             )
         else:
             # Fall back to default interactive auth
-            return InteractiveBrowserCredential()
+            return InteractiveBrowserCredential(**options)
     else:
         # Service principal (app) authentication
         client_id = os.getenv("AZURE_CLIENT_ID")
@@ -41,7 +118,8 @@ def get_credential():
             return ClientSecretCredential(
                 tenant_id=tenant_id,
                 client_id=client_id,
-                client_secret=client_secret
+                client_secret=client_secret,
+                **({"cache_persistence_options": cache_options} if cache_options else {})
             )
         
         # Fall back to DefaultAzureCredential (Azure CLI, managed identity, etc.)
@@ -50,30 +128,1524 @@ def get_credential():
         except:
             return InteractiveBrowserCredential()
 
-credential = get_credential()
+def close_on_loop_shutdown(close):
+    """Schedules close() to run when the current event loop shuts down.
+
+    asyncio.run() cancels leftover tasks before it closes the loop, so a task
+    waiting forever gets to close loop-bound resources (HTTP sessions) on the
+    loop that owns them. Returns the task; pass it to close_now() to close early.
+    """
+    async def wait_for_shutdown():
+        try:
+            await asyncio.get_running_loop().create_future()
+        finally:
+            await close()
+    return asyncio.ensure_future(wait_for_shutdown())
+
+def close_now(closer):
+    """Runs a close_on_loop_shutdown() close right away, from any loop or thread."""
+    loop = closer.get_loop()
+    if not loop.is_closed():
+        loop.call_soon_threadsafe(closer.cancel)
+
+class TokenManager:
+    """Caches the Graph access token and renews it in the background before it expires.
+
+    After each acquisition a refresh is scheduled refresh_margin seconds before
+    expiry, so tool calls get the cached token instead of waiting on Entra ID.
+    Only a missing or (nearly) expired token is acquired inline, and concurrent
+    callers then share that single acquisition.
+
+    Args:
+        credential_factory: Callable creating the azure-identity credential (sync or async) on first use
+        scope: Scope to request tokens for
+        refresh_margin: Seconds before expiry at which the token is renewed
+    """
+
+    # Inline acquisition happens once the token is this close to expiry
+    MIN_VALIDITY = 60
+    # Wait between background refreshes when the credential handed back the same token
+    # (azure-identity only renews its cached token within ~300 s of expiry)
+    RENEW_RETRY_INTERVAL = 60
+
+    def __init__(self, credential_factory, scope=GRAPH_SCOPE, refresh_margin=300.0):
+        self._credential_factory = credential_factory
+        self._credential = None
+        self._credential_closer = None
+        self.scope = scope
+        self.refresh_margin = refresh_margin
+        self._token = None
+        self._acquiring = None
+        self._refresh_task = None
+        self.cache_hits = 0
+        self.acquisitions = 0
+        self.background_refreshes = 0
+        self.refresh_failures = 0
+        self.last_latency = None
+        self.max_latency = 0.0
+        self.total_latency = 0.0
+
+    @property
+    def credential(self):
+        if self._credential_closer is not None and self._credential_closer.get_loop() is not asyncio.get_running_loop():
+            # An async credential's HTTP session belongs to the loop it was created on
+            close_now(self._credential_closer)
+            self._credential = self._credential_closer = None
+        if self._credential is None:
+            self._credential = self._credential_factory()
+            if inspect.iscoroutinefunction(getattr(self._credential, "close", None)):
+                self._credential_closer = close_on_loop_shutdown(self._credential.close)
+        return self._credential
+
+    async def get_token(self):
+        """Returns a valid access token string."""
+        if self._token is not None and self._token.expires_on - time.time() > self.MIN_VALIDITY:
+            self.cache_hits += 1
+            self._ensure_refresh_task()
+            return self._token.token
+        token = await self._acquire()
+        self._ensure_refresh_task()
+        return token.token
+
+    async def _acquire(self):
+        # Concurrent callers share one acquisition
+        if self._acquiring is None or self._acquiring.done() or self._acquiring.get_loop() is not asyncio.get_running_loop():
+            self._acquiring = asyncio.ensure_future(self._request_token())
+        return await asyncio.shield(self._acquiring)
 
-def get_access_token():
+    async def _request_token(self):
+        started = time.perf_counter()
+        if inspect.iscoroutinefunction(self.credential.get_token):
+            token = await self.credential.get_token(self.scope)
+        else:
+            await asyncio.to_thread(self._save_authentication_record)
+            token = await asyncio.to_thread(self.credential.get_token, self.scope)
+
+        latency = time.perf_counter() - started
+        self.acquisitions += 1
+        self.last_latency = latency
+        self.max_latency = max(self.max_latency, latency)
+        self.total_latency += latency
+        self._token = token
+        return token
+
+    def _save_authentication_record(self):
+        # Interactive sign-in: remember the account so a persisted cache can be used silently next time
+        if not hasattr(self.credential, "authenticate") or token_cache_options() is None:
+            return
+        path = authentication_record_path()
+        if os.path.exists(path):
+            return
+        record = self.credential.authenticate(scopes=[self.scope])
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w", encoding="utf-8") as record_file:
+            record_file.write(record.serialize())
+
+    def _ensure_refresh_task(self):
+        # Restarted when it did not survive or belongs to a previous event loop
+        task = self._refresh_task
+        if task is not None and not task.done() and task.get_loop() is not asyncio.get_running_loop():
+            old_loop = task.get_loop()
+            if not old_loop.is_closed():
+                old_loop.call_soon_threadsafe(task.cancel)
+            task = None
+        if task is None or task.done():
+            self._refresh_task = asyncio.ensure_future(self._refresh_loop())
+
+    async def _refresh_loop(self):
+        while True:
+            await asyncio.sleep(max(0.0, self._token.expires_on - time.time() - self.refresh_margin))
+            if self._token.expires_on - time.time() > self.refresh_margin:
+                # Renewed inline in the meantime
+                continue
+            expires_on = self._token.expires_on
+            try:
+                token = await self._acquire()
+                if token.expires_on > expires_on:
+                    self.background_refreshes += 1
+                if token.expires_on - time.time() <= self.refresh_margin:
+                    # Not renewed (refresh_margin is wider than the credential's own
+                    # renewal window) or issued for less than the margin: ask again
+                    # later instead of immediately
+                    await asyncio.sleep(self.RENEW_RETRY_INTERVAL)
+            except Exception:
+                # Keep the current token and try again later; get_token acquires
+                # inline once it is about to expire
+                self.refresh_failures += 1
+                await asyncio.sleep(self.MIN_VALIDITY / 2)
+
+    def stats(self):
+        return {
+            "acquisitions": self.acquisitions,
+            "background_refreshes": self.background_refreshes,
+            "refresh_failures": self.refresh_failures,
+            "cache_hits": self.cache_hits,
+            "last_acquisition_ms": round(self.last_latency * 1000, 1) if self.last_latency is not None else None,
+            "avg_acquisition_ms": round(self.total_latency / self.acquisitions * 1000, 1) if self.acquisitions else None,
+            "max_acquisition_ms": round(self.max_latency * 1000, 1),
+            "expires_in_seconds": int(self._token.expires_on - time.time()) if self._token else None
+        }
+
+token_manager = TokenManager(get_credential, refresh_margin=float(os.getenv("TOKEN_REFRESH_MARGIN", "300")))
+
+async def get_access_token():
     """Get access token for Microsoft Graph API."""
-    auth_mode = os.getenv("AUTH_MODE", "app")
-    
-    if auth_mode == "user":
-        # Use user delegated permissions scope
-        token = credential.get_token("https://graph.microsoft.com/.default")
-    else:
-        # Use application permissions scope
-        token = credential.get_token("https://graph.microsoft.com/.default")
-    
-    return token.token
+    return await token_manager.get_token()
+
+@lru_cache(maxsize=16)
+def token_principal(token):
+    """Identifies who a Graph access token was issued to (tenant and object id).
+
+    Falls back to a digest of the token when it is not a readable JWT, so
+    callers can still tell different credentials apart.
+    """
+    try:
+        payload = token.split(".")[1]
+        claims = json.loads(base64.urlsafe_b64decode(payload + "=" * (-len(payload) % 4)))
+        return f"{claims['tid']}/{claims.get('oid') or claims['appid']}"
+    except (IndexError, KeyError, ValueError):
+        return hashlib.sha256(token.encode()).hexdigest()
+
+class RetryScheduler:
+    """Decides when throttled or failed Graph requests are retried and tracks the cost.
+
+    429 and 503 responses wait for the server's Retry-After; other 5xx responses
+    and connection errors back off exponentially with full jitter. Requests that
+    are not idempotent (e.g. POST) may already have taken effect after a 5xx or a
+    dropped connection, so they are only retried on 429/503. A global budget
+    caps how many retries may start within a sliding window, so a throttled tenant
+    fails fast instead of piling up sleeping requests.
+
+    Args:
+        max_attempts: Maximum attempts per request, including the first one
+        base_delay: Initial backoff in seconds for 5xx responses
+        max_delay: Upper bound in seconds for any single wait
+        budget: Maximum retries allowed across all requests per window
+        budget_window: Length of the budget window in seconds
+    """
+
+    RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+    # Responses that mean the request was not processed, so any method may be retried
+    THROTTLE_STATUS_CODES = (429, 503)
+    IDEMPOTENT_METHODS = ("GET", "HEAD", "PUT")
+
+    def __init__(self, max_attempts=5, base_delay=1.0, max_delay=60.0, budget=100, budget_window=60.0):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.budget = budget
+        self.budget_window = budget_window
+        self._recent_retries = deque()
+        self.retries = 0
+        self.throttled_responses = 0
+        self.budget_exhausted = 0
+        self.wait_seconds = 0.0
+
+    def delay_for(self, attempt, response=None, idempotent=True):
+        """Returns seconds to wait before the next attempt, or None to give up.
+
+        response is None for a connection error; idempotent is False for requests
+        that must not be repeated unless the server says it did not process them.
+        """
+        if attempt + 1 >= self.max_attempts:
+            return None
+        if response is not None and response.status_code not in self.RETRY_STATUS_CODES:
+            return None
+        if not idempotent and (response is None or response.status_code not in self.THROTTLE_STATUS_CODES):
+            return None
+
+        if response is not None and response.status_code in self.THROTTLE_STATUS_CODES:
+            self.throttled_responses += 1
+            retry_after = self._parse_retry_after(response.headers.get("Retry-After"))
+            if retry_after is not None:
+                return min(retry_after, self.max_delay)
+
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def _parse_retry_after(self, value):
+        # Retry-After is either delta-seconds or an HTTP-date
+        if not value:
+            return None
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+        try:
+            retry_at = parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            return None
+        return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
+    def acquire(self):
+        """Takes one retry from the global budget; returns False when it is spent."""
+        now = time.monotonic()
+        while self._recent_retries and now - self._recent_retries[0] > self.budget_window:
+            self._recent_retries.popleft()
+        if len(self._recent_retries) >= self.budget:
+            self.budget_exhausted += 1
+            return False
+        self._recent_retries.append(now)
+        self.retries += 1
+        return True
+
+    async def wait(self, delay):
+        self.wait_seconds += delay
+        await asyncio.sleep(delay)
+
+    def stats(self):
+        return {
+            "retries": self.retries,
+            "throttled_responses": self.throttled_responses,
+            "budget_exhausted": self.budget_exhausted,
+            "wait_seconds": round(self.wait_seconds, 3),
+            "budget_remaining": max(0, self.budget - len(self._recent_retries))
+        }
+
+retry_scheduler = RetryScheduler(
+    max_attempts=int(os.getenv("GRAPH_MAX_ATTEMPTS", "5")),
+    base_delay=float(os.getenv("GRAPH_RETRY_BASE_DELAY", "1")),
+    max_delay=float(os.getenv("GRAPH_RETRY_MAX_DELAY", "60")),
+    budget=int(os.getenv("GRAPH_RETRY_BUDGET", "100")),
+    budget_window=float(os.getenv("GRAPH_RETRY_BUDGET_WINDOW", "60"))
+)
+
+class SingleFlight:
+    """Lets concurrent identical Graph reads share one upstream request.
+
+    The first caller for a key starts the request; callers arriving while it
+    is still in flight await the same result instead of sending their own.
+    Keys are dropped as soon as the request completes, so nothing is cached.
+    """
+
+    def __init__(self):
+        self._in_flight = {}
+        self.upstream_requests = 0
+        self.coalesced_requests = 0
+
+    def get(self, key):
+        """Returns the in-flight future for key, or None."""
+        future = self._in_flight.get(key)
+        if future is not None:
+            self.coalesced_requests += 1
+        return future
+
+    def claim(self, key, fetch=None):
+        """Registers a new in-flight request for key and returns its future.
+
+        With a fetch coroutine the request runs as its own task; without one the
+        caller resolves the returned future itself.
+        """
+        if fetch is not None:
+            future = asyncio.ensure_future(fetch)
+        else:
+            future = asyncio.get_running_loop().create_future()
+        self._in_flight[key] = future
+        self.upstream_requests += 1
+        future.add_done_callback(lambda done: self._release(key, done))
+        return future
+
+    def _release(self, key, future):
+        self._in_flight.pop(key, None)
+        if not future.cancelled():
+            # Marks the error as retrieved when no caller is left to await it
+            future.exception()
+
+    async def do(self, key, fetch):
+        """Runs fetch() for key unless an identical request is already in flight."""
+        future = self.get(key) or self.claim(key, fetch())
+        # Shielded so one caller being cancelled does not cancel the others' result
+        return await asyncio.shield(future)
+
+    def stats(self):
+        return {
+            "upstream_requests": self.upstream_requests,
+            "coalesced_requests": self.coalesced_requests
+        }
+
+single_flight = SingleFlight()
+
+async def read_key(url, headers=None):
+    """Builds the single-flight key for a GET: method, absolute URL, headers and auth principal."""
+    principal = token_principal(await get_access_token())
+    return ("GET", url, tuple(sorted((headers or {}).items())), principal)
+
+class ResponseCache:
+    """In-process LRU cache for Graph GET responses of slowly changing collections.
+
+    Only endpoints with a TTL are cached. Fresh entries are served without a
+    request; expired entries that carried an ETag are revalidated with
+    If-None-Match, so an unchanged collection costs a 304 instead of a full body.
+    Responses handed out carry extensions["cache_status"] (hit/miss/revalidated).
+
+    Args:
+        max_entries: Maximum cached responses before the least recently used is evicted (0 disables)
+        ttls: Mapping of Graph resource path prefixes (without version) to TTL seconds
+    """
+
+    # The stored content is already decoded, so replaying these would make httpx decode it again
+    TRANSPORT_HEADERS = ("content-encoding", "content-length", "transfer-encoding")
+
+    def __init__(self, max_entries=256, ttls=None):
+        self.max_entries = max_entries
+        self.ttls = dict(ttls or {})
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.revalidations = 0
+        self.evictions = 0
+
+    def ttl_for(self, url):
+        """Returns the TTL in seconds for a Graph URL, or 0 if it is not cached."""
+        if not self.max_entries:
+            return 0
+        _, resource = _split_version(urlsplit(url).path)
+        for prefix, ttl in self.ttls.items():
+            if resource.startswith(prefix):
+                return ttl
+        return 0
+
+    def lookup(self, key):
+        """Returns (fresh response or None, expired entry to revalidate or None).
+
+        The expired entry is only returned when it carries an ETag; pass it back
+        to update() so a 304 can still be answered if the entry was evicted in
+        the meantime.
+        """
+        entry = self._entries.get(key)
+        if entry is None:
+            return None, None
+        self._entries.move_to_end(key)
+        if time.monotonic() < entry["expires_at"]:
+            self.hits += 1
+            return self._replay(entry, "hit"), None
+        return None, entry if entry["etag"] else None
+
+    def update(self, key, url, response, stale=None):
+        """Records an upstream response for key and returns what the caller should see.
+
+        stale is the entry lookup() returned for revalidation, if any.
+        """
+        entry = self._entries.get(key) or stale
+        if response.status_code == 304 and entry is not None:
+            self.revalidations += 1
+            entry["expires_at"] = time.monotonic() + self.ttl_for(url)
+            if key not in self._entries:
+                self._store(key, entry)
+            return self._replay(entry, "revalidated")
+
+        response.extensions["cache_status"] = "miss"
+        ttl = self.ttl_for(url)
+        if ttl <= 0:
+            return response
+
+        self.misses += 1
+        if response.status_code != 200:
+            self._entries.pop(key, None)
+            return response
+
+        self._store(key, {
+            "status_code": response.status_code,
+            "headers": {
+                name: value for name, value in response.headers.items()
+                if name.lower() not in self.TRANSPORT_HEADERS
+            },
+            "content": response.content,
+            "etag": response.headers.get("ETag"),
+            "expires_at": time.monotonic() + ttl
+        })
+        return response
+
+    def _store(self, key, entry):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def _replay(self, entry, status):
+        return httpx.Response(
+            entry["status_code"],
+            headers=entry["headers"],
+            content=entry["content"],
+            extensions={"cache_status": status}
+        )
+
+    def stats(self):
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "revalidated": self.revalidations,
+            "evictions": self.evictions
+        }
+
+# Collections that change rarely; everything else always goes to Graph
+GRAPH_CACHE_TTLS = {
+    "/deviceManagement/deviceCompliancePolicies": 300,
+    "/deviceManagement/assignmentFilters": 300,
+    "/deviceManagement/deviceManagementScripts": 300,
+    "/deviceManagement/deviceShellScripts": 300,
+    "/deviceManagement/windowsAutopilotDeploymentProfiles": 300,
+    "/deviceManagement/domainJoinConnectors": 120,
+    "/deviceManagement/ndesConnectors": 120
+}
+
+if os.getenv("GRAPH_CACHE_TTL"):
+    GRAPH_CACHE_TTLS = {prefix: float(os.getenv("GRAPH_CACHE_TTL")) for prefix in GRAPH_CACHE_TTLS}
+
+response_cache = ResponseCache(
+    max_entries=int(os.getenv("GRAPH_CACHE_MAX_ENTRIES", "256")),
+    ttls=GRAPH_CACHE_TTLS
+)
+
+def combined_cache_status(statuses):
+    """Summarizes the cache status of the pages behind one tool result."""
+    if statuses and all(status == "hit" for status in statuses):
+        return "hit"
+    if statuses and all(status in ("hit", "revalidated") for status in statuses):
+        return "revalidated"
+    return "miss"
+
+class GraphClient:
+    """Shared async Microsoft Graph HTTP client backed by a keep-alive connection pool.
+
+    Every tool routes through a single instance so TCP/TLS connections to
+    graph.microsoft.com are reused across calls instead of being re-established
+    for each request, and a slow Graph call only suspends the tool awaiting it.
+
+    Args:
+        base_url: Graph root URL; paths like '/v1.0/users' are resolved against it
+        pool_hosts: Number of hosts the pool is sized for
+        pool_maxsize: Maximum open connections per host
+        connect_timeout: Seconds to wait when establishing a connection
+        read_timeout: Seconds to wait for the server to send data
+    """
+
+    def __init__(self, base_url="https://graph.microsoft.com", pool_hosts=10, pool_maxsize=20,
+                 connect_timeout=10.0, read_timeout=60.0):
+        self.base_url = base_url.rstrip("/")
+        self.pool_maxsize = pool_maxsize
+        self._host_slots = {}
+        # Open streamed bodies hold a connection each; keep half of a host's share for other requests
+        self.stream_limit = max(1, pool_maxsize // 2)
+        self._stream_slots = asyncio.Semaphore(self.stream_limit)
+        self.session = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=pool_hosts * pool_maxsize,
+                max_keepalive_connections=pool_hosts * pool_maxsize
+            ),
+            timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+            follow_redirects=True
+        )
+
+    def url(self, path):
+        """Resolves a Graph path (e.g. '/v1.0/users') to an absolute URL."""
+        if path.startswith(("https://", "http://")):
+            return path
+        return f"{self.base_url}{path}"
+
+    def _slots_for(self, url):
+        # httpx only limits the pool as a whole, so per-host limits are enforced here
+        host = urlsplit(url).netloc
+        if host not in self._host_slots:
+            self._host_slots[host] = asyncio.Semaphore(self.pool_maxsize)
+        return self._host_slots[host]
+
+    async def request(self, method, path, headers=None, authenticate=True, idempotent=None, **kwargs):
+        """Sends an authenticated request to Microsoft Graph.
+
+        Throttled (429/503) and failed (5xx) responses are retried according to
+        the shared retry scheduler; the last response is returned once it gives up.
+        Pass authenticate=False for pre-authenticated URLs (downloads, upload sessions).
+        idempotent defaults to whether the method is safe to repeat (GET, HEAD, PUT);
+        pass True for requests that are safe to repeat regardless of method.
+        """
+        url = self.url(path)
+        params = kwargs.pop("params", None)
+        if params:
+            # httpx replaces an existing query string when params are given; merge instead
+            url = str(httpx.URL(url).copy_merge_params(params))
+
+        if method == "GET" and authenticate and not kwargs:
+            key = await read_key(url, headers)
+            cached, stale = response_cache.lookup(key)
+            if cached is not None:
+                return cached
+            # Concurrent identical reads share a single upstream request
+            return await single_flight.do(key, lambda: self._read(key, url, headers, stale))
+        return await self._send(method, url, headers, authenticate, idempotent, **kwargs)
+
+    async def _read(self, key, url, headers, stale):
+        if stale is not None:
+            headers = {**(headers or {}), "If-None-Match": stale["etag"]}
+        return response_cache.update(key, url, await self._send("GET", url, headers, True), stale)
+
+    async def _send(self, method, url, headers, authenticate, idempotent=None, **kwargs):
+        if idempotent is None:
+            idempotent = method in retry_scheduler.IDEMPOTENT_METHODS
+        attempt = 0
+        while True:
+            request_headers = {}
+            if authenticate:
+                request_headers["Authorization"] = f"Bearer {await get_access_token()}"
+            if headers:
+                request_headers.update(headers)
+
+            try:
+                async with self._slots_for(url):
+                    response = await self.session.request(method, url, headers=request_headers, **kwargs)
+            except httpx.TransportError:
+                delay = retry_scheduler.delay_for(attempt, idempotent=idempotent)
+                if delay is None or not retry_scheduler.acquire():
+                    raise
+            else:
+                delay = retry_scheduler.delay_for(attempt, response, idempotent)
+                if delay is None or not retry_scheduler.acquire():
+                    return response
+
+            await retry_scheduler.wait(delay)
+            attempt += 1
+
+    @asynccontextmanager
+    async def stream(self, method, path, headers=None, authenticate=True, **kwargs):
+        """Sends a request and yields the response before its body is read.
+
+        Failures are retried like request() as long as no body was handed out;
+        the connection is released when the context exits. At most half of
+        pool_maxsize streams are open at once, so requests made while a body is
+        open (e.g. uploading it) always find a free connection. Do not open
+        another stream inside the context.
+        """
+        url = self.url(path)
+        params = kwargs.pop("params", None)
+        if params:
+            url = str(httpx.URL(url).copy_merge_params(params))
+
+        idempotent = method in retry_scheduler.IDEMPOTENT_METHODS
+        attempt = 0
+        async with self._stream_slots:
+            while True:
+                request_headers = {}
+                if authenticate:
+                    request_headers["Authorization"] = f"Bearer {await get_access_token()}"
+                if headers:
+                    request_headers.update(headers)
+
+                # The host slot only covers sending the request and receiving the headers:
+                # callers keep the body open while making other Graph requests (e.g.
+                # uploading it), which would deadlock once every slot is held by a stream
+                request = self.session.build_request(method, url, headers=request_headers, **kwargs)
+                try:
+                    async with self._slots_for(url):
+                        response = await self.session.send(request, stream=True)
+                except httpx.TransportError:
+                    delay = retry_scheduler.delay_for(attempt, idempotent=idempotent)
+                    if delay is None or not retry_scheduler.acquire():
+                        raise
+                else:
+                    delay = retry_scheduler.delay_for(attempt, response, idempotent)
+                    if delay is None or not retry_scheduler.acquire():
+                        try:
+                            yield response
+                        finally:
+                            await response.aclose()
+                        return
+                    await response.aclose()
+
+                await retry_scheduler.wait(delay)
+                attempt += 1
+
+    async def get(self, path, **kwargs):
+        return await self.request("GET", path, **kwargs)
+
+    async def aclose(self):
+        """Closes the pooled connections."""
+        await self.session.aclose()
+
+    async def post(self, path, **kwargs):
+        return await self.request("POST", path, **kwargs)
+
+    async def put(self, path, **kwargs):
+        return await self.request("PUT", path, **kwargs)
+
+_graph_client = None
+_graph_client_loop = None
+_graph_client_closer = None
+
+def get_graph_client():
+    """Get the shared Graph client, creating it on first use.
+
+    Async connection pools are tied to the event loop that created them, so a
+    new client is created if the caller is running on a different loop. Each
+    client is closed when its loop shuts down, or when it is replaced.
+    """
+    global _graph_client, _graph_client_loop, _graph_client_closer
+
+    loop = asyncio.get_running_loop()
+    if _graph_client is None or _graph_client_loop is not loop:
+        if _graph_client_closer is not None:
+            close_now(_graph_client_closer)
+        _graph_client = GraphClient(
+            base_url=os.getenv("GRAPH_BASE_URL", "https://graph.microsoft.com"),
+            pool_hosts=int(os.getenv("GRAPH_POOL_HOSTS", "10")),
+            pool_maxsize=int(os.getenv("GRAPH_POOL_MAXSIZE", "20")),
+            connect_timeout=float(os.getenv("GRAPH_CONNECT_TIMEOUT", "10")),
+            read_timeout=float(os.getenv("GRAPH_READ_TIMEOUT", "60"))
+        )
+        _graph_client_loop = loop
+        _graph_client_closer = close_on_loop_shutdown(_graph_client.aclose)
+
+    return _graph_client
+
+class GraphAPIError(Exception):
+    """Raised when Microsoft Graph returns an unexpected status code."""
+
+    def __init__(self, response):
+        super().__init__(f"Graph request failed with status {response.status_code}")
+        self.status_code = response.status_code
+        self.text = response.text
+
+    def to_dict(self):
+        """Returns the error in the shape tools return to the client."""
+        return {"error": self.text, "status_code": self.status_code}
+
+async def iter_pages(path, params=None, page_size=None, max_items=None, first_page=None, cache_statuses=None, headers=None):
+    """Yields the items of a Graph collection one page at a time.
+
+    Follows @odata.nextLink until the collection is exhausted, so callers can
+    project each page as it arrives and only one raw page is held in memory.
+
+    Args:
+        path: Graph collection path (e.g. '/v1.0/users')
+        params: Optional query parameters for the first request
+        page_size: Optional page size sent as $top
+        max_items: Optional cap on the total number of items yielded
+        first_page: Optional response already holding the first page (e.g. from batch_requests)
+        cache_statuses: Optional list that receives the response cache status of each page
+        headers: Optional headers sent with every page request (e.g. ConsistencyLevel)
+    """
+    graph = get_graph_client()
+    params = dict(params or {})
+    if page_size:
+        params["$top"] = page_size
+
+    url = path
+    remaining = max_items
+    while url:
+        if first_page is not None:
+            response, first_page = first_page, None
+        else:
+            response = await graph.get(url, params=params, headers=headers)
+        if response.status_code != 200:
+            raise GraphAPIError(response)
+        if cache_statuses is not None:
+            cache_statuses.append(response.extensions.get("cache_status", "miss"))
+
+        result = response.json()
+        items = result.get("value", [])
+        if remaining is not None:
+            items = items[:remaining]
+            remaining -= len(items)
+        yield items
+
+        if remaining is not None and remaining <= 0:
+            break
+        # nextLink already carries the query string of the original request
+        url = result.get("@odata.nextLink")
+        params = None
+
+def odata_type_name(item):
+    """Returns the short entity type of a Graph item (e.g. 'androidGeneralDeviceConfiguration')."""
+    return item.get("@odata.type", "").split('.')[-1]
+
+def managed_app_platform(policy):
+    """Returns the platform prefix of an app protection policy type (e.g. 'ios')."""
+    policy_type = policy.get("@odata.type", "").lower()
+    if "managedapp" not in policy_type:
+        return "unknown"
+    return policy_type.replace("#microsoft.graph.", "").split("managedapp")[0]
+
+def project(item, fields):
+    """Projects a Graph item onto a field list.
+
+    Each field is either a Graph property name, copied as-is, or an
+    (output_name, function) pair computed from the item.
+    """
+    projected = {}
+    for field in fields:
+        if isinstance(field, tuple):
+            projected[field[0]] = field[1](item)
+        else:
+            projected[field] = item.get(field)
+    return projected
+
+def select_params(fields):
+    """Builds the $select query for a field list so Graph only sends projected properties.
+
+    Computed fields and OData annotations such as @odata.type are skipped; Graph
+    always returns the annotations.
+    """
+    properties = [field for field in fields if isinstance(field, str) and not field.startswith("@")]
+    return {"$select": ",".join(properties)}
+
+async def fan_out(items, fetch, concurrency=None):
+    """Runs fetch(item) for every item with bounded concurrency.
+
+    Results are returned in the same order as items regardless of completion order.
+
+    Args:
+        items: Items to process
+        fetch: Coroutine function called once per item
+        concurrency: Maximum calls in flight (defaults to GRAPH_FANOUT_CONCURRENCY)
+    """
+    if not concurrency:
+        concurrency = int(os.getenv("GRAPH_FANOUT_CONCURRENCY", "8"))
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run(item):
+        async with semaphore:
+            return await fetch(item)
+
+    return await asyncio.gather(*(run(item) for item in items))
+
+async def fetch_child_collections(parents, child_path, params=None, concurrency=None):
+    """Fetches a paged child collection for each parent (e.g. servers per site).
+
+    Args:
+        parents: Parent entities
+        child_path: Function mapping a parent to its child collection path
+        params: Optional query parameters for every child collection
+        concurrency: Maximum child collections fetched at once
+
+    Returns:
+        List of (parent, items, error) tuples in the same order as parents, where
+        error is the GraphAPIError that stopped the listing, or None
+    """
+    async def fetch(parent):
+        items = []
+        try:
+            async for page in iter_pages(child_path(parent), params=params):
+                items.extend(page)
+        except GraphAPIError as error:
+            return parent, items, error
+        return parent, items, None
+
+    return await fan_out(parents, fetch, concurrency)
+
+GRAPH_BATCH_LIMIT = 20
+
+def _split_version(path):
+    """Splits a Graph path like '/beta/users' into ('beta', '/users')."""
+    version, _, resource = path.lstrip("/").partition("/")
+    return version, f"/{resource}"
+
+async def batch_requests(requests):
+    """Sends independent Graph requests in as few round trips as possible.
+
+    Requests are grouped by API version and packed into JSON $batch calls of up
+    to 20 sub-requests, which are sent concurrently. Sub-requests that come back
+    throttled or failed are re-batched through the shared retry scheduler.
+    GET sub-requests are answered from the response cache when fresh, and wait
+    for an identical request already in flight (batched or not) instead of
+    being sent again.
+
+    Args:
+        requests: List of dicts with a Graph 'url' (e.g. '/beta/deviceManagement/...')
+            and optional 'method', 'params', 'headers' and 'body'
+
+    Returns:
+        List of httpx.Response objects in the same order as the requests
+    """
+    graph = get_graph_client()
+    loop = asyncio.get_running_loop()
+    futures = []
+    claimed = {}
+    upstream = []
+
+    # Keys are built before anything is claimed: no await may come between a
+    # claim and the send that resolves it, or a cancellation would strand it
+    keyed = []
+    for request in requests:
+        key = url = None
+        if request.get("method", "GET") == "GET" and request.get("body") is None:
+            url = graph.url(request["url"])
+            if request.get("params"):
+                url = str(httpx.URL(url).copy_merge_params(request["params"]))
+            key = await read_key(url, request.get("headers"))
+        keyed.append((request, key, url))
+
+    for request, key, url in keyed:
+        stale = None
+        if key is None:
+            future = loop.create_future()
+        else:
+            cached, stale = response_cache.lookup(key)
+            if cached is not None:
+                future = loop.create_future()
+                future.set_result(cached)
+                futures.append(future)
+                continue
+            future = single_flight.get(key) or claimed.get(key)
+            if future is not None:
+                futures.append(future)
+                continue
+            future = claimed[key] = single_flight.claim(key)
+            if stale is not None:
+                request = {**request, "headers": {**(request.get("headers") or {}), "If-None-Match": stale["etag"]}}
+        futures.append(future)
+        upstream.append((request, future, key, url, stale))
+
+    def resolve(sending):
+        for position, (_, future, key, url, stale) in enumerate(upstream):
+            if sending.cancelled():
+                future.cancel()
+            elif sending.exception() is not None:
+                future.set_exception(sending.exception())
+            elif key is not None:
+                future.set_result(response_cache.update(key, url, sending.result()[position], stale))
+            else:
+                future.set_result(sending.result()[position])
+
+    if upstream:
+        # Sent as its own task so other callers sharing these requests still get
+        # their responses if this caller is cancelled
+        sending = asyncio.ensure_future(_send_batch_rounds([request for request, *_ in upstream]))
+        sending.add_done_callback(resolve)
+
+    return [await asyncio.shield(future) for future in futures]
+
+async def _send_batch_rounds(requests):
+    """Sends requests as $batch calls, re-batching retryable sub-responses."""
+    responses = [None] * len(requests)
+    pending = list(range(len(requests)))
+    attempt = 0
+
+    while True:
+        batch_failed = await _send_batches(requests, pending, responses)
+
+        delays = {}
+        for index in pending:
+            if index in batch_failed:
+                # graph.post already retried the $batch call itself
+                continue
+            method = requests[index].get("method", "GET")
+            delay = retry_scheduler.delay_for(attempt, responses[index], method in retry_scheduler.IDEMPOTENT_METHODS)
+            # Every retried sub-request takes its own retry from the budget
+            if delay is not None and retry_scheduler.acquire():
+                delays[index] = delay
+
+        if not delays:
+            return responses
+
+        await retry_scheduler.wait(max(delays.values()))
+        pending = list(delays)
+        attempt += 1
+
+async def _send_batches(requests, indices, responses):
+    """Sends one round of $batch calls for the given request indices.
+
+    Returns the indices whose $batch call itself failed.
+    """
+    graph = get_graph_client()
+    batch_failed = set()
+
+    by_version = {}
+    for index in indices:
+        version, _ = _split_version(requests[index]["url"])
+        by_version.setdefault(version, []).append(index)
+
+    async def send(version, chunk):
+        sub_requests = []
+        for index in chunk:
+            request = requests[index]
+            url = request["url"]
+            if request.get("params"):
+                url = str(httpx.URL(url).copy_merge_params(request["params"]))
+            sub_request = {
+                "id": str(index),
+                "method": request.get("method", "GET"),
+                "url": _split_version(url)[1]
+            }
+            headers = dict(request.get("headers") or {})
+            if request.get("body") is not None:
+                sub_request["body"] = request["body"]
+                headers.setdefault("Content-Type", "application/json")
+            if headers:
+                sub_request["headers"] = headers
+            sub_requests.append(sub_request)
+
+        # The $batch POST is only as safe to repeat as the sub-requests it carries
+        idempotent = all(sub_request["method"] in retry_scheduler.IDEMPOTENT_METHODS for sub_request in sub_requests)
+        response = await graph.post(f"/{version}/$batch", json={"requests": sub_requests}, idempotent=idempotent)
+        if response.status_code != 200:
+            # The batch itself failed, so every sub-request shares its error
+            for index in chunk:
+                responses[index] = response
+            batch_failed.update(chunk)
+            return
+
+        answered = set()
+        for item in response.json().get("responses", []):
+            if "body" in item:
+                sub_response = httpx.Response(item.get("status", 500), headers=item.get("headers"), json=item["body"])
+            else:
+                sub_response = httpx.Response(item.get("status", 500), headers=item.get("headers"))
+            responses[int(item["id"])] = sub_response
+            answered.add(int(item["id"]))
+
+        # A sub-request missing from the reply is treated as a gateway error, so
+        # it is retried like one (GETs only: a write may have been applied)
+        for index in chunk:
+            if index not in answered:
+                responses[index] = httpx.Response(502, json={"error": {
+                    "code": "MissingBatchResponse",
+                    "message": "The $batch reply did not include a response for this request"
+                }})
+
+    await asyncio.gather(*(
+        send(version, members[start:start + GRAPH_BATCH_LIMIT])
+        for version, members in by_version.items()
+        for start in range(0, len(members), GRAPH_BATCH_LIMIT)
+    ))
+    return batch_failed
+
+# Graph paths whose server-side isof() $filter was rejected; they are filtered client-side
+_type_filter_unsupported = set()
+
+def type_filter_params(path, types, params=None):
+    """Adds an isof() $filter for the given entity types to a collection query.
+
+    Endpoints that rejected the filter before are left unfiltered so the caller
+    falls back to client-side filtering without another failed round trip.
+
+    Args:
+        path: Graph collection path the parameters are for
+        types: Entity type names (e.g. 'iosCompliancePolicy')
+        params: Optional query parameters to extend
+    """
+    params = dict(params or {})
+    if path not in _type_filter_unsupported:
+        params["$filter"] = " or ".join(f"isof('microsoft.graph.{type_name}')" for type_name in types)
+    return params
+
+async def batch_requests_with_filter_fallback(requests):
+    """Sends requests like batch_requests, retrying rejected $filter queries without the filter.
+
+    A 400 response to a filtered request marks its endpoint as not supporting
+    the filter, so later calls skip straight to the unfiltered query.
+    """
+    responses = await batch_requests(requests)
+
+    fallback = []
+    for index, (request, response) in enumerate(zip(requests, responses)):
+        params = request.get("params") or {}
+        if response.status_code == 400 and "$filter" in params:
+            _type_filter_unsupported.add(request["url"])
+            unfiltered = {key: value for key, value in params.items() if key != "$filter"}
+            fallback.append((index, {**request, "params": unfiltered}))
+
+    if fallback:
+        retried = await batch_requests([request for _, request in fallback])
+        for (index, _), response in zip(fallback, retried):
+            responses[index] = response
+
+    return responses
+
+class CollectionSync:
+    """Local copy of a Graph collection that is brought up to date incrementally.
+
+    Subclasses decide which request fetches the changes since the last sync;
+    items are stored raw (only the selected properties) and projected on read.
+
+    Args:
+        path: Graph collection path
+        fields: Projected fields; their names are sent as $select
+    """
+
+    def __init__(self, path, fields):
+        self.path = path
+        self.fields = fields
+        self.items = {}
+        self.synced_at = None
+        self.changed_ids = set()
+        self.removed_ids = set()
+        self._lock = None
+
+    @property
+    def ready(self):
+        """True once a full sync has completed."""
+        return self.synced_at is not None
+
+    def values(self):
+        return self.items.values()
+
+    async def sync(self, page_size=None):
+        """Brings the local copy up to date; returns the sync mode and number of changes."""
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            self.changed_ids = set()
+            self.removed_ids = set()
+            return await self._sync(page_size)
+
+    async def _pull(self, url, params, items, headers=None):
+        """Applies every page of a (delta) response to items; returns (changes, final page)."""
+        graph = get_graph_client()
+        changes = 0
+        while True:
+            response = await graph.get(url, params=params, headers=headers)
+            if response.status_code != 200:
+                raise GraphAPIError(response)
+
+            result = response.json()
+            for item in result.get("value", []):
+                changes += 1
+                self._apply(items, item)
+
+            url = result.get("@odata.nextLink")
+            params = None
+            if not url:
+                return changes, result
+
+    def _apply(self, items, item):
+        """Applies one changed or removed item from a (delta) page to items."""
+        if "@removed" in item:
+            items.pop(item["id"], None)
+            self.changed_ids.discard(item["id"])
+            self.removed_ids.add(item["id"])
+        else:
+            # Delta pages may only carry the properties that changed
+            items.setdefault(item["id"], {}).update(item)
+            self.changed_ids.add(item["id"])
+
+class DeltaSync(CollectionSync):
+    """Collection kept current with a Graph delta query (e.g. users/delta, groups/delta).
+
+    The first sync pages through the whole collection and keeps the returned
+    deltaLink; later syncs only fetch what changed since then. An expired
+    delta token (410 Gone) falls back to a full sync.
+    """
+
+    def __init__(self, path, fields):
+        super().__init__(path, fields)
+        self.delta_link = None
+
+    async def _sync(self, page_size=None):
+        headers = {"Prefer": f"odata.maxpagesize={page_size}"} if page_size else None
+
+        if self.delta_link:
+            try:
+                changes, result = await self._pull(self.delta_link, None, self.items, headers)
+                self.delta_link = result.get("@odata.deltaLink", self.delta_link)
+                self.synced_at = time.time()
+                return {"mode": "delta", "changes": changes}
+            except GraphAPIError as error:
+                if error.status_code != 410:
+                    raise
+
+        # Built aside so readers keep the previous copy until the full sync completes
+        items = {}
+        changes, result = await self._pull(f"{self.path}/delta", select_params(self.fields), items, headers)
+        self.items = items
+        self.delta_link = result.get("@odata.deltaLink")
+        self.synced_at = time.time()
+        return {"mode": "full", "changes": changes}
+
+class WatermarkSync(CollectionSync):
+    """Collection without delta support kept current through a modified-time watermark.
+
+    Incremental syncs only request items whose watermark field is at or after
+    the newest value seen. Deletions are not visible that way, so a full sync
+    runs again once resync_interval seconds have passed.
+
+    Args:
+        path: Graph collection path
+        fields: Projected fields; must include watermark_field
+        watermark_field: DateTimeOffset property that moves forward on change
+        resync_interval: Seconds between full syncs
+    """
+
+    def __init__(self, path, fields, watermark_field, resync_interval=3600.0):
+        super().__init__(path, fields)
+        self.watermark_field = watermark_field
+        self.resync_interval = resync_interval
+        self.watermark = None
+        self.full_synced_at = None
+
+    async def _sync(self, page_size=None):
+        params = select_params(self.fields)
+        if page_size:
+            params["$top"] = page_size
+
+        full = self.watermark is None or time.monotonic() - self.full_synced_at >= self.resync_interval
+        if full:
+            items = {}
+        else:
+            items = self.items
+            params["$filter"] = f"{self.watermark_field} ge {self.watermark}"
+
+        changes, _ = await self._pull(self.path, params, items)
+        self.items = items
+        # ISO 8601 timestamps in UTC compare correctly as strings
+        seen = [item[self.watermark_field] for item in items.values() if item.get(self.watermark_field)]
+        if seen:
+            self.watermark = max(seen)
+        if full:
+            self.full_synced_at = time.monotonic()
+        self.synced_at = time.time()
+        return {"mode": "full" if full else "incremental", "changes": changes}
+
+class GroupMembershipSync(DeltaSync):
+    """In-memory graph of direct group memberships, kept current with groups/delta.
+
+    groups/delta with $select=members reports member additions and removals
+    (members@delta), so after the first full pull only changed memberships
+    are fetched. Directory object ids are interned to integers and each
+    group's direct members are kept as an array of those integers; a
+    member -> groups index is rebuilt lazily after changes. Nested
+    membership, reverse lookups and flattening are answered from memory.
+
+    Args:
+        ttl: Seconds an answer may be served before the graph is synced again
+    """
+
+    def __init__(self, ttl=300.0):
+        super().__init__("/v1.0/groups", ("id", "displayName", "members"))
+        self.ttl = ttl
+        self.ids = []
+        self.types = []
+        self.index = {}
+        self._touched = {}
+        self._touched_items = None
+        self._parents = None
+        self._checked_at = None
+
+    def intern(self, object_id, object_type=None):
+        """Returns the integer for a directory object id, recording its type."""
+        number = self.index.get(object_id)
+        if number is None:
+            number = self.index[object_id] = len(self.ids)
+            self.ids.append(object_id)
+            self.types.append(object_type)
+        elif object_type and not self.types[number]:
+            self.types[number] = object_type
+        return number
+
+    def _apply(self, items, item):
+        if items is not self._touched_items:
+            # A full sync (first, or after an expired token) starts from empty sets
+            self._touched = {}
+            self._touched_items = items
+        changes = item.pop("members@delta", None)
+        group = self.intern(item["id"], "group")
+        if "@removed" in item:
+            self._touched.pop(group, None)
+        elif changes is not None:
+            members = self._touched.get(group)
+            if members is None:
+                members = self._touched[group] = set(items.get(item["id"], {}).get("_members", ()))
+            for member in changes:
+                number = self.intern(member["id"], member.get("@odata.type", "").rsplit(".", 1)[-1] or None)
+                if "@removed" in member:
+                    members.discard(number)
+                else:
+                    members.add(number)
+        super()._apply(items, item)
+
+    async def _sync(self, page_size=None):
+        if not GRAPH_DELTA_SYNC:
+            self.delta_link = None
+        self._touched = {}
+        self._touched_items = None
+        status = await super()._sync(page_size)
+        for group, members in self._touched.items():
+            item = self.items.get(self.ids[group])
+            if item is not None:
+                item["_members"] = array("l", sorted(members))
+        self._touched = {}
+        self._touched_items = None
+        if status["changes"]:
+            self._parents = None
+        return status
+
+    async def refresh(self, force=False):
+        """Syncs when forced or when the graph is older than the TTL; returns the sync status."""
+        if not force and self._checked_at is not None and time.monotonic() - self._checked_at < self.ttl:
+            return {"mode": "cached", "changes": 0, "age_seconds": round(time.monotonic() - self._checked_at)}
+        status = await self.sync()
+        self._checked_at = time.monotonic()
+        return status
+
+    def direct_members(self, group):
+        item = self.items.get(self.ids[group])
+        return item.get("_members", ()) if item else ()
+
+    def parents(self, member):
+        """Groups that directly contain the member (by interned integer)."""
+        if self._parents is None:
+            parents = {}
+            for item in self.items.values():
+                group = self.index[item["id"]]
+                for number in item.get("_members", ()):
+                    parents.setdefault(number, []).append(group)
+            self._parents = parents
+        return self._parents.get(member, ())
+
+    def membership_path(self, member, group):
+        """Returns the chain of groups from group down to member, or None if not a member."""
+        previous = {member: None}
+        queue = deque([member])
+        while queue:
+            current = queue.popleft()
+            for parent in self.parents(current):
+                if parent in previous:
+                    continue
+                previous[parent] = current
+                if parent == group:
+                    path = [parent]
+                    while path[-1] != member:
+                        path.append(previous[path[-1]])
+                    return path
+                queue.append(parent)
+        return None
+
+    def containing_groups(self, member, transitive=True):
+        """Returns {group: depth} for the groups containing member (depth 1 = direct)."""
+        depths = {}
+        frontier = [member]
+        depth = 0
+        while frontier and (transitive or depth < 1):
+            depth += 1
+            next_frontier = []
+            for current in frontier:
+                for parent in self.parents(current):
+                    if parent not in depths:
+                        depths[parent] = depth
+                        next_frontier.append(parent)
+            frontier = next_frontier
+        return depths
+
+    def flatten(self, group):
+        """Returns (members, nested groups) reachable from group, each as {integer: depth}."""
+        members = {}
+        groups = {group: 0}
+        frontier = [group]
+        depth = 0
+        while frontier:
+            depth += 1
+            next_frontier = []
+            for current in frontier:
+                for number in self.direct_members(current):
+                    if self.types[number] == "group":
+                        if number not in groups:
+                            groups[number] = depth
+                            next_frontier.append(number)
+                    elif number not in members:
+                        members[number] = depth
+            frontier = next_frontier
+        del groups[group]
+        return members, groups
+
+    def stats(self):
+        return {
+            "groups": len(self.items),
+            "objects": len(self.ids),
+            "memberships": sum(len(item.get("_members", ())) for item in self.items.values())
+        }
+
+GRAPH_DELTA_SYNC = os.getenv("GRAPH_DELTA_SYNC", "true").lower() == "true"
+
+# Collections served from a local copy; built lazily per signed-in principal
+COLLECTION_SYNCS = {
+    "users": lambda: DeltaSync("/v1.0/users", USER_FIELDS),
+    "groups": lambda: DeltaSync("/v1.0/groups", GROUP_FIELDS),
+    "group_memberships": lambda: GroupMembershipSync(ttl=float(os.getenv("GROUP_MEMBERSHIP_TTL", "300"))),
+    "devices": lambda: WatermarkSync(
+        "/v1.0/deviceManagement/managedDevices",
+        MANAGED_DEVICE_FIELDS,
+        "lastSyncDateTime",
+        resync_interval=float(os.getenv("GRAPH_DEVICE_RESYNC_INTERVAL", "3600"))
+    )
+}
+
+_collection_syncs = {}
+
+async def collection_sync(name):
+    """Returns the sync engine for a collection in COLLECTION_SYNCS for the current principal."""
+    key = (name, token_principal(await get_access_token()))
+    if key not in _collection_syncs:
+        _collection_syncs[key] = COLLECTION_SYNCS[name]()
+    return _collection_syncs[key]
+
+class InventoryMirror:
+    """Local SQLite copy of tool results, so filtered and aggregated questions
+    can be answered without pulling whole collections from Graph.
+
+    Each table holds the projected fields of one tool family; `_sync_state`
+    records when each table was last written and how many rows it holds.
+    The database is a cache: a table whose columns changed is rebuilt.
+
+    Args:
+        path: SQLite database file
+        tables: Mapping of table name to (columns, indexed columns)
+    """
+
+    FILTER_OPERATORS = {"eq": "=", "ne": "!=", "gt": ">", "ge": ">=", "lt": "<", "le": "<=", "like": "LIKE"}
+
+    def __init__(self, path, tables):
+        self.tables = tables
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        with self._lock, self._db:
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS "_sync_state" '
+                '(table_name TEXT PRIMARY KEY, synced_at TEXT, row_count INTEGER)'
+            )
+            for table, (columns, indexes) in tables.items():
+                existing = [row["name"] for row in self._db.execute(f'PRAGMA table_info("{table}")')]
+                if existing and existing != list(columns):
+                    self._db.execute(f'DROP TABLE "{table}"')
+                    self._db.execute('DELETE FROM "_sync_state" WHERE table_name = ?', (table,))
+                column_sql = ", ".join(f'"{column}"' + (" PRIMARY KEY" if column == "id" else "") for column in columns)
+                self._db.execute(f'CREATE TABLE IF NOT EXISTS "{table}" ({column_sql})')
+                for column in indexes:
+                    self._db.execute(f'CREATE INDEX IF NOT EXISTS "ix_{table}_{column}" ON "{table}" ("{column}")')
+
+    def write(self, table, rows, removed_ids=(), replace=False, scope=None):
+        """Upserts rows into a table and refreshes its freshness record.
+
+        Args:
+            table: Table name
+            rows: Projected items to insert or replace
+            removed_ids: Ids to delete
+            replace: Delete the existing rows (within scope) first
+            scope: Optional (column, value) limiting replace to part of the table
+        """
+        columns = self.tables[table][0]
+        placeholders = ", ".join("?" for _ in columns)
+        values = [
+            tuple(
+                json.dumps(row.get(column)) if isinstance(row.get(column), (list, dict)) else row.get(column)
+                for column in columns
+            )
+            for row in rows
+        ]
+        with self._lock, self._db:
+            if replace and scope:
+                self._db.execute(f'DELETE FROM "{table}" WHERE "{scope[0]}" = ?', (scope[1],))
+            elif replace:
+                self._db.execute(f'DELETE FROM "{table}"')
+            self._db.executemany(f'DELETE FROM "{table}" WHERE id = ?', [(item_id,) for item_id in removed_ids])
+            self._db.executemany(f'INSERT OR REPLACE INTO "{table}" VALUES ({placeholders})', values)
+            row_count = self._db.execute(f'SELECT COUNT(*) FROM "{table}"').fetchone()[0]
+            self._db.execute(
+                'INSERT OR REPLACE INTO "_sync_state" VALUES (?, ?, ?)',
+                (table, datetime.now(timezone.utc).isoformat(timespec="seconds"), row_count)
+            )
+
+    def query(self, table, columns=None, filters=None, group_by=None, order_by=None, descending=False, limit=100):
+        """Runs a filtered (and optionally grouped) query against a mirrored table.
+
+        Column names are checked against the table definition; values are
+        always bound as parameters.
+        """
+        if table not in self.tables:
+            raise ValueError(f"Unknown table '{table}'. Available: {', '.join(self.tables)}")
+        known = self.tables[table][0]
+        for column in [*(columns or []), *(filters or {}), *([group_by] if group_by else [])]:
+            if column not in known:
+                raise ValueError(f"Unknown column '{column}' for table '{table}'. Available: {', '.join(known)}")
+        # 'count' only exists as the group size; elsewhere SQLite would read "count" as a string
+        sortable = (*known, "count") if group_by else known
+        if order_by and order_by not in sortable:
+            raise ValueError(f"Unknown column '{order_by}' for table '{table}'. Available: {', '.join(sortable)}")
+
+        clauses, parameters = [], []
+        for column, condition in (filters or {}).items():
+            if not isinstance(condition, dict):
+                condition = {"eq": condition}
+            for operator, value in condition.items():
+                if operator not in self.FILTER_OPERATORS:
+                    raise ValueError(f"Unknown operator '{operator}'. Available: {', '.join(self.FILTER_OPERATORS)}")
+                if value is None:
+                    clauses.append(f'"{column}" IS {"NOT " if operator == "ne" else ""}NULL')
+                elif isinstance(value, list):
+                    if operator not in ("eq", "ne"):
+                        raise ValueError(f"Operator '{operator}' takes a single value; only eq and ne accept a list")
+                    clauses.append(f'"{column}" {"NOT " if operator == "ne" else ""}IN ({", ".join("?" for _ in value)})')
+                    parameters.extend(value)
+                else:
+                    clauses.append(f'"{column}" {self.FILTER_OPERATORS[operator]} ?')
+                    parameters.append(value)
+        where = f" WHERE {' AND '.join(clauses)}" if clauses else ""
+
+        if group_by:
+            sql = f'SELECT "{group_by}", COUNT(*) AS count FROM "{table}"{where} GROUP BY "{group_by}"'
+            order_by = order_by or "count"
+            descending = descending or order_by == "count"
+        else:
+            selected = ", ".join(f'"{column}"' for column in columns) if columns else "*"
+            sql = f'SELECT {selected} FROM "{table}"{where}'
+        if order_by:
+            sql += f' ORDER BY "{order_by}"{" DESC" if descending else ""}'
+
+        with self._lock:
+            total = None
+            if not group_by:
+                total = self._db.execute(f'SELECT COUNT(*) FROM "{table}"{where}', parameters).fetchone()[0]
+            rows = [dict(row) for row in self._db.execute(f"{sql} LIMIT ?", [*parameters, limit])]
+            state = self._db.execute('SELECT synced_at, row_count FROM "_sync_state" WHERE table_name = ?', (table,)).fetchone()
+
+        result = {"table": table, "rows": rows, "count": len(rows)}
+        if total is not None:
+            result["total_matches"] = total
+        result["freshness"] = self._freshness(state)
+        return result
+
+    def freshness(self):
+        """Returns the freshness record of every table."""
+        with self._lock:
+            states = {row["table_name"]: row for row in self._db.execute('SELECT * FROM "_sync_state"')}
+        return {table: self._freshness(states.get(table)) for table in self.tables}
+
+    def _freshness(self, state):
+        if state is None:
+            return {"synced_at": None, "row_count": 0, "age_seconds": None}
+        age = datetime.now(timezone.utc) - datetime.fromisoformat(state["synced_at"])
+        return {"synced_at": state["synced_at"], "row_count": state["row_count"], "age_seconds": int(age.total_seconds())}
+
+INVENTORY_DB_PATH = os.getenv("INVENTORY_DB_PATH")
+
+_inventory = None
+
+def get_inventory():
+    """Returns the inventory mirror, or None when INVENTORY_DB_PATH is not set."""
+    global _inventory
+    if _inventory is None and INVENTORY_DB_PATH:
+        _inventory = InventoryMirror(INVENTORY_DB_PATH, INVENTORY_TABLES)
+    return _inventory
+
+async def mirror_rows(table, rows, removed_ids=(), replace=True, scope=None):
+    """Writes tool results to the inventory mirror if it is enabled."""
+    inventory = get_inventory()
+    if inventory is not None:
+        await asyncio.to_thread(inventory.write, table, rows, removed_ids, replace, scope)
+
+async def mirror_sync(table, sync, status, fields):
+    """Mirrors a collection sync: everything after a full sync, only the changes otherwise."""
+    if get_inventory() is None:
+        return
+    if status["mode"] == "full":
+        await mirror_rows(table, [project(item, fields) for item in sync.values()])
+    elif sync.changed_ids or sync.removed_ids:
+        rows = [project(sync.items[item_id], fields) for item_id in sync.changed_ids]
+        await mirror_rows(table, rows, sync.removed_ids, replace=False)
 
 @mcp.tool()
-def create_user(display_name: str, mail_nickname: str, user_principal_name: str):
+async def create_user(display_name: str, mail_nickname: str, user_principal_name: str):
     """Creates a user in Microsoft Entra ID."""
-    access_token = get_access_token()
-    
-    headers = {
-        "Authorization": f"Bearer {access_token}",
-        "Content-Type": "application/json"
-    }
+    graph = get_graph_client()
     
     body = {
         "accountEnabled": True,
@@ -86,11 +1658,7 @@ def create_user(display_name: str, mail_nickname: str, user_principal_name: str)
         }
     }
     
-    response = requests.post(
-        "https://graph.microsoft.com/v1.0/users",
-        headers=headers,
-        json=body
-    )
+    response = await graph.post("/v1.0/users", json=body)
     
     if response.status_code == 201:
         result = response.json()
@@ -103,392 +1671,819 @@ def create_user(display_name: str, mail_nickname: str, user_principal_name: str)
     else:
         return {"error": response.text, "status_code": response.status_code}
 
+# Properties create_users_bulk copies from each row into the new user
+USER_CREATE_PROPERTIES = (
+    "displayName",
+    "userPrincipalName",
+    "mailNickname",
+    "givenName",
+    "surname",
+    "jobTitle",
+    "department",
+    "companyName",
+    "employeeId",
+    "officeLocation",
+    "city",
+    "country",
+    "mobilePhone",
+    "usageLocation"
+)
+
+# Graph accepts at most 15 values in a single 'in' filter
+UPN_FILTER_CHUNK = 15
+
+def generate_password(length=16):
+    """Returns a random password with upper- and lowercase letters, digits and symbols."""
+    classes = (string.ascii_uppercase, string.ascii_lowercase, string.digits, "!@#$%^&*-_=+?")
+    characters = [secrets.choice(chars) for chars in classes]
+    alphabet = "".join(classes)
+    characters += [secrets.choice(alphabet) for _ in range(length - len(characters))]
+    secrets.SystemRandom().shuffle(characters)
+    return "".join(characters)
+
+def user_create_body(row, force_change_password=True):
+    """Builds the POST /users body for one bulk row and returns (body, password).
+
+    Raises ValueError when the row has no usable userPrincipalName.
+    """
+    if not isinstance(row, dict):
+        raise ValueError("Each user must be an object with a userPrincipalName")
+    upn = str(row.get("userPrincipalName") or "").strip()
+    if "@" not in upn:
+        raise ValueError("userPrincipalName is required (user@domain)")
+    
+    body = {}
+    for name in USER_CREATE_PROPERTIES:
+        value = row.get(name)
+        if value not in (None, ""):
+            body[name] = value.strip() if isinstance(value, str) else value
+    body["userPrincipalName"] = upn
+    body.setdefault("displayName", upn.split("@")[0])
+    body.setdefault("mailNickname", "".join(c for c in upn.split("@")[0] if c.isalnum() or c in "-_.") or "user")
+    body["accountEnabled"] = str(row.get("accountEnabled", True)).lower() not in ("false", "0", "no")
+    
+    password = str(row.get("password") or "") or generate_password()
+    body["passwordProfile"] = {
+        "forceChangePasswordNextSignIn": force_change_password,
+        "password": password
+    }
+    return body, password
+
+async def existing_user_principal_names(upns, concurrency=None):
+    """Returns {lowercased UPN: user id} for the given UPNs that already exist.
+
+    UPNs are looked up 15 per 'in' filter, with the filters sent through $batch
+    calls of which at most concurrency are in flight. Raises GraphAPIError if a
+    lookup fails.
+    """
+    requests = []
+    for start in range(0, len(upns), UPN_FILTER_CHUNK):
+        values = ",".join("'" + upn.replace("'", "''") + "'" for upn in upns[start:start + UPN_FILTER_CHUNK])
+        requests.append({
+            "url": "/v1.0/users",
+            "params": {"$filter": f"userPrincipalName in ({values})", "$select": "id,userPrincipalName"}
+        })
+    
+    chunks = [requests[start:start + GRAPH_BATCH_LIMIT] for start in range(0, len(requests), GRAPH_BATCH_LIMIT)]
+    existing = {}
+    for responses in await fan_out(chunks, batch_requests, concurrency):
+        for response in responses:
+            if response.status_code != 200:
+                raise GraphAPIError(response)
+            for user in response.json().get("value", []):
+                existing[user["userPrincipalName"].lower()] = user["id"]
+    return existing
+
 @mcp.tool()
-def list_intune_devices():
-    """Lists Intune-managed devices from your tenant."""
-    access_token = get_access_token()
+async def create_users_bulk(
+    users: Optional[list] = None,
+    location_type: str = "",
+    location_id: str = "",
+    file_id: str = "",
+    force_change_password: bool = True,
+    concurrency: Optional[int] = None,
+    return_passwords: bool = False
+):
+    """Creates many users in Microsoft Entra ID in one call.
+    
+    Users come either from a list or from a CSV file in OneDrive/SharePoint
+    whose header names the properties. Users whose UPN already exists are
+    skipped, so a rerun only creates what is missing. Creations are sent
+    through $batch (20 per call) with bounded concurrency, and throttled
+    requests are retried after Graph's Retry-After.
     
-    headers = {
-        "Authorization": f"Bearer {access_token}",
-        "Content-Type": "application/json"
+    Args:
+        users: List of dicts with userPrincipalName and optionally displayName,
+            mailNickname, givenName, surname, jobTitle, department, companyName,
+            employeeId, officeLocation, city, country, mobilePhone, usageLocation,
+            accountEnabled and password (a random password is generated if omitted)
+        location_type: Either 'onedrive' or 'sharepoint' (when reading a CSV file)
+        location_id: User ID for OneDrive, or Site ID for SharePoint (when reading a CSV file)
+        file_id: ID of a CSV file with the same columns, used instead of users
+        force_change_password: Require a password change at first sign-in
+        concurrency: Maximum $batch calls in flight (defaults to GRAPH_FANOUT_CONCURRENCY)
+        return_passwords: Include each created user's initial password in the results;
+            otherwise passwords are never returned and generated ones must be reset
+            before the accounts are handed out
+    
+    Returns:
+        Per-row results (created with id, exists, duplicate, invalid or failed)
+        with counts, elapsed time and creation rate
+    """
+    started = time.monotonic()
+    throttled_before = retry_scheduler.throttled_responses
+    
+    if file_id:
+        users = []
+        header = None
+        blocks = iter_csv_file(location_type, location_id, file_id)
+        try:
+            async for block in blocks:
+                reader = csv.reader(io.StringIO(block, newline=""))
+                if header is None:
+                    header = [name.strip() for name in next(reader, [])]
+                users.extend(dict(zip(header, row)) for row in reader if row)
+        except GraphAPIError as error:
+            return error.to_dict()
+        finally:
+            await blocks.aclose()
+    
+    results = []
+    pending = []
+    seen = set()
+    for row_number, row in enumerate(users or [], start=1):
+        try:
+            body, password = user_create_body(row, force_change_password)
+        except (ValueError, AttributeError) as error:
+            results.append({"row": row_number, "status": "invalid", "error": str(error)})
+            continue
+        upn = body["userPrincipalName"]
+        if upn.lower() in seen:
+            results.append({"row": row_number, "userPrincipalName": upn, "status": "duplicate"})
+            continue
+        seen.add(upn.lower())
+        result = {"row": row_number, "userPrincipalName": upn}
+        results.append(result)
+        pending.append((result, body, password))
+    
+    try:
+        existing = await existing_user_principal_names(
+            [body["userPrincipalName"] for _, body, _ in pending], concurrency
+        )
+    except GraphAPIError as error:
+        return error.to_dict()
+    
+    to_create = []
+    for result, body, password in pending:
+        user_id = existing.get(body["userPrincipalName"].lower())
+        if user_id:
+            result.update(status="exists", id=user_id)
+        else:
+            to_create.append((result, body, password))
+    
+    async def create(chunk):
+        responses = await batch_requests([
+            {"method": "POST", "url": "/v1.0/users", "body": body}
+            for _, body, _ in chunk
+        ])
+        for (result, _, password), response in zip(chunk, responses):
+            if response.status_code == 201:
+                result.update(status="created", id=response.json().get("id"))
+                if return_passwords:
+                    result["password"] = password
+            elif response.status_code == 400 and "already exists" in response.text:
+                # Possibly created by a retried attempt whose response was lost,
+                # in which case its password is unknown
+                result.update(status="exists", note="Created concurrently or by a retried request; reset the password if needed")
+            else:
+                result.update(status="failed", error=response.text, status_code=response.status_code)
+    
+    chunks = [to_create[start:start + GRAPH_BATCH_LIMIT] for start in range(0, len(to_create), GRAPH_BATCH_LIMIT)]
+    await fan_out(chunks, create, concurrency)
+    
+    elapsed = time.monotonic() - started
+    counts = Counter(result["status"] for result in results)
+    return {
+        "results": results,
+        "total": len(results),
+        "counts": dict(counts),
+        "throttled_responses": retry_scheduler.throttled_responses - throttled_before,
+        "elapsed_seconds": round(elapsed, 2),
+        "created_per_second": round(counts["created"] / elapsed, 1) if elapsed else None
     }
+
+MANAGED_DEVICE_FIELDS = (
+    "id",
+    "deviceName",
+    "operatingSystem",
+    "osVersion",
+    "complianceState",
+    "managedDeviceOwnerType",
+    "userPrincipalName",
+    "enrolledDateTime",
+    "lastSyncDateTime"
+)
+
+@mcp.tool()
+async def list_intune_devices(page_size: Optional[int] = None, max_items: Optional[int] = None):
+    """Lists Intune-managed devices from your tenant.
     
-    response = requests.get(
-        "https://graph.microsoft.com/v1.0/deviceManagement/managedDevices",
-        headers=headers
-    )
+    After the first full listing, devices are served from a local copy that is
+    refreshed with a lastSyncDateTime watermark on every call.
     
-    if response.status_code == 200:
-        result = response.json()
-        devices = []
-        
-        for device in result.get("value", []):
-            devices.append({
-                "id": device.get("id"),
-                "deviceName": device.get("deviceName"),
-                "operatingSystem": device.get("operatingSystem"),
-                "osVersion": device.get("osVersion"),
-                "complianceState": device.get("complianceState"),
-                "managedDeviceOwnerType": device.get("managedDeviceOwnerType"),
-                "enrolledDateTime": device.get("enrolledDateTime"),
-                "lastSyncDateTime": device.get("lastSyncDateTime")
-            })
-        
-        return {"devices": devices, "count": len(devices)}
-    else:
-        return {"error": response.text, "status_code": response.status_code}
+    Args:
+        page_size: Optional number of devices to request per page
+        max_items: Optional cap on the number of devices returned (all pages are followed by default)
+    """
+    sync = await collection_sync("devices")
+    if GRAPH_DELTA_SYNC and (max_items is None or sync.ready):
+        try:
+            status = await sync.sync(page_size)
+        except GraphAPIError as error:
+            return error.to_dict()
+        await mirror_sync("devices", sync, status, MANAGED_DEVICE_FIELDS)
+        devices = [project(device, MANAGED_DEVICE_FIELDS) for device in islice(sync.values(), max_items)]
+        return {"devices": devices, "count": len(devices), "sync": status}
+    
+    devices = []
+    
+    try:
+        async for page in iter_pages("/v1.0/deviceManagement/managedDevices", params=select_params(MANAGED_DEVICE_FIELDS), page_size=page_size, max_items=max_items):
+            for device in page:
+                devices.append(project(device, MANAGED_DEVICE_FIELDS))
+    except GraphAPIError as error:
+        return error.to_dict()
+    
+    if max_items is None:
+        await mirror_rows("devices", devices)
+    
+    return {"devices": devices, "count": len(devices)}
+
+# Collections count_entities can aggregate: name -> (path, supports directory advanced queries)
+COUNTABLE_COLLECTIONS = {
+    "users": ("/v1.0/users", True),
+    "groups": ("/v1.0/groups", True),
+    "directory_devices": ("/v1.0/devices", True),
+    "devices": ("/v1.0/deviceManagement/managedDevices", False)
+}
+COUNT_PAGE_SIZE = 999
+ADVANCED_QUERY_HEADERS = {"ConsistencyLevel": "eventual"}
+
+# Graph paths that rejected a $count query or answered it without @odata.count;
+# they are counted by paging
+_count_unsupported = set()
+
+def odata_literal(value):
+    """Formats a Python value as an OData literal for $filter."""
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if value is None or isinstance(value, (int, float)):
+        return "null" if value is None else str(value)
+    return "'" + str(value).replace("'", "''") + "'"
+
+def group_key(value):
+    """Makes a property value usable as a counter key (collections become tuples)."""
+    return tuple(value) if isinstance(value, list) else value
+
+async def server_counts(path, filters):
+    """Asks Graph for the size of a collection under each $filter with $count.
+
+    Returns a list of counts in the order of filters, or None when the
+    collection does not report @odata.count or a request failed.
+    """
+    if path in _count_unsupported:
+        return None
+    requests = []
+    for odata_filter in filters:
+        params = {"$count": "true", "$top": 1, "$select": "id"}
+        if odata_filter:
+            params["$filter"] = odata_filter
+        requests.append({"url": path, "params": params, "headers": ADVANCED_QUERY_HEADERS})
+    
+    counts = []
+    for odata_filter, response in zip(filters, await batch_requests(requests)):
+        if response.status_code == 400 and not odata_filter:
+            # Only an unfiltered query shows $count itself is rejected, not the caller's filter
+            _count_unsupported.add(path)
+            return None
+        if response.status_code != 200:
+            return None
+        count = response.json().get("@odata.count")
+        if count is None:
+            _count_unsupported.add(path)
+            return None
+        counts.append(count)
+    return counts
+
+class GroupCounts:
+    """Counts items per value of each field and per combination of values.
+
+    Only the counters are kept, so memory grows with the number of distinct
+    values rather than the number of items.
+
+    Args:
+        fields: Property names to group by
+    """
+
+    def __init__(self, fields):
+        self.fields = fields
+        self.total = 0
+        self.by_field = [Counter() for _ in fields]
+        self.combined = Counter()
+
+    def add(self, items):
+        for item in items:
+            key = tuple(group_key(item.get(field)) for field in self.fields)
+            self.combined[key] += 1
+            for counter, value in zip(self.by_field, key):
+                counter[value] += 1
+            self.total += 1
+
+async def stream_counts(path, fields, odata_filter="", advanced=False):
+    """Counts a collection grouped by fields in one paged pass.
+
+    Only the grouped properties are selected, so pages stay small.
+
+    Returns:
+        Tuple of (GroupCounts, number of pages read)
+    """
+    counts = GroupCounts(fields)
+    params = {"$select": ",".join(("id",) + tuple(fields))}
+    headers = None
+    if odata_filter:
+        params["$filter"] = odata_filter
+        if advanced:
+            # Advanced directory filters (endswith, ne, not) need eventual consistency with $count
+            params["$count"] = "true"
+            headers = ADVANCED_QUERY_HEADERS
+    pages = 0
+    async for page in iter_pages(path, params=params, page_size=COUNT_PAGE_SIZE, headers=headers):
+        pages += 1
+        counts.add(page)
+    return counts, pages
+
+def ranked_counts(counter, max_groups=None):
+    """Returns (most common (value, count) pairs, count of the items left out)."""
+    ranked = counter.most_common(max_groups)
+    return ranked, sum(counter.values()) - sum(count for _, count in ranked)
+
+@mcp.tool()
+async def count_entities(entity: str, filter: str = "", group_by: str = "", values: Optional[list] = None, max_groups: Optional[int] = 50):
+    """Counts users, groups or devices, optionally per value of one or more properties, without returning the items.
+    
+    Uses Graph $count (ConsistencyLevel: eventual) where the collection supports it,
+    batching one filtered count per entry of values. Group-by without values, and
+    collections that do not report counts (Intune managed devices), are counted in
+    one paged pass that only selects the grouped properties.
+    
+    Args:
+        entity: One of 'users', 'groups', 'devices' (Intune managed devices) or 'directory_devices' (Entra ID devices)
+        filter: Optional OData $filter applied before counting (e.g. "accountEnabled eq true")
+        group_by: Optional comma-separated property names to group by (e.g. 'operatingSystem,complianceState')
+        values: Optional values of a single group_by property to count server-side, one filtered count each
+        max_groups: Maximum number of groups returned, largest first (the rest are summed in other_count)
+    """
+    if entity not in COUNTABLE_COLLECTIONS:
+        return {"error": f"Unknown entity '{entity}'", "available_entities": list(COUNTABLE_COLLECTIONS)}
+    path, advanced = COUNTABLE_COLLECTIONS[entity]
+    fields = tuple(field.strip() for field in group_by.split(",") if field.strip())
+    if values and len(fields) != 1:
+        return {"error": "values requires exactly one group_by property", "status_code": 400}
+    
+    result = {"entity": entity, "filter": filter, "group_by": list(fields)}
+    
+    # $count with ConsistencyLevel is a directory advanced query; other collections are paged
+    if advanced and (values or not fields):
+        filters = [filter]
+        for value in values or ():
+            condition = f"{fields[0]} eq {odata_literal(value)}"
+            filters.append(f"({filter}) and {condition}" if filter else condition)
+        counts = await server_counts(path, filters)
+        if counts is not None:
+            result.update(total=counts[0], mode="server", requests=len(filters))
+            if fields:
+                result["groups"] = [{fields[0]: value, "count": count} for value, count in zip(values, counts[1:])]
+                result["other_count"] = counts[0] - sum(counts[1:])
+            return result
+    
+    try:
+        counts, pages = await stream_counts(path, fields, filter, advanced)
+    except GraphAPIError as error:
+        return error.to_dict()
+    
+    result.update(total=counts.total, mode="stream", requests=pages)
+    if values:
+        listed = [counts.combined.get((group_key(value),), 0) for value in values]
+        result["groups"] = [{fields[0]: value, "count": count} for value, count in zip(values, listed)]
+        result["other_count"] = counts.total - sum(listed)
+    elif fields:
+        ranked, other = ranked_counts(counts.combined, max_groups)
+        result["groups"] = [dict(zip(fields, key), count=count) for key, count in ranked]
+        result["other_count"] = other
+        result["distinct_groups"] = len(counts.combined)
+    return result
 
 @mcp.tool()
-def list_intune_compliance_policies():
+async def summarize_devices(group_by: str = "operatingSystem,complianceState,managedDeviceOwnerType", filter: str = "", max_values: Optional[int] = 20):
+    """Summarizes Intune-managed devices as counts per property value, without returning the devices.
+    
+    Every property is counted in the same pass. When list_intune_devices has
+    already built the local device copy and no filter is given, the copy is
+    brought up to date and counted with no full listing; otherwise only the
+    grouped properties are paged from Graph.
+    
+    Args:
+        group_by: Comma-separated managed device properties to count (e.g. 'operatingSystem,osVersion')
+        filter: Optional OData $filter for managedDevices (e.g. "operatingSystem eq 'Windows'")
+        max_values: Maximum number of values listed per property, most common first
+    """
+    fields = tuple(field.strip() for field in group_by.split(",") if field.strip())
+    sync = await collection_sync("devices")
+    
+    try:
+        if GRAPH_DELTA_SYNC and sync.ready and not filter and set(fields) <= set(MANAGED_DEVICE_FIELDS):
+            status = await sync.sync()
+            counts = GroupCounts(fields)
+            counts.add(sync.values())
+            source = {"mode": "local", "sync": status}
+        else:
+            counts, pages = await stream_counts("/v1.0/deviceManagement/managedDevices", fields, filter)
+            source = {"mode": "stream", "requests": pages}
+    except GraphAPIError as error:
+        return error.to_dict()
+    
+    summary = {}
+    for field, counter in zip(fields, counts.by_field):
+        ranked, other = ranked_counts(counter, max_values)
+        summary[field] = {
+            "values": [{"value": value, "count": count} for value, count in ranked],
+            "other_count": other,
+            "distinct": len(counter)
+        }
+    
+    return {"total": counts.total, "filter": filter, "summary": summary, **source}
+
+POLICY_FIELDS = (
+    "id",
+    "displayName",
+    "description",
+    ("platform", odata_type_name),
+    "createdDateTime",
+    "lastModifiedDateTime",
+    "version"
+)
+
+@mcp.tool()
+async def list_intune_compliance_policies():
     """Lists all Intune device compliance policies."""
-    access_token = get_access_token()
+    policies = []
+    cache_statuses = []
     
-    headers = {
-        "Authorization": f"Bearer {access_token}",
-        "Content-Type": "application/json"
-    }
+    try:
+        async for page in iter_pages("/v1.0/deviceManagement/deviceCompliancePolicies", params=select_params(POLICY_FIELDS), cache_statuses=cache_statuses):
+            for policy in page:
+                policies.append(project(policy, POLICY_FIELDS))
+    except GraphAPIError as error:
+        return error.to_dict()
     
-    response = requests.get(
-        "https://graph.microsoft.com/v1.0/deviceManagement/deviceCompliancePolicies",
-        headers=headers
-    )
+    await mirror_rows("policies", [{**policy, "kind": "compliance"} for policy in policies], scope=("kind", "compliance"))
     
-    if response.status_code == 200:
-        result = response.json()
-        policies = []
-        
-        for policy in result.get("value", []):
-            policies.append({
-                "id": policy.get("id"),
-                "displayName": policy.get("displayName"),
-                "description": policy.get("description"),
-                "platform": policy.get("@odata.type", "").split('.')[-1],
-                "createdDateTime": policy.get("createdDateTime"),
-                "lastModifiedDateTime": policy.get("lastModifiedDateTime"),
-                "version": policy.get("version")
-            })
-        
-        return {"policies": policies, "count": len(policies)}
-    else:
-        return {"error": response.text, "status_code": response.status_code}
+    return {"policies": policies, "count": len(policies), "cache_status": combined_cache_status(cache_statuses)}
 
 @mcp.tool()
-def list_intune_configuration_policies():
+async def list_intune_configuration_policies():
     """Lists all Intune device configuration policies (settings)."""
-    access_token = get_access_token()
+    policies = []
     
-    headers = {
-        "Authorization": f"Bearer {access_token}",
-        "Content-Type": "application/json"
-    }
+    try:
+        async for page in iter_pages("/v1.0/deviceManagement/deviceConfigurations", params=select_params(POLICY_FIELDS)):
+            for policy in page:
+                policies.append(project(policy, POLICY_FIELDS))
+    except GraphAPIError as error:
+        return error.to_dict()
     
-    response = requests.get(
-        "https://graph.microsoft.com/v1.0/deviceManagement/deviceConfigurations",
-        headers=headers
-    )
+    await mirror_rows("policies", [{**policy, "kind": "configuration"} for policy in policies], scope=("kind", "configuration"))
     
-    if response.status_code == 200:
-        result = response.json()
-        policies = []
-        
-        for policy in result.get("value", []):
-            policies.append({
-                "id": policy.get("id"),
-                "displayName": policy.get("displayName"),
-                "description": policy.get("description"),
-                "platform": policy.get("@odata.type", "").split('.')[-1],
-                "createdDateTime": policy.get("createdDateTime"),
-                "lastModifiedDateTime": policy.get("lastModifiedDateTime"),
-                "version": policy.get("version")
-            })
-        
-        return {"policies": policies, "count": len(policies)}
-    else:
-        return {"error": response.text, "status_code": response.status_code}
+    return {"policies": policies, "count": len(policies)}
+
+ASSIGNMENT_FILTER_FIELDS = (
+    "id",
+    "displayName",
+    "description",
+    "platform",
+    "rule",
+    "createdDateTime",
+    "lastModifiedDateTime"
+)
 
 @mcp.tool()
-def list_intune_filters():
+async def list_intune_filters():
     """Lists all Intune assignment filters."""
-    access_token = get_access_token()
+    filters = []
+    cache_statuses = []
     
-    headers = {
-        "Authorization": f"Bearer {access_token}",
-        "Content-Type": "application/json"
-    }
-    
-    response = requests.get(
-        "https://graph.microsoft.com/beta/deviceManagement/assignmentFilters",
-        headers=headers
-    )
+    try:
+        async for page in iter_pages("/beta/deviceManagement/assignmentFilters", params=select_params(ASSIGNMENT_FILTER_FIELDS), cache_statuses=cache_statuses):
+            for filter_item in page:
+                filters.append(project(filter_item, ASSIGNMENT_FILTER_FIELDS))
+    except GraphAPIError as error:
+        return error.to_dict()
     
-    if response.status_code == 200:
-        result = response.json()
-        filters = []
-        
-        for filter_item in result.get("value", []):
-            filters.append({
-                "id": filter_item.get("id"),
-                "displayName": filter_item.get("displayName"),
-                "description": filter_item.get("description"),
-                "platform": filter_item.get("platform"),
-                "rule": filter_item.get("rule"),
-                "createdDateTime": filter_item.get("createdDateTime"),
-                "lastModifiedDateTime": filter_item.get("lastModifiedDateTime")
-            })
-        
-        return {"filters": filters, "count": len(filters)}
-    else:
-        return {"error": response.text, "status_code": response.status_code}
+    return {"filters": filters, "count": len(filters), "cache_status": combined_cache_status(cache_statuses)}
+
+POWERSHELL_SCRIPT_FIELDS = (
+    "id",
+    "displayName",
+    "description",
+    ("scriptType", lambda script: "PowerShell"),
+    "fileName",
+    "runAsAccount",
+    "enforceSignatureCheck",
+    "createdDateTime",
+    "lastModifiedDateTime"
+)
+
+SHELL_SCRIPT_FIELDS = (
+    "id",
+    "displayName",
+    "description",
+    ("scriptType", lambda script: "Shell"),
+    "fileName",
+    "runAsAccount",
+    "createdDateTime",
+    "lastModifiedDateTime"
+)
 
 @mcp.tool()
-def list_intune_scripts():
+async def list_intune_scripts():
     """Lists all Intune device management scripts (PowerShell and Shell scripts)."""
-    access_token = get_access_token()
+    ps_response, shell_response = await batch_requests([
+        {"url": "/beta/deviceManagement/deviceManagementScripts", "params": select_params(POWERSHELL_SCRIPT_FIELDS)},
+        {"url": "/beta/deviceManagement/deviceShellScripts", "params": select_params(SHELL_SCRIPT_FIELDS)}
+    ])
     
-    headers = {
-        "Authorization": f"Bearer {access_token}",
-        "Content-Type": "application/json"
-    }
+    scripts = []
+    cache_statuses = []
     
     # Get PowerShell scripts
-    ps_response = requests.get(
-        "https://graph.microsoft.com/beta/deviceManagement/deviceManagementScripts",
-        headers=headers
-    )
+    try:
+        async for page in iter_pages("/beta/deviceManagement/deviceManagementScripts", first_page=ps_response, cache_statuses=cache_statuses):
+            for script in page:
+                scripts.append(project(script, POWERSHELL_SCRIPT_FIELDS))
+    except GraphAPIError:
+        pass
     
     # Get Shell scripts (for macOS/Linux)
-    shell_response = requests.get(
-        "https://graph.microsoft.com/beta/deviceManagement/deviceShellScripts",
-        headers=headers
-    )
-    
-    scripts = []
-    
-    if ps_response.status_code == 200:
-        ps_result = ps_response.json()
-        for script in ps_result.get("value", []):
-            scripts.append({
-                "id": script.get("id"),
-                "displayName": script.get("displayName"),
-                "description": script.get("description"),
-                "scriptType": "PowerShell",
-                "fileName": script.get("fileName"),
-                "runAsAccount": script.get("runAsAccount"),
-                "enforceSignatureCheck": script.get("enforceSignatureCheck"),
-                "createdDateTime": script.get("createdDateTime"),
-                "lastModifiedDateTime": script.get("lastModifiedDateTime")
-            })
-    
-    if shell_response.status_code == 200:
-        shell_result = shell_response.json()
-        for script in shell_result.get("value", []):
-            scripts.append({
-                "id": script.get("id"),
-                "displayName": script.get("displayName"),
-                "description": script.get("description"),
-                "scriptType": "Shell",
-                "fileName": script.get("fileName"),
-                "runAsAccount": script.get("runAsAccount"),
-                "createdDateTime": script.get("createdDateTime"),
-                "lastModifiedDateTime": script.get("lastModifiedDateTime")
-            })
-    
-    return {"scripts": scripts, "count": len(scripts)}
+    try:
+        async for page in iter_pages("/beta/deviceManagement/deviceShellScripts", first_page=shell_response, cache_statuses=cache_statuses):
+            for script in page:
+                scripts.append(project(script, SHELL_SCRIPT_FIELDS))
+    except GraphAPIError:
+        pass
+    
+    return {"scripts": scripts, "count": len(scripts), "cache_status": combined_cache_status(cache_statuses)}
+
+MOBILE_APP_FIELDS = (
+    "id",
+    "displayName",
+    "description",
+    "publisher",
+    ("appType", odata_type_name),
+    "createdDateTime",
+    "lastModifiedDateTime",
+    "publishingState",
+    "isAssigned",
+    "isFeatured"
+)
 
 @mcp.tool()
-def list_intune_applications():
-    """Lists all Intune applications (mobile apps)."""
-    access_token = get_access_token()
-    
-    headers = {
-        "Authorization": f"Bearer {access_token}",
-        "Content-Type": "application/json"
-    }
+async def list_intune_applications(page_size: Optional[int] = None, max_items: Optional[int] = None):
+    """Lists all Intune applications (mobile apps).
     
-    response = requests.get(
-        "https://graph.microsoft.com/beta/deviceAppManagement/mobileApps",
-        headers=headers
-    )
-    
-    if response.status_code == 200:
-        result = response.json()
-        apps = []
-        
-        for app in result.get("value", []):
-            app_type = app.get("@odata.type", "").split('.')[-1]
-            apps.append({
-                "id": app.get("id"),
-                "displayName": app.get("displayName"),
-                "description": app.get("description"),
-                "publisher": app.get("publisher"),
-                "appType": app_type,
-                "createdDateTime": app.get("createdDateTime"),
-                "lastModifiedDateTime": app.get("lastModifiedDateTime"),
-                "publishingState": app.get("publishingState"),
-                "isAssigned": app.get("isAssigned"),
-                "isFeatured": app.get("isFeatured")
-            })
-        
-        return {"applications": apps, "count": len(apps)}
-    else:
-        return {"error": response.text, "status_code": response.status_code}
+    Args:
+        page_size: Optional number of applications to request per page
+        max_items: Optional cap on the number of applications returned (all pages are followed by default)
+    """
+    apps = []
+    
+    try:
+        async for page in iter_pages("/beta/deviceAppManagement/mobileApps", params=select_params(MOBILE_APP_FIELDS), page_size=page_size, max_items=max_items):
+            for app in page:
+                apps.append(project(app, MOBILE_APP_FIELDS))
+    except GraphAPIError as error:
+        return error.to_dict()
+    
+    return {"applications": apps, "count": len(apps)}
+
+AUTOPILOT_PROFILE_FIELDS = (
+    "id",
+    "displayName",
+    "description",
+    ("profileType", odata_type_name),
+    "createdDateTime",
+    "lastModifiedDateTime",
+    "outOfBoxExperienceSettings",
+    "enrollmentStatusScreenSettings",
+    "extractHardwareHash",
+    "deviceNameTemplate",
+    "deviceType",
+    "enableWhiteGlove"
+)
 
 @mcp.tool()
-def list_autopilot_profiles():
+async def list_autopilot_profiles():
     """Lists all Windows Autopilot deployment profiles."""
-    access_token = get_access_token()
-    
-    headers = {
-        "Authorization": f"Bearer {access_token}",
-        "Content-Type": "application/json"
-    }
+    profiles = []
+    cache_statuses = []
     
-    response = requests.get(
-        "https://graph.microsoft.com/beta/deviceManagement/windowsAutopilotDeploymentProfiles",
-        headers=headers
-    )
+    try:
+        async for page in iter_pages("/beta/deviceManagement/windowsAutopilotDeploymentProfiles", params=select_params(AUTOPILOT_PROFILE_FIELDS), cache_statuses=cache_statuses):
+            for profile in page:
+                profiles.append(project(profile, AUTOPILOT_PROFILE_FIELDS))
+    except GraphAPIError as error:
+        return error.to_dict()
     
-    if response.status_code == 200:
-        result = response.json()
-        profiles = []
-        
-        for profile in result.get("value", []):
-            profiles.append({
-                "id": profile.get("id"),
-                "displayName": profile.get("displayName"),
-                "description": profile.get("description"),
-                "profileType": profile.get("@odata.type", "").split('.')[-1],
-                "createdDateTime": profile.get("createdDateTime"),
-                "lastModifiedDateTime": profile.get("lastModifiedDateTime"),
-                "outOfBoxExperienceSettings": profile.get("outOfBoxExperienceSettings"),
-                "enrollmentStatusScreenSettings": profile.get("enrollmentStatusScreenSettings"),
-                "extractHardwareHash": profile.get("extractHardwareHash"),
-                "deviceNameTemplate": profile.get("deviceNameTemplate"),
-                "deviceType": profile.get("deviceType"),
-                "enableWhiteGlove": profile.get("enableWhiteGlove")
-            })
-        
-        return {"profiles": profiles, "count": len(profiles)}
-    else:
-        return {"error": response.text, "status_code": response.status_code}
+    return {"profiles": profiles, "count": len(profiles), "cache_status": combined_cache_status(cache_statuses)}
+
+AUTOPILOT_DEVICE_FIELDS = (
+    "id",
+    "serialNumber",
+    "model",
+    "manufacturer",
+    "productKey",
+    "groupTag",
+    "purchaseOrderIdentifier",
+    "enrollmentState",
+    "lastContactedDateTime",
+    "addressableUserName",
+    "userPrincipalName",
+    "resourceName",
+    "skuNumber",
+    "systemFamily",
+    "azureActiveDirectoryDeviceId",
+    "managedDeviceId",
+    "displayName"
+)
 
 @mcp.tool()
-def list_autopilot_devices():
-    """Lists all Windows Autopilot devices registered in the tenant."""
-    access_token = get_access_token()
+async def list_autopilot_devices(page_size: Optional[int] = None, max_items: Optional[int] = None):
+    """Lists all Windows Autopilot devices registered in the tenant.
     
-    headers = {
-        "Authorization": f"Bearer {access_token}",
-        "Content-Type": "application/json"
-    }
+    Args:
+        page_size: Optional number of devices to request per page
+        max_items: Optional cap on the number of devices returned (all pages are followed by default)
+    """
+    devices = []
     
-    response = requests.get(
-        "https://graph.microsoft.com/beta/deviceManagement/windowsAutopilotDeviceIdentities",
-        headers=headers
-    )
+    try:
+        async for page in iter_pages("/beta/deviceManagement/windowsAutopilotDeviceIdentities", params=select_params(AUTOPILOT_DEVICE_FIELDS), page_size=page_size, max_items=max_items):
+            for device in page:
+                devices.append(project(device, AUTOPILOT_DEVICE_FIELDS))
+    except GraphAPIError as error:
+        return error.to_dict()
     
-    if response.status_code == 200:
-        result = response.json()
-        devices = []
-        
-        for device in result.get("value", []):
-            devices.append({
-                "id": device.get("id"),
-                "serialNumber": device.get("serialNumber"),
-                "model": device.get("model"),
-                "manufacturer": device.get("manufacturer"),
-                "productKey": device.get("productKey"),
-                "groupTag": device.get("groupTag"),
-                "purchaseOrderIdentifier": device.get("purchaseOrderIdentifier"),
-                "enrollmentState": device.get("enrollmentState"),
-                "lastContactedDateTime": device.get("lastContactedDateTime"),
-                "addressableUserName": device.get("addressableUserName"),
-                "userPrincipalName": device.get("userPrincipalName"),
-                "resourceName": device.get("resourceName"),
-                "skuNumber": device.get("skuNumber"),
-                "systemFamily": device.get("systemFamily"),
-                "azureActiveDirectoryDeviceId": device.get("azureActiveDirectoryDeviceId"),
-                "managedDeviceId": device.get("managedDeviceId"),
-                "displayName": device.get("displayName")
-            })
-        
-        return {"devices": devices, "count": len(devices)}
-    else:
-        return {"error": response.text, "status_code": response.status_code}
+    return {"devices": devices, "count": len(devices)}
+
+ESP_PROFILE_FIELDS = (
+    "id",
+    "displayName",
+    "description",
+    "priority",
+    "createdDateTime",
+    "lastModifiedDateTime",
+    "version",
+    "showInstallationProgress",
+    "blockDeviceSetupRetryByUser",
+    "allowDeviceResetOnInstallFailure",
+    "allowLogCollectionOnInstallFailure",
+    "customErrorMessage",
+    "installProgressTimeoutInMinutes",
+    "allowDeviceUseOnInstallFailure",
+    "selectedMobileAppIds",
+    "trackInstallProgressForAutopilotOnly",
+    "disableUserStatusTrackingAfterFirstUser"
+)
+
+ESP_PROFILE_TYPES = ("windows10EnrollmentCompletionPageConfiguration",)
 
 @mcp.tool()
-def list_enrollment_status_page_profiles():
+async def list_enrollment_status_page_profiles():
     """Lists all Enrollment Status Page (ESP) profiles for Windows Autopilot."""
-    access_token = get_access_token()
+    enrollment_path = "/beta/deviceManagement/deviceEnrollmentConfigurations"
     
-    headers = {
-        "Authorization": f"Bearer {access_token}",
-        "Content-Type": "application/json"
-    }
+    # Ask Graph for ESP profiles only. No $select: the ESP settings only exist on the derived type
+    response, = await batch_requests_with_filter_fallback([
+        {"url": enrollment_path, "params": type_filter_params(enrollment_path, ESP_PROFILE_TYPES)}
+    ])
     
-    response = requests.get(
-        "https://graph.microsoft.com/beta/deviceManagement/deviceEnrollmentConfigurations",
-        headers=headers
-    )
+    esp_profiles = []
     
-    if response.status_code == 200:
-        result = response.json()
-        esp_profiles = []
-        
-        for config in result.get("value", []):
-            # Filter for Windows10EnrollmentCompletionPageConfiguration (ESP profiles)
-            if "windows10EnrollmentCompletionPageConfiguration" in config.get("@odata.type", "").lower():
-                esp_profiles.append({
-                    "id": config.get("id"),
-                    "displayName": config.get("displayName"),
-                    "description": config.get("description"),
-                    "priority": config.get("priority"),
-                    "createdDateTime": config.get("createdDateTime"),
-                    "lastModifiedDateTime": config.get("lastModifiedDateTime"),
-                    "version": config.get("version"),
-                    "showInstallationProgress": config.get("showInstallationProgress"),
-                    "blockDeviceSetupRetryByUser": config.get("blockDeviceSetupRetryByUser"),
-                    "allowDeviceResetOnInstallFailure": config.get("allowDeviceResetOnInstallFailure"),
-                    "allowLogCollectionOnInstallFailure": config.get("allowLogCollectionOnInstallFailure"),
-                    "customErrorMessage": config.get("customErrorMessage"),
-                    "installProgressTimeoutInMinutes": config.get("installProgressTimeoutInMinutes"),
-                    "allowDeviceUseOnInstallFailure": config.get("allowDeviceUseOnInstallFailure"),
-                    "selectedMobileAppIds": config.get("selectedMobileAppIds"),
-                    "trackInstallProgressForAutopilotOnly": config.get("trackInstallProgressForAutopilotOnly"),
-                    "disableUserStatusTrackingAfterFirstUser": config.get("disableUserStatusTrackingAfterFirstUser")
-                })
-        
-        return {"esp_profiles": esp_profiles, "count": len(esp_profiles)}
-    else:
-        return {"error": response.text, "status_code": response.status_code}
+    try:
+        async for page in iter_pages(enrollment_path, first_page=response):
+            for config in page:
+                # Filter for Windows10EnrollmentCompletionPageConfiguration (ESP profiles)
+                if "windows10enrollmentcompletionpageconfiguration" in config.get("@odata.type", "").lower():
+                    esp_profiles.append(project(config, ESP_PROFILE_FIELDS))
+    except GraphAPIError as error:
+        return error.to_dict()
+    
+    return {"esp_profiles": esp_profiles, "count": len(esp_profiles)}
+
+# Entity types matched by the server-side isof() filters. Certificate and Wi-Fi
+# base types also match their derived types (PKCS, SCEP, enterprise Wi-Fi).
+ANDROID_CONFIGURATION_TYPES = (
+    "androidCustomConfiguration",
+    "androidGeneralDeviceConfiguration",
+    "androidEasEmailProfileConfiguration",
+    "androidWiFiConfiguration",
+    "androidVpnConfiguration",
+    "androidCertificateProfileBase",
+    "androidTrustedRootCertificate",
+    "androidImportedPFXCertificateProfile",
+    "androidOmaCpConfiguration",
+    "androidDeviceOwnerGeneralDeviceConfiguration",
+    "androidDeviceOwnerWiFiConfiguration",
+    "androidDeviceOwnerVpnConfiguration",
+    "androidDeviceOwnerCertificateProfileBase",
+    "androidDeviceOwnerTrustedRootCertificate",
+    "androidDeviceOwnerImportedPFXCertificateProfile",
+    "androidDeviceOwnerDerivedCredentialAuthenticationConfiguration",
+    "androidWorkProfileCustomConfiguration",
+    "androidWorkProfileGeneralDeviceConfiguration",
+    "androidWorkProfileEasEmailProfileBase",
+    "androidWorkProfileWiFiConfiguration",
+    "androidWorkProfileVpnConfiguration",
+    "androidWorkProfileCertificateProfileBase",
+    "androidWorkProfileTrustedRootCertificate",
+    "androidForWorkCustomConfiguration",
+    "androidForWorkGeneralDeviceConfiguration",
+    "androidForWorkEasEmailProfileBase",
+    "androidForWorkWiFiConfiguration",
+    "androidForWorkVpnConfiguration",
+    "androidForWorkCertificateProfileBase",
+    "androidForWorkTrustedRootCertificate",
+    "androidForWorkImportedPFXCertificateProfile"
+)
+
+ANDROID_COMPLIANCE_TYPES = (
+    "androidCompliancePolicy",
+    "androidWorkProfileCompliancePolicy",
+    "androidDeviceOwnerCompliancePolicy",
+    "androidForWorkCompliancePolicy"
+)
+
+IOS_CONFIGURATION_TYPES = (
+    "iosCustomConfiguration",
+    "iosGeneralDeviceConfiguration",
+    "iosDeviceFeaturesConfiguration",
+    "iosUpdateConfiguration",
+    "iosEasEmailProfileConfiguration",
+    "iosCertificateProfile",
+    "iosTrustedRootCertificate",
+    "iosWiFiConfiguration",
+    "iosVpnConfiguration",
+    "iosEducationDeviceConfiguration",
+    "iosEduDeviceConfiguration",
+    "iosExpeditedCheckinConfiguration",
+    "iosDerivedCredentialAuthenticationConfiguration"
+)
+
+IOS_COMPLIANCE_TYPES = ("iosCompliancePolicy",)
+
+PLATFORM_CONFIGURATION_FIELDS = (
+    "id",
+    "displayName",
+    "description",
+    ("type", odata_type_name),
+    "createdDateTime",
+    "lastModifiedDateTime",
+    "version"
+)
+
+PLATFORM_ENROLLMENT_FIELDS = (
+    "id",
+    "displayName",
+    "description",
+    ("type", odata_type_name),
+    "priority",
+    "createdDateTime",
+    "lastModifiedDateTime",
+    "version"
+)
 
 @mcp.tool()
-def list_android_management_profiles():
+async def list_android_management_profiles():
     """Lists all Android device management settings, policies, profiles, and enrollment configurations."""
-    access_token = get_access_token()
-    
-    headers = {
-        "Authorization": f"Bearer {access_token}",
-        "Content-Type": "application/json"
-    }
-    
-    # Get Android device configurations
-    config_response = requests.get(
-        "https://graph.microsoft.com/beta/deviceManagement/deviceConfigurations",
-        headers=headers
-    )
-    
-    # Get Android enrollment configurations
-    enrollment_response = requests.get(
-        "https://graph.microsoft.com/beta/deviceManagement/deviceEnrollmentConfigurations",
-        headers=headers
-    )
+    config_path = "/beta/deviceManagement/deviceConfigurations"
+    compliance_path = "/v1.0/deviceManagement/deviceCompliancePolicies"
     
-    # Get Android compliance policies
-    compliance_response = requests.get(
-        "https://graph.microsoft.com/v1.0/deviceManagement/deviceCompliancePolicies",
-        headers=headers
-    )
+    # Configurations and compliance policies are filtered by type on the server where
+    # supported; enrollment configurations have no Android-specific types and stay client-side
+    config_response, enrollment_response, compliance_response = await batch_requests_with_filter_fallback([
+        {"url": config_path, "params": type_filter_params(config_path, ANDROID_CONFIGURATION_TYPES, select_params(PLATFORM_CONFIGURATION_FIELDS))},
+        {"url": "/beta/deviceManagement/deviceEnrollmentConfigurations", "params": select_params(PLATFORM_ENROLLMENT_FIELDS)},
+        {"url": compliance_path, "params": type_filter_params(compliance_path, ANDROID_COMPLIANCE_TYPES, select_params(PLATFORM_CONFIGURATION_FIELDS))}
+    ])
     
     android_profiles = {
         "device_configurations": [],
@@ -496,54 +2491,35 @@ def list_android_management_profiles():
         "compliance_policies": []
     }
     
-    # Parse device configurations
-    if config_response.status_code == 200:
-        configs = config_response.json().get("value", [])
-        for config in configs:
-            config_type = config.get("@odata.type", "")
-            if "android" in config_type.lower():
-                android_profiles["device_configurations"].append({
-                    "id": config.get("id"),
-                    "displayName": config.get("displayName"),
-                    "description": config.get("description"),
-                    "type": config_type.split('.')[-1],
-                    "createdDateTime": config.get("createdDateTime"),
-                    "lastModifiedDateTime": config.get("lastModifiedDateTime"),
-                    "version": config.get("version")
-                })
-    
-    # Parse enrollment configurations
-    if enrollment_response.status_code == 200:
-        enrollments = enrollment_response.json().get("value", [])
-        for enrollment in enrollments:
-            enrollment_type = enrollment.get("@odata.type", "")
-            if "android" in enrollment_type.lower():
-                android_profiles["enrollment_configurations"].append({
-                    "id": enrollment.get("id"),
-                    "displayName": enrollment.get("displayName"),
-                    "description": enrollment.get("description"),
-                    "type": enrollment_type.split('.')[-1],
-                    "priority": enrollment.get("priority"),
-                    "createdDateTime": enrollment.get("createdDateTime"),
-                    "lastModifiedDateTime": enrollment.get("lastModifiedDateTime"),
-                    "version": enrollment.get("version")
-                })
-    
-    # Parse compliance policies
-    if compliance_response.status_code == 200:
-        policies = compliance_response.json().get("value", [])
-        for policy in policies:
-            policy_type = policy.get("@odata.type", "")
-            if "android" in policy_type.lower():
-                android_profiles["compliance_policies"].append({
-                    "id": policy.get("id"),
-                    "displayName": policy.get("displayName"),
-                    "description": policy.get("description"),
-                    "type": policy_type.split('.')[-1],
-                    "createdDateTime": policy.get("createdDateTime"),
-                    "lastModifiedDateTime": policy.get("lastModifiedDateTime"),
-                    "version": policy.get("version")
-                })
+    # Get Android device configurations
+    try:
+        async for page in iter_pages(config_path, first_page=config_response):
+            for config in page:
+                config_type = config.get("@odata.type", "")
+                if "android" in config_type.lower():
+                    android_profiles["device_configurations"].append(project(config, PLATFORM_CONFIGURATION_FIELDS))
+    except GraphAPIError:
+        pass
+    
+    # Get Android enrollment configurations
+    try:
+        async for page in iter_pages("/beta/deviceManagement/deviceEnrollmentConfigurations", first_page=enrollment_response):
+            for enrollment in page:
+                enrollment_type = enrollment.get("@odata.type", "")
+                if "android" in enrollment_type.lower():
+                    android_profiles["enrollment_configurations"].append(project(enrollment, PLATFORM_ENROLLMENT_FIELDS))
+    except GraphAPIError:
+        pass
+    
+    # Get Android compliance policies
+    try:
+        async for page in iter_pages(compliance_path, first_page=compliance_response):
+            for policy in page:
+                policy_type = policy.get("@odata.type", "")
+                if "android" in policy_type.lower():
+                    android_profiles["compliance_policies"].append(project(policy, PLATFORM_CONFIGURATION_FIELDS))
+    except GraphAPIError:
+        pass
     
     android_profiles["total_count"] = (
         len(android_profiles["device_configurations"]) +
@@ -554,32 +2530,18 @@ def list_android_management_profiles():
     return android_profiles
 
 @mcp.tool()
-def list_ios_management_profiles():
+async def list_ios_management_profiles():
     """Lists all iOS/iPadOS device management settings, policies, profiles, and enrollment configurations."""
-    access_token = get_access_token()
-    
-    headers = {
-        "Authorization": f"Bearer {access_token}",
-        "Content-Type": "application/json"
-    }
-    
-    # Get iOS device configurations
-    config_response = requests.get(
-        "https://graph.microsoft.com/beta/deviceManagement/deviceConfigurations",
-        headers=headers
-    )
+    config_path = "/beta/deviceManagement/deviceConfigurations"
+    compliance_path = "/v1.0/deviceManagement/deviceCompliancePolicies"
     
-    # Get iOS enrollment configurations
-    enrollment_response = requests.get(
-        "https://graph.microsoft.com/beta/deviceManagement/deviceEnrollmentConfigurations",
-        headers=headers
-    )
-    
-    # Get iOS compliance policies
-    compliance_response = requests.get(
-        "https://graph.microsoft.com/v1.0/deviceManagement/deviceCompliancePolicies",
-        headers=headers
-    )
+    # Configurations and compliance policies are filtered by type on the server where
+    # supported; enrollment configurations have no iOS-specific types and stay client-side
+    config_response, enrollment_response, compliance_response = await batch_requests_with_filter_fallback([
+        {"url": config_path, "params": type_filter_params(config_path, IOS_CONFIGURATION_TYPES, select_params(PLATFORM_CONFIGURATION_FIELDS))},
+        {"url": "/beta/deviceManagement/deviceEnrollmentConfigurations", "params": select_params(PLATFORM_ENROLLMENT_FIELDS)},
+        {"url": compliance_path, "params": type_filter_params(compliance_path, IOS_COMPLIANCE_TYPES, select_params(PLATFORM_CONFIGURATION_FIELDS))}
+    ])
     
     ios_profiles = {
         "device_configurations": [],
@@ -587,54 +2549,35 @@ def list_ios_management_profiles():
         "compliance_policies": []
     }
     
-    # Parse device configurations
-    if config_response.status_code == 200:
-        configs = config_response.json().get("value", [])
-        for config in configs:
-            config_type = config.get("@odata.type", "")
-            if "ios" in config_type.lower():
-                ios_profiles["device_configurations"].append({
-                    "id": config.get("id"),
-                    "displayName": config.get("displayName"),
-                    "description": config.get("description"),
-                    "type": config_type.split('.')[-1],
-                    "createdDateTime": config.get("createdDateTime"),
-                    "lastModifiedDateTime": config.get("lastModifiedDateTime"),
-                    "version": config.get("version")
-                })
-    
-    # Parse enrollment configurations
-    if enrollment_response.status_code == 200:
-        enrollments = enrollment_response.json().get("value", [])
-        for enrollment in enrollments:
-            enrollment_type = enrollment.get("@odata.type", "")
-            if "ios" in enrollment_type.lower():
-                ios_profiles["enrollment_configurations"].append({
-                    "id": enrollment.get("id"),
-                    "displayName": enrollment.get("displayName"),
-                    "description": enrollment.get("description"),
-                    "type": enrollment_type.split('.')[-1],
-                    "priority": enrollment.get("priority"),
-                    "createdDateTime": enrollment.get("createdDateTime"),
-                    "lastModifiedDateTime": enrollment.get("lastModifiedDateTime"),
-                    "version": enrollment.get("version")
-                })
-    
-    # Parse compliance policies
-    if compliance_response.status_code == 200:
-        policies = compliance_response.json().get("value", [])
-        for policy in policies:
-            policy_type = policy.get("@odata.type", "")
-            if "ios" in policy_type.lower():
-                ios_profiles["compliance_policies"].append({
-                    "id": policy.get("id"),
-                    "displayName": policy.get("displayName"),
-                    "description": policy.get("description"),
-                    "type": policy_type.split('.')[-1],
-                    "createdDateTime": policy.get("createdDateTime"),
-                    "lastModifiedDateTime": policy.get("lastModifiedDateTime"),
-                    "version": policy.get("version")
-                })
+    # Get iOS device configurations
+    try:
+        async for page in iter_pages(config_path, first_page=config_response):
+            for config in page:
+                config_type = config.get("@odata.type", "")
+                if "ios" in config_type.lower():
+                    ios_profiles["device_configurations"].append(project(config, PLATFORM_CONFIGURATION_FIELDS))
+    except GraphAPIError:
+        pass
+    
+    # Get iOS enrollment configurations
+    try:
+        async for page in iter_pages("/beta/deviceManagement/deviceEnrollmentConfigurations", first_page=enrollment_response):
+            for enrollment in page:
+                enrollment_type = enrollment.get("@odata.type", "")
+                if "ios" in enrollment_type.lower():
+                    ios_profiles["enrollment_configurations"].append(project(enrollment, PLATFORM_ENROLLMENT_FIELDS))
+    except GraphAPIError:
+        pass
+    
+    # Get iOS compliance policies
+    try:
+        async for page in iter_pages(compliance_path, first_page=compliance_response):
+            for policy in page:
+                policy_type = policy.get("@odata.type", "")
+                if "ios" in policy_type.lower():
+                    ios_profiles["compliance_policies"].append(project(policy, PLATFORM_CONFIGURATION_FIELDS))
+    except GraphAPIError:
+        pass
     
     ios_profiles["total_count"] = (
         len(ios_profiles["device_configurations"]) +
@@ -644,384 +2587,675 @@ def list_ios_management_profiles():
     
     return ios_profiles
 
+APP_PROTECTION_POLICY_FIELDS = (
+    "id",
+    "displayName",
+    "description",
+    ("policyType", odata_type_name),
+    "createdDateTime",
+    "lastModifiedDateTime",
+    "version",
+    "isAssigned",
+    ("platformType", managed_app_platform)
+)
+
 @mcp.tool()
-def list_app_protection_policies():
+async def list_app_protection_policies():
     """Lists all app protection policies (MAM policies) for iOS, Android, and Windows."""
-    access_token = get_access_token()
-    
-    headers = {
-        "Authorization": f"Bearer {access_token}",
-        "Content-Type": "application/json"
-    }
+    policies = []
     
-    # Get managed app policies
-    response = requests.get(
-        "https://graph.microsoft.com/beta/deviceAppManagement/managedAppPolicies",
-        headers=headers
-    )
+    # Get managed app policies (no $select: isAssigned only exists on the derived policy types)
+    try:
+        async for page in iter_pages("/beta/deviceAppManagement/managedAppPolicies"):
+            for policy in page:
+                policies.append(project(policy, APP_PROTECTION_POLICY_FIELDS))
+    except GraphAPIError as error:
+        return error.to_dict()
     
-    if response.status_code == 200:
-        result = response.json()
-        policies = []
-        
-        for policy in result.get("value", []):
-            policy_type = policy.get("@odata.type", "").split('.')[-1]
-            policies.append({
-                "id": policy.get("id"),
-                "displayName": policy.get("displayName"),
-                "description": policy.get("description"),
-                "policyType": policy_type,
-                "createdDateTime": policy.get("createdDateTime"),
-                "lastModifiedDateTime": policy.get("lastModifiedDateTime"),
-                "version": policy.get("version"),
-                "isAssigned": policy.get("isAssigned"),
-                # Platform-specific fields
-                "platformType": policy.get("@odata.type", "").lower().replace("#microsoft.graph.", "").split("managedapp")[0] if "managedapp" in policy.get("@odata.type", "").lower() else "unknown"
-            })
-        
-        return {"app_protection_policies": policies, "count": len(policies)}
-    else:
-        return {"error": response.text, "status_code": response.status_code}
+    return {"app_protection_policies": policies, "count": len(policies)}
+
+TUNNEL_SITE_FIELDS = (
+    "id",
+    "displayName",
+    "description",
+    "publicAddress",
+    "upgradeWindowUtcOffsetInMinutes",
+    "upgradeWindowStartTime",
+    "upgradeWindowEndTime",
+    "upgradeAutomatically",
+    "upgradeAvailable",
+    "internalNetworkProbeUrl",
+    "roleScopeTagIds"
+)
 
 @mcp.tool()
-def list_microsoft_tunnel_sites():
+async def list_microsoft_tunnel_sites():
     """Lists all Microsoft Tunnel Gateway sites and their configurations."""
-    access_token = get_access_token()
-    
-    headers = {
-        "Authorization": f"Bearer {access_token}",
-        "Content-Type": "application/json"
-    }
+    sites = []
     
     # Get Microsoft Tunnel sites
-    response = requests.get(
-        "https://graph.microsoft.com/beta/deviceManagement/microsoftTunnelSites",
-        headers=headers
-    )
-    
-    if response.status_code == 200:
-        result = response.json()
-        sites = []
-        
-        for site in result.get("value", []):
-            sites.append({
-                "id": site.get("id"),
-                "displayName": site.get("displayName"),
-                "description": site.get("description"),
-                "publicAddress": site.get("publicAddress"),
-                "upgradeWindowUtcOffsetInMinutes": site.get("upgradeWindowUtcOffsetInMinutes"),
-                "upgradeWindowStartTime": site.get("upgradeWindowStartTime"),
-                "upgradeWindowEndTime": site.get("upgradeWindowEndTime"),
-                "upgradeAutomatically": site.get("upgradeAutomatically"),
-                "upgradeAvailable": site.get("upgradeAvailable"),
-                "internalNetworkProbeUrl": site.get("internalNetworkProbeUrl"),
-                "roleScopeTagIds": site.get("roleScopeTagIds")
-            })
-        
-        return {"tunnel_sites": sites, "count": len(sites)}
-    else:
-        return {"error": response.text, "status_code": response.status_code}
+    try:
+        async for page in iter_pages("/beta/deviceManagement/microsoftTunnelSites", params=select_params(TUNNEL_SITE_FIELDS)):
+            for site in page:
+                sites.append(project(site, TUNNEL_SITE_FIELDS))
+    except GraphAPIError as error:
+        return error.to_dict()
+    
+    return {"tunnel_sites": sites, "count": len(sites)}
+
+TUNNEL_SERVER_FIELDS = (
+    "id",
+    "displayName",
+    "tunnelServerHealthStatus",
+    "lastCheckinDateTime",
+    "agentImageDigest",
+    "serverImageDigest"
+)
 
 @mcp.tool()
-def list_microsoft_tunnel_servers():
-    """Lists all Microsoft Tunnel Gateway servers across all sites."""
-    access_token = get_access_token()
-    
-    headers = {
-        "Authorization": f"Bearer {access_token}",
-        "Content-Type": "application/json"
-    }
+async def list_microsoft_tunnel_servers(concurrency: Optional[int] = None):
+    """Lists all Microsoft Tunnel Gateway servers across all sites.
     
+    Args:
+        concurrency: Optional number of sites whose servers are fetched in parallel
+    """
     # First get all tunnel sites
-    sites_response = requests.get(
-        "https://graph.microsoft.com/beta/deviceManagement/microsoftTunnelSites",
-        headers=headers
+    sites = []
+    
+    try:
+        async for page in iter_pages("/beta/deviceManagement/microsoftTunnelSites", params={"$select": "id,displayName"}):
+            sites.extend(page)
+    except GraphAPIError as error:
+        return error.to_dict()
+    
+    # Then get the servers of every site in parallel; a failed site is skipped
+    site_servers = await fetch_child_collections(
+        sites,
+        lambda site: f"/beta/deviceManagement/microsoftTunnelSites/{site.get('id')}/microsoftTunnelServers",
+        params=select_params(TUNNEL_SERVER_FIELDS),
+        concurrency=concurrency
     )
     
     all_servers = []
     
-    if sites_response.status_code == 200:
-        sites = sites_response.json().get("value", [])
-        
-        # For each site, get its servers
-        for site in sites:
-            site_id = site.get("id")
-            servers_response = requests.get(
-                f"https://graph.microsoft.com/beta/deviceManagement/microsoftTunnelSites/{site_id}/microsoftTunnelServers",
-                headers=headers
-            )
-            
-            if servers_response.status_code == 200:
-                servers = servers_response.json().get("value", [])
-                for server in servers:
-                    all_servers.append({
-                        "id": server.get("id"),
-                        "displayName": server.get("displayName"),
-                        "tunnelServerHealthStatus": server.get("tunnelServerHealthStatus"),
-                        "lastCheckinDateTime": server.get("lastCheckinDateTime"),
-                        "agentImageDigest": server.get("agentImageDigest"),
-                        "serverImageDigest": server.get("serverImageDigest"),
-                        "siteName": site.get("displayName"),
-                        "siteId": site_id
-                    })
-        
-        return {"tunnel_servers": all_servers, "count": len(all_servers)}
-    else:
-        return {"error": sites_response.text, "status_code": sites_response.status_code}
+    for site, servers, _ in site_servers:
+        for server in servers:
+            all_servers.append({
+                **project(server, TUNNEL_SERVER_FIELDS),
+                "siteName": site.get("displayName"),
+                "siteId": site.get("id")
+            })
+    
+    return {"tunnel_servers": all_servers, "count": len(all_servers)}
+
+AD_CONNECTOR_FIELDS = (
+    "id",
+    "displayName",
+    "state",
+    "version",
+    "machineName",
+    "lastConnectionDateTime"
+)
 
 @mcp.tool()
-def list_intune_ad_connectors():
+async def list_intune_ad_connectors():
     """Lists all Intune Connector for Active Directory (used for Hybrid Azure AD Join and Autopilot)."""
-    access_token = get_access_token()
-    
-    headers = {
-        "Authorization": f"Bearer {access_token}",
-        "Content-Type": "application/json"
-    }
+    connectors = []
+    cache_statuses = []
     
-    response = requests.get(
-        "https://graph.microsoft.com/beta/deviceManagement/domainJoinConnectors",
-        headers=headers
-    )
+    try:
+        async for page in iter_pages("/beta/deviceManagement/domainJoinConnectors", params=select_params(AD_CONNECTOR_FIELDS), cache_statuses=cache_statuses):
+            for connector in page:
+                connectors.append(project(connector, AD_CONNECTOR_FIELDS))
+    except GraphAPIError as error:
+        return error.to_dict()
     
-    if response.status_code == 200:
-        result = response.json()
-        connectors = []
-        
-        for connector in result.get("value", []):
-            connectors.append({
-                "id": connector.get("id"),
-                "displayName": connector.get("displayName"),
-                "state": connector.get("state"),
-                "version": connector.get("version"),
-                "machineName": connector.get("machineName"),
-                "lastConnectionDateTime": connector.get("lastConnectionDateTime")
-            })
-        
-        return {"ad_connectors": connectors, "count": len(connectors)}
-    else:
-        return {"error": response.text, "status_code": response.status_code}
+    return {"ad_connectors": connectors, "count": len(connectors), "cache_status": combined_cache_status(cache_statuses)}
+
+CERTIFICATE_CONNECTOR_FIELDS = (
+    "id",
+    "displayName",
+    "lastConnectionDateTime",
+    "state",
+    "connectorVersion",
+    "machineName",
+    "enrolledDateTime"
+)
 
 @mcp.tool()
-def list_intune_certificate_connectors():
+async def list_intune_certificate_connectors():
     """Lists all Intune Certificate Connectors (NDES connectors for SCEP certificates)."""
-    access_token = get_access_token()
-    
-    headers = {
-        "Authorization": f"Bearer {access_token}",
-        "Content-Type": "application/json"
-    }
+    connectors = []
+    cache_statuses = []
     
-    response = requests.get(
-        "https://graph.microsoft.com/beta/deviceManagement/ndesConnectors",
-        headers=headers
-    )
+    try:
+        async for page in iter_pages("/beta/deviceManagement/ndesConnectors", params=select_params(CERTIFICATE_CONNECTOR_FIELDS), cache_statuses=cache_statuses):
+            for connector in page:
+                connectors.append(project(connector, CERTIFICATE_CONNECTOR_FIELDS))
+    except GraphAPIError as error:
+        return error.to_dict()
     
-    if response.status_code == 200:
-        result = response.json()
-        connectors = []
-        
-        for connector in result.get("value", []):
-            connectors.append({
-                "id": connector.get("id"),
-                "displayName": connector.get("displayName"),
-                "lastConnectionDateTime": connector.get("lastConnectionDateTime"),
-                "state": connector.get("state"),
-                "connectorVersion": connector.get("connectorVersion"),
-                "machineName": connector.get("machineName"),
-                "enrolledDateTime": connector.get("enrolledDateTime")
-            })
-        
-        return {"certificate_connectors": connectors, "count": len(connectors)}
-    else:
-        return {"error": response.text, "status_code": response.status_code}
+    return {"certificate_connectors": connectors, "count": len(connectors), "cache_status": combined_cache_status(cache_statuses)}
+
+USER_DETAIL_FIELDS = (
+    "id",
+    "displayName",
+    "userPrincipalName",
+    "mail",
+    "jobTitle",
+    "department",
+    "officeLocation",
+    "mobilePhone",
+    "businessPhones",
+    "accountEnabled"
+)
 
 @mcp.tool()
-def get_user_info(user_id: str):
+async def get_user_info(user_id: str):
     """Gets information about a specific user by user principal name or object ID."""
-    access_token = get_access_token()
+    graph = get_graph_client()
     
-    headers = {
-        "Authorization": f"Bearer {access_token}",
-        "Content-Type": "application/json"
-    }
-    
-    response = requests.get(
-        f"https://graph.microsoft.com/v1.0/users/{user_id}",
-        headers=headers
-    )
+    response = await graph.get(f"/v1.0/users/{user_id}", params=select_params(USER_DETAIL_FIELDS))
     
     if response.status_code == 200:
         user = response.json()
-        return {
-            "id": user.get("id"),
-            "displayName": user.get("displayName"),
-            "userPrincipalName": user.get("userPrincipalName"),
-            "mail": user.get("mail"),
-            "jobTitle": user.get("jobTitle"),
-            "department": user.get("department"),
-            "officeLocation": user.get("officeLocation"),
-            "mobilePhone": user.get("mobilePhone"),
-            "businessPhones": user.get("businessPhones"),
-            "accountEnabled": user.get("accountEnabled")
-        }
+        return project(user, USER_DETAIL_FIELDS)
     else:
         return {"error": response.text, "status_code": response.status_code}
 
+USER_FIELDS = (
+    "id",
+    "displayName",
+    "userPrincipalName",
+    "mail",
+    "jobTitle",
+    "accountEnabled"
+)
+
 @mcp.tool()
-def list_users():
-    """Lists all users in the tenant."""
-    access_token = get_access_token()
-    
-    headers = {
-        "Authorization": f"Bearer {access_token}",
-        "Content-Type": "application/json"
-    }
+async def list_users(page_size: Optional[int] = None, max_items: Optional[int] = None):
+    """Lists all users in the tenant.
     
-    response = requests.get(
-        "https://graph.microsoft.com/v1.0/users",
-        headers=headers
-    )
+    After the first full listing, users are served from a local copy that is
+    refreshed with a delta query on every call.
     
-    if response.status_code == 200:
-        result = response.json()
-        users = []
-        
-        for user in result.get("value", []):
-            users.append({
-                "id": user.get("id"),
-                "displayName": user.get("displayName"),
-                "userPrincipalName": user.get("userPrincipalName"),
-                "mail": user.get("mail"),
-                "jobTitle": user.get("jobTitle"),
-                "accountEnabled": user.get("accountEnabled")
-            })
-        
-        return {"users": users, "count": len(users)}
-    else:
-        return {"error": response.text, "status_code": response.status_code}
+    Args:
+        page_size: Optional number of users to request per page
+        max_items: Optional cap on the number of users returned (all pages are followed by default)
+    """
+    sync = await collection_sync("users")
+    if GRAPH_DELTA_SYNC and (max_items is None or sync.ready):
+        try:
+            status = await sync.sync(page_size)
+        except GraphAPIError as error:
+            return error.to_dict()
+        await mirror_sync("users", sync, status, USER_FIELDS)
+        users = [project(user, USER_FIELDS) for user in islice(sync.values(), max_items)]
+        return {"users": users, "count": len(users), "sync": status}
+    
+    users = []
+    
+    try:
+        async for page in iter_pages("/v1.0/users", params=select_params(USER_FIELDS), page_size=page_size, max_items=max_items):
+            for user in page:
+                users.append(project(user, USER_FIELDS))
+    except GraphAPIError as error:
+        return error.to_dict()
+    
+    if max_items is None:
+        await mirror_rows("users", users)
+    
+    return {"users": users, "count": len(users)}
+
+GROUP_FIELDS = (
+    "id",
+    "displayName",
+    "description",
+    "mailEnabled",
+    "securityEnabled",
+    "mail",
+    "groupTypes",
+    "createdDateTime"
+)
 
 @mcp.tool()
-def list_groups():
-    """Lists all groups in the tenant with creation date."""
-    access_token = get_access_token()
-    
-    headers = {
-        "Authorization": f"Bearer {access_token}",
-        "Content-Type": "application/json"
-    }
+async def list_groups(page_size: Optional[int] = None, max_items: Optional[int] = None):
+    """Lists all groups in the tenant with creation date.
     
-    response = requests.get(
-        "https://graph.microsoft.com/v1.0/groups",
-        headers=headers
-    )
+    After the first full listing, groups are served from a local copy that is
+    refreshed with a delta query on every call.
     
-    if response.status_code == 200:
-        result = response.json()
-        groups = []
-        
-        for group in result.get("value", []):
-            groups.append({
-                "id": group.get("id"),
-                "displayName": group.get("displayName"),
-                "description": group.get("description"),
-                "mailEnabled": group.get("mailEnabled"),
-                "securityEnabled": group.get("securityEnabled"),
-                "mail": group.get("mail"),
-                "groupTypes": group.get("groupTypes"),
-                "createdDateTime": group.get("createdDateTime")
-            })
-        
-        return {"groups": groups, "count": len(groups)}
-    else:
-        return {"error": response.text, "status_code": response.status_code}
+    Args:
+        page_size: Optional number of groups to request per page
+        max_items: Optional cap on the number of groups returned (all pages are followed by default)
+    """
+    sync = await collection_sync("groups")
+    if GRAPH_DELTA_SYNC and (max_items is None or sync.ready):
+        try:
+            status = await sync.sync(page_size)
+        except GraphAPIError as error:
+            return error.to_dict()
+        await mirror_sync("groups", sync, status, GROUP_FIELDS)
+        groups = [project(group, GROUP_FIELDS) for group in islice(sync.values(), max_items)]
+        return {"groups": groups, "count": len(groups), "sync": status}
+    
+    groups = []
+    
+    try:
+        async for page in iter_pages("/v1.0/groups", params=select_params(GROUP_FIELDS), page_size=page_size, max_items=max_items):
+            for group in page:
+                groups.append(project(group, GROUP_FIELDS))
+    except GraphAPIError as error:
+        return error.to_dict()
+    
+    if max_items is None:
+        await mirror_rows("groups", groups)
+    
+    return {"groups": groups, "count": len(groups)}
+
+GROUP_DETAIL_FIELDS = (
+    "id",
+    "displayName",
+    "description",
+    "mail",
+    "mailEnabled",
+    "mailNickname",
+    "securityEnabled",
+    "securityIdentifier",
+    "groupTypes",
+    "createdDateTime",
+    "renewedDateTime",
+    "deletedDateTime",
+    "expirationDateTime",
+    "membershipRule",
+    "membershipRuleProcessingState",
+    "visibility",
+    "isAssignableToRole",
+    "onPremisesDomainName",
+    "onPremisesNetBiosName",
+    "onPremisesSamAccountName",
+    "onPremisesSyncEnabled",
+    "onPremisesLastSyncDateTime",
+    "preferredDataLocation",
+    "preferredLanguage",
+    "proxyAddresses",
+    "theme"
+)
 
 @mcp.tool()
-def get_group_details(group_id: str):
+async def get_group_details(group_id: str):
     """Gets detailed information about a specific group including all properties.
     
     Args:
         group_id: The ID of the group to retrieve details for
     """
-    access_token = get_access_token()
-    
-    headers = {
-        "Authorization": f"Bearer {access_token}",
-        "Content-Type": "application/json"
-    }
+    graph = get_graph_client()
     
-    response = requests.get(
-        f"https://graph.microsoft.com/v1.0/groups/{group_id}",
-        headers=headers
-    )
+    response = await graph.get(f"/v1.0/groups/{group_id}", params=select_params(GROUP_DETAIL_FIELDS))
     
     if response.status_code == 200:
         group = response.json()
-        return {
-            "id": group.get("id"),
-            "displayName": group.get("displayName"),
-            "description": group.get("description"),
-            "mail": group.get("mail"),
-            "mailEnabled": group.get("mailEnabled"),
-            "mailNickname": group.get("mailNickname"),
-            "securityEnabled": group.get("securityEnabled"),
-            "securityIdentifier": group.get("securityIdentifier"),
-            "groupTypes": group.get("groupTypes"),
-            "createdDateTime": group.get("createdDateTime"),
-            "renewedDateTime": group.get("renewedDateTime"),
-            "deletedDateTime": group.get("deletedDateTime"),
-            "expirationDateTime": group.get("expirationDateTime"),
-            "membershipRule": group.get("membershipRule"),
-            "membershipRuleProcessingState": group.get("membershipRuleProcessingState"),
-            "visibility": group.get("visibility"),
-            "isAssignableToRole": group.get("isAssignableToRole"),
-            "onPremisesDomainName": group.get("onPremisesDomainName"),
-            "onPremisesNetBiosName": group.get("onPremisesNetBiosName"),
-            "onPremisesSamAccountName": group.get("onPremisesSamAccountName"),
-            "onPremisesSyncEnabled": group.get("onPremisesSyncEnabled"),
-            "onPremisesLastSyncDateTime": group.get("onPremisesLastSyncDateTime"),
-            "preferredDataLocation": group.get("preferredDataLocation"),
-            "preferredLanguage": group.get("preferredLanguage"),
-            "proxyAddresses": group.get("proxyAddresses"),
-            "theme": group.get("theme")
-        }
+        return project(group, GROUP_DETAIL_FIELDS)
     else:
         return {"error": response.text, "status_code": response.status_code}
 
+GROUP_MEMBER_FIELDS = (
+    "id",
+    "displayName",
+    "userPrincipalName",
+    "mail",
+    "@odata.type"
+)
+
 @mcp.tool()
-def get_group_members(group_id: str):
-    """Gets members of a specific group."""
-    access_token = get_access_token()
+async def get_group_members(group_id: str, page_size: Optional[int] = None, max_items: Optional[int] = None, transitive: bool = False):
+    """Gets members of a specific group.
     
-    headers = {
-        "Authorization": f"Bearer {access_token}",
-        "Content-Type": "application/json"
-    }
+    Args:
+        group_id: The ID of the group
+        page_size: Optional number of members to request per page
+        max_items: Optional cap on the number of members returned (all pages are followed by default)
+        transitive: Also return members of nested groups (Graph transitiveMembers)
+    """
+    members = []
+    relation = "transitiveMembers" if transitive else "members"
     
-    response = requests.get(
-        f"https://graph.microsoft.com/v1.0/groups/{group_id}/members",
-        headers=headers
-    )
+    try:
+        async for page in iter_pages(f"/v1.0/groups/{group_id}/{relation}", params=select_params(GROUP_MEMBER_FIELDS), page_size=page_size, max_items=max_items):
+            for member in page:
+                members.append(project(member, GROUP_MEMBER_FIELDS))
+    except GraphAPIError as error:
+        return error.to_dict()
     
-    if response.status_code == 200:
-        result = response.json()
-        members = []
-        
-        for member in result.get("value", []):
-            members.append({
-                "id": member.get("id"),
-                "displayName": member.get("displayName"),
-                "userPrincipalName": member.get("userPrincipalName"),
-                "mail": member.get("mail"),
-                "@odata.type": member.get("@odata.type")
-            })
-        
-        return {"members": members, "count": len(members), "groupId": group_id}
+    return {"members": members, "count": len(members), "groupId": group_id, "transitive": transitive}
+
+async def membership_graph(refresh=False):
+    """Returns the membership graph for the current principal and its sync status.
+
+    Raises GraphAPIError when the graph cannot be synced.
+    """
+    graph = await collection_sync("group_memberships")
+    status = await graph.refresh(force=refresh)
+    return graph, {**status, **graph.stats()}
+
+def _directory_object(graph, number, **extra):
+    """Describes an interned directory object with the names known locally."""
+    object_id = graph.ids[number]
+    entry = {"id": object_id, "type": graph.types[number]}
+    group = graph.items.get(object_id)
+    if group is not None:
+        entry["displayName"] = group.get("displayName")
+    entry.update(extra)
+    return entry
+
+@mcp.tool()
+async def check_group_membership(member_id: str, group_id: str, refresh: bool = False):
+    """Checks whether a user, device or group is in a group, directly or through nested groups.
+    
+    Answered from a cached membership graph that is synced with a groups delta
+    query at most every GROUP_MEMBERSHIP_TTL seconds.
+    
+    Args:
+        member_id: ID of the user, device, service principal or group
+        group_id: ID of the group
+        refresh: Sync the membership graph first even if it is still fresh
+    """
+    try:
+        graph, status = await membership_graph(refresh)
+    except GraphAPIError as error:
+        return error.to_dict()
+    
+    if member_id not in graph.index or group_id not in graph.items:
+        path = None
     else:
-        return {"error": response.text, "status_code": response.status_code}
+        path = graph.membership_path(graph.index[member_id], graph.index[group_id])
+    
+    return {
+        "memberId": member_id,
+        "groupId": group_id,
+        "isMember": path is not None,
+        "direct": path is not None and len(path) == 2,
+        "path": [_directory_object(graph, number) for number in path] if path else [],
+        "sync": status
+    }
+
+@mcp.tool()
+async def list_member_groups(member_id: str, transitive: bool = True, refresh: bool = False):
+    """Lists the groups that contain a user, device or group.
+    
+    Answered from the cached membership graph (see check_group_membership).
+    
+    Args:
+        member_id: ID of the user, device, service principal or group
+        transitive: Include groups that contain it through nested groups
+        refresh: Sync the membership graph first even if it is still fresh
+    """
+    try:
+        graph, status = await membership_graph(refresh)
+    except GraphAPIError as error:
+        return error.to_dict()
+    
+    depths = graph.containing_groups(graph.index[member_id], transitive) if member_id in graph.index else {}
+    groups = [
+        _directory_object(graph, number, direct=depth == 1)
+        for number, depth in sorted(depths.items(), key=lambda item: item[1])
+    ]
+    return {"memberId": member_id, "groups": groups, "count": len(groups), "sync": status}
+
+@mcp.tool()
+async def flatten_group_members(group_id: str, member_type: str = "", max_items: Optional[int] = None, refresh: bool = False):
+    """Lists every member of a group including members of nested groups, from the cached membership graph.
+    
+    Unlike get_group_members(transitive=True), this returns member IDs and
+    types without querying Graph again, which suits repeated access reviews
+    of large nested groups.
+    
+    Args:
+        group_id: ID of the group
+        member_type: Optional type to keep (e.g. 'user', 'device', 'servicePrincipal')
+        max_items: Optional cap on the number of members returned
+        refresh: Sync the membership graph first even if it is still fresh
+    """
+    try:
+        graph, status = await membership_graph(refresh)
+    except GraphAPIError as error:
+        return error.to_dict()
+    
+    if group_id not in graph.items:
+        return {"error": f"Group {group_id} not found", "status_code": 404}
+    
+    members, nested = graph.flatten(graph.index[group_id])
+    if member_type:
+        members = {number: depth for number, depth in members.items() if graph.types[number] == member_type}
+    
+    # Add user names when the users list is already synced locally
+    users = await collection_sync("users")
+    flattened = []
+    for number, depth in islice(sorted(members.items(), key=lambda item: item[1]), max_items):
+        entry = _directory_object(graph, number, direct=depth == 1)
+        user = users.items.get(entry["id"])
+        if user is not None:
+            entry.update(displayName=user.get("displayName"), userPrincipalName=user.get("userPrincipalName"))
+        flattened.append(entry)
+    
+    return {
+        "groupId": group_id,
+        "members": flattened,
+        "count": len(flattened),
+        "totalMembers": len(members),
+        "nestedGroups": [_directory_object(graph, number) for number in nested],
+        "sync": status
+    }
+
+# Graph rejects simple PUT uploads above 4 MB; larger files go through an upload session
+GRAPH_SIMPLE_UPLOAD_LIMIT = 4 * 1024 * 1024
+
+# Upload session chunks must be a multiple of 320 KiB
+UPLOAD_CHUNK_ALIGNMENT = 320 * 1024
+
+GRAPH_UPLOAD_CHUNK_SIZE = max(
+    UPLOAD_CHUNK_ALIGNMENT,
+    int(os.getenv("GRAPH_UPLOAD_CHUNK_SIZE", str(10 * UPLOAD_CHUNK_ALIGNMENT))) // UPLOAD_CHUNK_ALIGNMENT * UPLOAD_CHUNK_ALIGNMENT
+)
+
+# Upload sessions interrupted by a failure, by (item path, content digest), so retrying
+# the same upload continues where it stopped instead of starting over
+_interrupted_uploads = {}
+
+def drive_root(location_type, location_id):
+    """Returns the Graph path of a user's OneDrive or a SharePoint site's default library."""
+    if location_type == "onedrive":
+        return f"/v1.0/users/{location_id}/drive"
+    return f"/v1.0/sites/{location_id}/drive"
+
+def drive_item_path(location_type, location_id, file_name, folder_path=""):
+    """Returns the path-addressed Graph item for a file, e.g. '/v1.0/users/x/drive/root:/a/b.docx:'."""
+    if folder_path:
+        return f"{drive_root(location_type, location_id)}/root:/{folder_path}/{file_name}:"
+    return f"{drive_root(location_type, location_id)}/root:/{file_name}:"
+
+class ChunkSource:
+    """Byte ranges of upload content for upload sessions.
+
+    Bytes and seekable binary files can serve any range again. An async
+    iterator of bytes (e.g. a download being streamed) is consumed as the
+    upload advances and only the bytes not yet sent are buffered, so it can
+    resume within the current chunk but never rewind further.
+
+    Args:
+        content: bytes, a seekable binary file, or an async iterator of bytes
+    """
+
+    def __init__(self, content):
+        self.content = content
+        self._buffer = bytearray()
+        self._buffer_start = 0
+
+    async def read(self, offset, end):
+        """Returns the bytes in [offset, end)."""
+        if isinstance(self.content, (bytes, bytearray)):
+            return bytes(self.content[offset:end])
+        if hasattr(self.content, "seek"):
+            self.content.seek(offset)
+            return self.content.read(end - offset)
+
+        if offset < self._buffer_start:
+            raise ValueError(f"Cannot rewind a streamed upload to byte {offset}")
+        # Drop what the session has already accepted, then pull until the range is buffered
+        del self._buffer[:offset - self._buffer_start]
+        self._buffer_start = offset
+        while len(self._buffer) < end - offset:
+            try:
+                self._buffer += await self.content.__anext__()
+            except StopAsyncIteration:
+                break
+        return bytes(memoryview(self._buffer)[:end - offset])
+
+class _ChunkPayload:
+    """Request body for one upload chunk that is released once the chunk is sent.
+
+    httpx keeps a response and its request in a reference cycle, so the chunk
+    bytes would otherwise stay alive until the cyclic garbage collector runs.
+    """
+
+    def __init__(self, data):
+        self.data = data
+
+    async def __aiter__(self):
+        yield self.data
+
+async def upload_file(location_type, location_id, file_name, content, content_type, folder_path="", size=None):
+    """Uploads a file to OneDrive or SharePoint, replacing any existing file.
+
+    Files up to 4 MB are sent with a single PUT. Larger files go through an
+    upload session in 320 KiB-aligned chunks, so a failure only costs the
+    chunk in flight and an interrupted upload of the same bytes resumes.
+
+    Args:
+        location_type: Either 'onedrive' or 'sharepoint'
+        location_id: User ID for OneDrive, or Site ID for SharePoint
+        file_name: Name of the file
+        content: File content as bytes, a seekable binary file, or an async iterator of bytes
+        content_type: MIME type for simple uploads
+        folder_path: Optional folder path
+        size: Content length in bytes; required unless content is bytes
+
+    Returns:
+        The final httpx.Response; 200/201 responses carry the driveItem
+    """
+    graph = get_graph_client()
+    item_path = drive_item_path(location_type, location_id, file_name, folder_path)
+    source = ChunkSource(content)
+    if size is None:
+        size = len(content)
+
+    if size <= GRAPH_SIMPLE_UPLOAD_LIMIT:
+        return await graph.put(
+            f"{item_path}/content",
+            headers={"Content-Type": content_type},
+            content=await source.read(0, size)
+        )
+
+    # Only in-memory content can be recognized again, so only it is resumed across calls
+    key = (item_path, hashlib.sha256(content).hexdigest()) if isinstance(content, bytes) else None
+    upload_url = _interrupted_uploads.pop(key, None)
+    resume = upload_url is not None
+    while True:
+        if upload_url is None:
+            response = await graph.post(
+                f"{item_path}/createUploadSession",
+                json={"item": {"@microsoft.graph.conflictBehavior": "replace"}}
+            )
+            if response.status_code != 200:
+                return response
+            upload_url = response.json()["uploadUrl"]
+
+        try:
+            response = await upload_session_chunks(upload_url, source, size, resume=resume)
+        except httpx.TransportError:
+            if key:
+                _interrupted_uploads[key] = upload_url
+            raise
+        if resume and response.status_code == 404:
+            # The interrupted session expired or was cancelled; start over in a new one
+            upload_url = None
+            resume = False
+            continue
+        break
+    if key and response.status_code not in (200, 201, 404):
+        _interrupted_uploads[key] = upload_url
+    return response
+
+def _next_expected_offset(session):
+    # nextExpectedRanges looks like ["26214400-"] or ["0-1023", "2048-"]
+    ranges = session.get("nextExpectedRanges") or ["0-"]
+    return int(ranges[0].split("-")[0])
+
+async def upload_session_chunks(upload_url, source, size, chunk_size=None, max_resumes=5, resume=False):
+    """Sends content to an upload session chunk by chunk.
+
+    Each chunk is retried by the shared retry scheduler. When a chunk still
+    fails (or its acknowledgement was lost), the session is asked which bytes
+    it is missing and the upload continues from there.
+
+    Args:
+        upload_url: Pre-authenticated upload URL from createUploadSession
+        source: ChunkSource with the file content
+        size: Total content length in bytes
+        chunk_size: Bytes per chunk; a multiple of 320 KiB (GRAPH_UPLOAD_CHUNK_SIZE by default)
+        max_resumes: How many times to resynchronize with the session before giving up
+        resume: The session already holds part of the content; ask it where to continue first
+
+    Returns:
+        The response completing the upload, or the last failed response
+        (404 when the session no longer exists)
+    """
+    graph = get_graph_client()
+    chunk_size = chunk_size or GRAPH_UPLOAD_CHUNK_SIZE
+    offset = 0
+    resumes = 0
+
+    if resume:
+        status = await graph.get(upload_url, authenticate=False)
+        if status.status_code != 200:
+            return status
+        offset = _next_expected_offset(status.json())
+
+    while True:
+        end = min(offset + chunk_size, size)
+        payload = _ChunkPayload(await source.read(offset, end))
+        # The upload URL is pre-authenticated; Graph rejects requests that also carry a bearer token
+        try:
+            response = await graph.put(
+                upload_url,
+                authenticate=False,
+                headers={"Content-Length": str(end - offset), "Content-Range": f"bytes {offset}-{end - 1}/{size}"},
+                content=payload
+            )
+        except httpx.TransportError:
+            if resumes >= max_resumes:
+                raise
+            response = None
+        finally:
+            payload.data = None
+
+        if response is not None and response.status_code in (200, 201):
+            return response
+        if response is not None and response.status_code == 202:
+            offset = _next_expected_offset(response.json())
+            continue
+
+        # Out of sync with the session: resume from the bytes it still expects
+        if resumes >= max_resumes or (response is not None and response.status_code == 404):
+            return response
+        resumes += 1
+        status = await graph.get(upload_url, authenticate=False)
+        if status.status_code != 200:
+            return status
+        offset = _next_expected_offset(status.json())
 
 @mcp.tool()
-def create_file_in_onedrive(user_id: str, file_name: str, content: str, folder_path: str = ""):
+async def create_file_in_onedrive(user_id: str, file_name: str, content: str, folder_path: str = ""):
     """Creates a text file in a user's OneDrive.
     
     Args:
@@ -1030,24 +3264,7 @@ def create_file_in_onedrive(user_id: str, file_name: str, content: str, folder_p
         content: Text content to write to the file
         folder_path: Optional folder path (e.g., 'Documents/MyFolder'). Leave empty for root.
     """
-    access_token = get_access_token()
-    
-    headers = {
-        "Authorization": f"Bearer {access_token}",
-        "Content-Type": "text/plain"
-    }
-    
-    # Build the path
-    if folder_path:
-        path = f"/drive/root:/{folder_path}/{file_name}:/content"
-    else:
-        path = f"/drive/root:/{file_name}:/content"
-    
-    response = requests.put(
-        f"https://graph.microsoft.com/v1.0/users/{user_id}{path}",
-        headers=headers,
-        data=content.encode('utf-8')
-    )
+    response = await upload_file("onedrive", user_id, file_name, content.encode('utf-8'), "text/plain", folder_path)
     
     if response.status_code in [200, 201]:
         result = response.json()
@@ -1063,7 +3280,7 @@ def create_file_in_onedrive(user_id: str, file_name: str, content: str, folder_p
         return {"error": response.text, "status_code": response.status_code}
 
 @mcp.tool()
-def create_file_in_sharepoint(site_id: str, file_name: str, content: str, folder_path: str = ""):
+async def create_file_in_sharepoint(site_id: str, file_name: str, content: str, folder_path: str = ""):
     """Creates a text file in a SharePoint site's document library.
     
     Args:
@@ -1072,24 +3289,7 @@ def create_file_in_sharepoint(site_id: str, file_name: str, content: str, folder
         content: Text content to write to the file
         folder_path: Optional folder path within the document library (e.g., 'Shared Documents/MyFolder')
     """
-    access_token = get_access_token()
-    
-    headers = {
-        "Authorization": f"Bearer {access_token}",
-        "Content-Type": "text/plain"
-    }
-    
-    # Build the path
-    if folder_path:
-        path = f"/drive/root:/{folder_path}/{file_name}:/content"
-    else:
-        path = f"/drive/root:/{file_name}:/content"
-    
-    response = requests.put(
-        f"https://graph.microsoft.com/v1.0/sites/{site_id}{path}",
-        headers=headers,
-        data=content.encode('utf-8')
-    )
+    response = await upload_file("sharepoint", site_id, file_name, content.encode('utf-8'), "text/plain", folder_path)
     
     if response.status_code in [200, 201]:
         result = response.json()
@@ -1104,40 +3304,189 @@ def create_file_in_sharepoint(site_id: str, file_name: str, content: str, folder
     else:
         return {"error": response.text, "status_code": response.status_code}
 
+SITE_FIELDS = (
+    "id",
+    "name",
+    "displayName",
+    "webUrl",
+    "description"
+)
+
 @mcp.tool()
-def list_sharepoint_sites():
+async def list_sharepoint_sites():
     """Lists all SharePoint sites in the tenant."""
-    access_token = get_access_token()
-    
-    headers = {
-        "Authorization": f"Bearer {access_token}",
-        "Content-Type": "application/json"
-    }
+    sites = []
     
-    response = requests.get(
-        "https://graph.microsoft.com/v1.0/sites?search=*",
-        headers=headers
-    )
+    try:
+        async for page in iter_pages("/v1.0/sites?search=*", params=select_params(SITE_FIELDS)):
+            for site in page:
+                sites.append(project(site, SITE_FIELDS))
+    except GraphAPIError as error:
+        return error.to_dict()
     
-    if response.status_code == 200:
-        result = response.json()
-        sites = []
+    return {"sites": sites, "count": len(sites)}
+
+# Worker processes that render Office/ODF documents; zip and XML serialization
+# is CPU-bound Python, so rendering in-process would serialize concurrent tool
+# calls on the GIL (0 = render in a thread instead)
+DOC_RENDER_WORKERS = int(os.getenv("DOC_RENDER_WORKERS", str(min(4, os.cpu_count() or 1))))
+
+_render_pool = None
+
+def get_render_pool():
+    """Returns the shared document rendering process pool, starting it on first use."""
+    global _render_pool
+    if _render_pool is None:
+        # spawn: forking a process that runs an event loop and client threads is unsafe
+        _render_pool = ProcessPoolExecutor(
+            max_workers=DOC_RENDER_WORKERS,
+            mp_context=multiprocessing.get_context("spawn")
+        )
+    return _render_pool
+
+@asynccontextmanager
+async def rendered_document(render, *args):
+    """Renders a document off the event loop and yields it as (binary file, size).
+
+    render is a top-level function taking *args and a target path or file. It
+    runs in the rendering process pool and writes to a temporary file that is
+    removed when the context exits; with DOC_RENDER_WORKERS=0 it runs in a
+    thread and writes to a spooled temporary file instead.
+    """
+    if DOC_RENDER_WORKERS <= 0:
+        with tempfile.SpooledTemporaryFile(max_size=GRAPH_SIMPLE_UPLOAD_LIMIT) as spool:
+            await asyncio.to_thread(render, *args, spool)
+            yield spool, spool.tell()
+        return
+    
+    global _render_pool
+    fd, path = tempfile.mkstemp(prefix="m365-render-")
+    os.close(fd)
+    try:
+        try:
+            await asyncio.get_running_loop().run_in_executor(get_render_pool(), render, *args, path)
+        except BrokenProcessPool:
+            # A worker died; start a fresh pool on the next call
+            _render_pool = None
+            raise
+        with open(path, "rb") as document:
+            yield document, os.path.getsize(path)
+    finally:
+        os.remove(path)
+
+# Server-wide custom templates (.docx/.dotx, .pptx/.potx) used when a call
+# does not name one; empty means the python-docx / python-pptx defaults
+TEMPLATE_PATHS = {
+    "docx": os.getenv("WORD_TEMPLATE_PATH", ""),
+    "pptx": os.getenv("POWERPOINT_TEMPLATE_PATH", "")
+}
+
+# Templates kept per process: parsed packages in rendering workers, downloaded
+# SharePoint templates (keyed by drive item, validated by eTag) in the server
+TEMPLATE_CACHE_SIZE = 16
+_parsed_templates = OrderedDict()
+_downloaded_templates = OrderedDict()
+
+# .dotx/.potx main parts only differ from documents by content type
+TEMPLATE_MAIN_CONTENT_TYPES = {
+    "application/vnd.openxmlformats-officedocument.wordprocessingml.template.main+xml":
+        "application/vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml",
+    "application/vnd.openxmlformats-officedocument.presentationml.template.main+xml":
+        "application/vnd.openxmlformats-officedocument.presentationml.presentation.main+xml"
+}
+
+def as_document_package(data):
+    """Returns the bytes of an OOXML package, rewriting a template (.dotx/.potx) into a document."""
+    with zipfile.ZipFile(io.BytesIO(data)) as source:
+        types = source.read("[Content_Types].xml").decode("utf-8")
+        if not any(template in types for template in TEMPLATE_MAIN_CONTENT_TYPES):
+            return data
+        for template, document in TEMPLATE_MAIN_CONTENT_TYPES.items():
+            types = types.replace(template, document)
         
-        for site in result.get("value", []):
-            sites.append({
-                "id": site.get("id"),
-                "name": site.get("name"),
-                "displayName": site.get("displayName"),
-                "webUrl": site.get("webUrl"),
-                "description": site.get("description")
-            })
+        package = io.BytesIO()
+        with zipfile.ZipFile(package, "w", zipfile.ZIP_DEFLATED) as target:
+            for info in source.infolist():
+                body = types.encode("utf-8") if info.filename == "[Content_Types].xml" else source.read(info)
+                target.writestr(info, body)
+    return package.getvalue()
+
+def load_template(kind, template=None):
+    """Returns a fresh copy of a parsed Word ('docx') or PowerPoint ('pptx') template.
+
+    Each template is unzipped and parsed once per process; later calls get a
+    deep copy of the parsed package, which is several times cheaper than
+    Document()/Presentation() re-reading the file.
+
+    Args:
+        kind: 'docx' or 'pptx'
+        template: Optional (cache key, package bytes) from fetch_template; by
+            default the TEMPLATE_PATHS file or the library's built-in template
+    """
+    if template is None and TEMPLATE_PATHS[kind]:
+        path = TEMPLATE_PATHS[kind]
+        key = (kind, path, os.path.getmtime(path))
+    else:
+        path = None
+        key = (kind, template[0] if template else None)
+    
+    parsed = _parsed_templates.get(key)
+    if parsed is None:
+        if kind == "docx":
+            from docx import Document as opener
+        else:
+            from pptx import Presentation as opener
         
-        return {"sites": sites, "count": len(sites)}
+        if template is not None:
+            parsed = opener(io.BytesIO(template[1]))
+        elif path:
+            with open(path, "rb") as f:
+                parsed = opener(io.BytesIO(as_document_package(f.read())))
+        else:
+            parsed = opener()
+        _parsed_templates[key] = parsed
+        while len(_parsed_templates) > TEMPLATE_CACHE_SIZE:
+            _parsed_templates.popitem(last=False)
     else:
-        return {"error": response.text, "status_code": response.status_code}
+        _parsed_templates.move_to_end(key)
+    return copy.deepcopy(parsed)
+
+async def fetch_template(location_type, location_id, file_id):
+    """Returns (cache key, package bytes) for a template file stored in OneDrive or SharePoint.
+
+    The file is downloaded once and reused while its eTag is unchanged, so a
+    call only costs a metadata request. Raises GraphAPIError on failure.
+    """
+    graph = get_graph_client()
+    item_path = f"{drive_root(location_type, location_id)}/items/{file_id}"
+    
+    response = await graph.get(item_path, params={"$select": "id,eTag"})
+    if response.status_code != 200:
+        raise GraphAPIError(response)
+    etag = response.json().get("eTag")
+    
+    item_key = (location_type, location_id, file_id)
+    cached = _downloaded_templates.get(item_key)
+    if cached is None or cached[0] != etag:
+        response = await graph.get(f"{item_path}/content")
+        if response.status_code != 200:
+            raise GraphAPIError(response)
+        cached = (etag, as_document_package(response.content))
+        _downloaded_templates[item_key] = cached
+        while len(_downloaded_templates) > TEMPLATE_CACHE_SIZE:
+            _downloaded_templates.popitem(last=False)
+    _downloaded_templates.move_to_end(item_key)
+    
+    return f"{location_id}/{file_id}@{etag}", cached[1]
+
+def render_word_document(content, template, target):
+    """Writes a .docx with content as a paragraph to target (path or binary file)."""
+    doc = load_template("docx", template)
+    doc.add_paragraph(content)
+    doc.save(target)
 
 @mcp.tool()
-def create_word_document(location_type: str, location_id: str, file_name: str, content: str, folder_path: str = ""):
+async def create_word_document(location_type: str, location_id: str, file_name: str, content: str, folder_path: str = "", template_file_id: str = ""):
     """Creates a Word document (.docx) in OneDrive or SharePoint.
     
     Args:
@@ -1146,41 +3495,20 @@ def create_word_document(location_type: str, location_id: str, file_name: str, c
         file_name: Name of the file (e.g., 'report.docx')
         content: HTML content to put in the document
         folder_path: Optional folder path
+        template_file_id: Optional ID of a .docx/.dotx in the same location to base the document on
     """
-    import io
-    from docx import Document
-    from docx.shared import Pt
-    
-    # Create Word document
-    doc = Document()
-    
-    # Add content (simple paragraph)
-    paragraph = doc.add_paragraph(content)
-    
-    # Save to bytes
-    doc_bytes = io.BytesIO()
-    doc.save(doc_bytes)
-    doc_bytes.seek(0)
-    
-    access_token = get_access_token()
-    headers = {
-        "Authorization": f"Bearer {access_token}",
-        "Content-Type": "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
-    }
-    
-    # Build URL based on location type
-    if location_type == "onedrive":
-        if folder_path:
-            url = f"https://graph.microsoft.com/v1.0/users/{location_id}/drive/root:/{folder_path}/{file_name}:/content"
-        else:
-            url = f"https://graph.microsoft.com/v1.0/users/{location_id}/drive/root:/{file_name}:/content"
-    else:  # sharepoint
-        if folder_path:
-            url = f"https://graph.microsoft.com/v1.0/sites/{location_id}/drive/root:/{folder_path}/{file_name}:/content"
-        else:
-            url = f"https://graph.microsoft.com/v1.0/sites/{location_id}/drive/root:/{file_name}:/content"
+    template = None
+    if template_file_id:
+        try:
+            template = await fetch_template(location_type, location_id, template_file_id)
+        except GraphAPIError as error:
+            return error.to_dict()
     
-    response = requests.put(url, headers=headers, data=doc_bytes.getvalue())
+    async with rendered_document(render_word_document, content, template) as (document, size):
+        response = await upload_file(
+            location_type, location_id, file_name, document,
+            "application/vnd.openxmlformats-officedocument.wordprocessingml.document", folder_path, size=size
+        )
     
     if response.status_code in [200, 201]:
         result = response.json()
@@ -1194,10 +3522,32 @@ def create_word_document(location_type: str, location_id: str, file_name: str, c
     else:
         return {"error": response.text, "status_code": response.status_code}
 
+def render_excel_workbook(data, target):
+    """Writes rows to a single-sheet .xlsx in openpyxl's write-only mode.
+
+    Rows are serialized as they are appended instead of being kept as cell
+    objects, so memory does not grow with the number of rows.
+
+    Args:
+        data: Iterable of rows (lists of cell values)
+        target: Path or writable binary file for the workbook
+    """
+    from openpyxl import Workbook
+    
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("Sheet1")
+    for row in data:
+        ws.append(row)
+    wb.save(target)
+
 @mcp.tool()
-def create_excel_workbook(location_type: str, location_id: str, file_name: str, data: list, folder_path: str = ""):
+async def create_excel_workbook(location_type: str, location_id: str, file_name: str, data: list, folder_path: str = ""):
     """Creates an Excel workbook (.xlsx) in OneDrive or SharePoint.
     
+    The workbook is written in streaming mode to a temporary file by a
+    rendering worker and then uploaded in chunks, so large datasets need
+    neither per-cell objects nor an in-memory copy of the file.
+    
     Args:
         location_type: Either 'onedrive' or 'sharepoint'
         location_id: User ID for OneDrive, or Site ID for SharePoint
@@ -1205,42 +3555,11 @@ def create_excel_workbook(location_type: str, location_id: str, file_name: str,
         data: List of lists representing rows (e.g., [['Name', 'Age'], ['John', 30]])
         folder_path: Optional folder path
     """
-    import io
-    from openpyxl import Workbook
-    
-    # Create Excel workbook
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "Sheet1"
-    
-    # Add data
-    for row in data:
-        ws.append(row)
-    
-    # Save to bytes
-    excel_bytes = io.BytesIO()
-    wb.save(excel_bytes)
-    excel_bytes.seek(0)
-    
-    access_token = get_access_token()
-    headers = {
-        "Authorization": f"Bearer {access_token}",
-        "Content-Type": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-    }
-    
-    # Build URL based on location type
-    if location_type == "onedrive":
-        if folder_path:
-            url = f"https://graph.microsoft.com/v1.0/users/{location_id}/drive/root:/{folder_path}/{file_name}:/content"
-        else:
-            url = f"https://graph.microsoft.com/v1.0/users/{location_id}/drive/root:/{file_name}:/content"
-    else:  # sharepoint
-        if folder_path:
-            url = f"https://graph.microsoft.com/v1.0/sites/{location_id}/drive/root:/{folder_path}/{file_name}:/content"
-        else:
-            url = f"https://graph.microsoft.com/v1.0/sites/{location_id}/drive/root:/{file_name}:/content"
-    
-    response = requests.put(url, headers=headers, data=excel_bytes.getvalue())
+    async with rendered_document(render_excel_workbook, data) as (workbook, size):
+        response = await upload_file(
+            location_type, location_id, file_name, workbook,
+            "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", folder_path, size=size
+        )
     
     if response.status_code in [200, 201]:
         result = response.json()
@@ -1254,8 +3573,23 @@ def create_excel_workbook(location_type: str, location_id: str, file_name: str,
     else:
         return {"error": response.text, "status_code": response.status_code}
 
+def render_powerpoint_presentation(title, content, template, target):
+    """Writes a .pptx with a title slide to target (path or binary file)."""
+    prs = load_template("pptx", template)
+    
+    # Add title slide; custom templates may lack the title or body placeholder
+    title_slide_layout = prs.slide_layouts[0]
+    slide = prs.slides.add_slide(title_slide_layout)
+    if slide.shapes.title is not None:
+        slide.shapes.title.text = title
+    body = next((shape for shape in slide.placeholders if shape.placeholder_format.idx == 1), None)
+    if body is not None:
+        body.text = content
+    
+    prs.save(target)
+
 @mcp.tool()
-def create_powerpoint_presentation(location_type: str, location_id: str, file_name: str, title: str, content: str, folder_path: str = ""):
+async def create_powerpoint_presentation(location_type: str, location_id: str, file_name: str, title: str, content: str, folder_path: str = "", template_file_id: str = ""):
     """Creates a PowerPoint presentation (.pptx) in OneDrive or SharePoint.
     
     Args:
@@ -1265,44 +3599,20 @@ def create_powerpoint_presentation(location_type: str, location_id: str, file_na
         title: Title for the first slide
         content: Content for the first slide
         folder_path: Optional folder path
+        template_file_id: Optional ID of a .pptx/.potx in the same location to base the presentation on
     """
-    import io
-    from pptx import Presentation
-    from pptx.util import Inches, Pt
-    
-    # Create PowerPoint presentation
-    prs = Presentation()
-    
-    # Add title slide
-    title_slide_layout = prs.slide_layouts[0]
-    slide = prs.slides.add_slide(title_slide_layout)
-    slide.shapes.title.text = title
-    slide.placeholders[1].text = content
-    
-    # Save to bytes
-    pptx_bytes = io.BytesIO()
-    prs.save(pptx_bytes)
-    pptx_bytes.seek(0)
-    
-    access_token = get_access_token()
-    headers = {
-        "Authorization": f"Bearer {access_token}",
-        "Content-Type": "application/vnd.openxmlformats-officedocument.presentationml.presentation"
-    }
-    
-    # Build URL based on location type
-    if location_type == "onedrive":
-        if folder_path:
-            url = f"https://graph.microsoft.com/v1.0/users/{location_id}/drive/root:/{folder_path}/{file_name}:/content"
-        else:
-            url = f"https://graph.microsoft.com/v1.0/users/{location_id}/drive/root:/{file_name}:/content"
-    else:  # sharepoint
-        if folder_path:
-            url = f"https://graph.microsoft.com/v1.0/sites/{location_id}/drive/root:/{folder_path}/{file_name}:/content"
-        else:
-            url = f"https://graph.microsoft.com/v1.0/sites/{location_id}/drive/root:/{file_name}:/content"
+    template = None
+    if template_file_id:
+        try:
+            template = await fetch_template(location_type, location_id, template_file_id)
+        except GraphAPIError as error:
+            return error.to_dict()
     
-    response = requests.put(url, headers=headers, data=pptx_bytes.getvalue())
+    async with rendered_document(render_powerpoint_presentation, title, content, template) as (presentation, size):
+        response = await upload_file(
+            location_type, location_id, file_name, presentation,
+            "application/vnd.openxmlformats-officedocument.presentationml.presentation", folder_path, size=size
+        )
     
     if response.status_code in [200, 201]:
         result = response.json()
@@ -1316,8 +3626,56 @@ def create_powerpoint_presentation(location_type: str, location_id: str, file_na
     else:
         return {"error": response.text, "status_code": response.status_code}
 
+async def convert_item_to_pdf(location_type, location_id, file_id, pdf_name, output_folder="", convert_response=None):
+    """Streams the PDF rendition of a drive item into a new file next to it or in output_folder.
+
+    The PDF is uploaded while it downloads, so only about one chunk is held in
+    memory. Raises GraphAPIError when Graph cannot convert the file.
+
+    Args:
+        location_type: Either 'onedrive' or 'sharepoint'
+        location_id: User ID for OneDrive, or Site ID for SharePoint
+        file_id: ID of the file to convert
+        pdf_name: Name of the PDF to create
+        output_folder: Optional folder path for the PDF
+        convert_response: Optional ?format=pdf response already fetched (e.g. through $batch)
+
+    Returns:
+        The upload httpx.Response; 200/201 responses carry the PDF's driveItem
+    """
+    graph = get_graph_client()
+    convert_url = f"{drive_root(location_type, location_id)}/items/{file_id}/content?format=pdf"
+    
+    # $batch does not follow the redirect to the download URL
+    if convert_response is not None and convert_response.status_code in (302, 303) and convert_response.headers.get("Location"):
+        download = graph.stream("GET", convert_response.headers["Location"], authenticate=False)
+    else:
+        download = graph.stream("GET", convert_url)
+    
+    async with download as response:
+        if response.status_code != 200:
+            await response.aread()
+            raise GraphAPIError(response)
+        
+        # Content-Length counts the encoded bytes; aiter_bytes() yields them decoded
+        encoding = response.headers.get("Content-Encoding", "identity").lower()
+        if response.headers.get("Content-Length") and encoding == "identity":
+            return await upload_file(
+                location_type, location_id, pdf_name, response.aiter_bytes(),
+                "application/pdf", output_folder, size=int(response.headers["Content-Length"])
+            )
+        
+        # Upload sessions need the total size up front; spool to disk past a few MB
+        with tempfile.SpooledTemporaryFile(max_size=GRAPH_SIMPLE_UPLOAD_LIMIT) as spool:
+            async for chunk in response.aiter_bytes():
+                spool.write(chunk)
+            return await upload_file(
+                location_type, location_id, pdf_name, spool,
+                "application/pdf", output_folder, size=spool.tell()
+            )
+
 @mcp.tool()
-def convert_file_to_pdf(location_type: str, location_id: str, file_id: str, output_folder: str = ""):
+async def convert_file_to_pdf(location_type: str, location_id: str, file_id: str, output_folder: str = ""):
     """Converts a file to PDF in OneDrive or SharePoint.
     
     Args:
@@ -1328,20 +3686,11 @@ def convert_file_to_pdf(location_type: str, location_id: str, file_id: str, outp
     
     Note: This works for Word, Excel, PowerPoint files
     """
-    access_token = get_access_token()
-    
-    # First, get the file info to get its name
-    headers = {
-        "Authorization": f"Bearer {access_token}",
-        "Content-Type": "application/json"
-    }
-    
-    if location_type == "onedrive":
-        get_url = f"https://graph.microsoft.com/v1.0/users/{location_id}/drive/items/{file_id}"
-    else:  # sharepoint
-        get_url = f"https://graph.microsoft.com/v1.0/sites/{location_id}/drive/items/{file_id}"
+    get_url = f"{drive_root(location_type, location_id)}/items/{file_id}"
+    convert_url = f"{get_url}/content?format=pdf"
     
-    response = requests.get(get_url, headers=headers)
+    # Get the file info (for its name) and the PDF download location in one round trip
+    response, convert_response = await batch_requests([{"url": get_url}, {"url": convert_url}])
     
     if response.status_code != 200:
         return {"error": "Failed to get file info", "status_code": response.status_code, "details": response.text}
@@ -1350,37 +3699,12 @@ def convert_file_to_pdf(location_type: str, location_id: str, file_id: str, outp
     original_name = file_info.get("name", "")
     pdf_name = original_name.rsplit('.', 1)[0] + '.pdf'
     
-    # Get the PDF content
-    if location_type == "onedrive":
-        convert_url = f"https://graph.microsoft.com/v1.0/users/{location_id}/drive/items/{file_id}/content?format=pdf"
-    else:  # sharepoint
-        convert_url = f"https://graph.microsoft.com/v1.0/sites/{location_id}/drive/items/{file_id}/content?format=pdf"
-    
-    response = requests.get(convert_url, headers={"Authorization": f"Bearer {access_token}"})
-    
-    if response.status_code != 200:
-        return {"error": "Failed to convert file", "status_code": response.status_code, "details": response.text}
-    
-    pdf_content = response.content
-    
-    # Upload the PDF
-    pdf_headers = {
-        "Authorization": f"Bearer {access_token}",
-        "Content-Type": "application/pdf"
-    }
-    
-    if location_type == "onedrive":
-        if output_folder:
-            upload_url = f"https://graph.microsoft.com/v1.0/users/{location_id}/drive/root:/{output_folder}/{pdf_name}:/content"
-        else:
-            upload_url = f"https://graph.microsoft.com/v1.0/users/{location_id}/drive/root:/{pdf_name}:/content"
-    else:  # sharepoint
-        if output_folder:
-            upload_url = f"https://graph.microsoft.com/v1.0/sites/{location_id}/drive/root:/{output_folder}/{pdf_name}:/content"
-        else:
-            upload_url = f"https://graph.microsoft.com/v1.0/sites/{location_id}/drive/root:/{pdf_name}:/content"
-    
-    upload_response = requests.put(upload_url, headers=pdf_headers, data=pdf_content)
+    try:
+        upload_response = await convert_item_to_pdf(
+            location_type, location_id, file_id, pdf_name, output_folder, convert_response
+        )
+    except GraphAPIError as error:
+        return {"error": "Failed to convert file", "status_code": error.status_code, "details": error.text}
     
     if upload_response.status_code in [200, 201]:
         result = upload_response.json()
@@ -1395,8 +3719,111 @@ def convert_file_to_pdf(location_type: str, location_id: str, file_id: str, outp
     else:
         return {"error": "Failed to upload PDF", "status_code": upload_response.status_code, "details": upload_response.text}
 
+# Extensions Graph can render as PDF (?format=pdf)
+PDF_CONVERTIBLE_EXTENSIONS = (
+    ".csv", ".doc", ".docx", ".odp", ".ods", ".odt", ".pot", ".potm", ".potx", ".pps",
+    ".ppsx", ".ppsxm", ".ppt", ".pptm", ".pptx", ".rtf", ".xls", ".xlsx"
+)
+
+DRIVE_CHILD_FIELDS = ("id", "name", "size", "file", "folder", "lastModifiedDateTime")
+
+def drive_children_path(location_type, location_id, folder_path=""):
+    """Returns the Graph path listing the children of a drive folder."""
+    if folder_path:
+        return f"{drive_root(location_type, location_id)}/root:/{folder_path.strip('/')}:/children"
+    return f"{drive_root(location_type, location_id)}/root/children"
+
+@mcp.tool()
+async def convert_folder_to_pdf(location_type: str, location_id: str, folder_path: str = "",
+                                output_folder: Optional[str] = None, concurrency: Optional[int] = None,
+                                overwrite: bool = False):
+    """Converts every Office file in a OneDrive or SharePoint folder to PDF.
+    
+    Files are converted in parallel. A file is skipped when a PDF with the same
+    name in the output folder was modified after it, unless overwrite is set.
+    
+    Args:
+        location_type: Either 'onedrive' or 'sharepoint'
+        location_id: User ID for OneDrive, or Site ID for SharePoint
+        folder_path: Folder to convert (empty for the drive root)
+        output_folder: Optional folder path for the PDFs (defaults to the source folder)
+        concurrency: Maximum conversions in flight (defaults to GRAPH_FANOUT_CONCURRENCY;
+            capped at half of GRAPH_POOL_MAXSIZE, the number of downloads the client keeps open at once)
+        overwrite: Convert files even when their PDF is already up to date
+    """
+    if output_folder is None:
+        output_folder = folder_path
+    # Each conversion keeps its download open while uploading; more workers would only queue for it
+    concurrency = min(concurrency or int(os.getenv("GRAPH_FANOUT_CONCURRENCY", "8")), get_graph_client().stream_limit)
+    started = time.perf_counter()
+    
+    # List the source folder, and the output folder when it differs, in full
+    listings = [folder_path] if output_folder.strip("/") == folder_path.strip("/") else [folder_path, output_folder]
+    children = {}
+    for path in listings:
+        children[path] = []
+        try:
+            async for page in iter_pages(drive_children_path(location_type, location_id, path), params=select_params(DRIVE_CHILD_FIELDS)):
+                children[path].extend(page)
+        except GraphAPIError as error:
+            if path == folder_path or error.status_code != 404:
+                return error.to_dict()
+    
+    existing_pdfs = {
+        item["name"].lower(): item.get("lastModifiedDateTime", "")
+        for item in children[listings[-1]]
+        if "file" in item and item["name"].lower().endswith(".pdf")
+    }
+    sources = [
+        item for item in children[folder_path]
+        if "file" in item and item["name"].lower().endswith(PDF_CONVERTIBLE_EXTENSIONS)
+    ]
+    
+    async def convert(item):
+        pdf_name = item["name"].rsplit('.', 1)[0] + '.pdf'
+        result = {"file": item["name"], "id": item["id"], "pdf": pdf_name}
+        
+        # ISO 8601 timestamps in UTC compare correctly as strings
+        pdf_modified = existing_pdfs.get(pdf_name.lower())
+        if not overwrite and pdf_modified and pdf_modified >= item.get("lastModifiedDateTime", ""):
+            result["status"] = "skipped"
+            return result
+        
+        file_started = time.perf_counter()
+        try:
+            upload_response = await convert_item_to_pdf(location_type, location_id, item["id"], pdf_name, output_folder)
+        except GraphAPIError as error:
+            result.update(status="failed", error="Failed to convert file", status_code=error.status_code)
+        except httpx.HTTPError as error:
+            result.update(status="failed", error=str(error))
+        else:
+            if upload_response.status_code in [200, 201]:
+                uploaded = upload_response.json()
+                result.update(status="converted", pdfId=uploaded.get("id"), size=uploaded.get("size"), webUrl=uploaded.get("webUrl"))
+            else:
+                result.update(status="failed", error="Failed to upload PDF", status_code=upload_response.status_code)
+        result["seconds"] = round(time.perf_counter() - file_started, 3)
+        return result
+    
+    results = await fan_out(sources, convert, concurrency)
+    
+    elapsed = time.perf_counter() - started
+    converted = [result for result in results if result["status"] == "converted"]
+    converted_bytes = sum(result.get("size") or 0 for result in converted)
+    return {
+        "results": results,
+        "total": len(results),
+        "converted": len(converted),
+        "skipped": sum(1 for result in results if result["status"] == "skipped"),
+        "failed": sum(1 for result in results if result["status"] == "failed"),
+        "concurrency": concurrency,
+        "elapsed_seconds": round(elapsed, 3),
+        "files_per_second": round(len(converted) / elapsed, 2) if elapsed else None,
+        "megabytes_per_second": round(converted_bytes / elapsed / 1e6, 2) if elapsed else None
+    }
+
 @mcp.tool()
-def create_csv_file(location_type: str, location_id: str, file_name: str, data: list, folder_path: str = ""):
+async def create_csv_file(location_type: str, location_id: str, file_name: str, data: list, folder_path: str = ""):
     """Creates a CSV file in OneDrive or SharePoint.
     
     Args:
@@ -1417,25 +3844,10 @@ def create_csv_file(location_type: str, location_id: str, file_name: str, data:
     
     csv_content = csv_buffer.getvalue()
     
-    access_token = get_access_token()
-    headers = {
-        "Authorization": f"Bearer {access_token}",
-        "Content-Type": "text/csv"
-    }
-    
-    # Build URL
-    if location_type == "onedrive":
-        if folder_path:
-            url = f"https://graph.microsoft.com/v1.0/users/{location_id}/drive/root:/{folder_path}/{file_name}:/content"
-        else:
-            url = f"https://graph.microsoft.com/v1.0/users/{location_id}/drive/root:/{file_name}:/content"
-    else:  # sharepoint
-        if folder_path:
-            url = f"https://graph.microsoft.com/v1.0/sites/{location_id}/drive/root:/{folder_path}/{file_name}:/content"
-        else:
-            url = f"https://graph.microsoft.com/v1.0/sites/{location_id}/drive/root:/{file_name}:/content"
-    
-    response = requests.put(url, headers=headers, data=csv_content.encode('utf-8'))
+    response = await upload_file(
+        location_type, location_id, file_name, csv_content.encode('utf-8'),
+        "text/csv", folder_path
+    )
     
     if response.status_code in [200, 201]:
         result = response.json()
@@ -1449,42 +3861,339 @@ def create_csv_file(location_type: str, location_id: str, file_name: str, data:
     else:
         return {"error": response.text, "status_code": response.status_code}
 
+# Rows read_csv_file returns per call unless a limit is given (0 = no cap)
+CSV_READ_MAX_ROWS = int(os.getenv("CSV_READ_MAX_ROWS", "1000"))
+
+async def iter_csv_blocks(byte_chunks, encoding="utf-8-sig"):
+    """Splits a byte stream into blocks of complete CSV records as it downloads.
+
+    Chunks are decoded incrementally and cut at the last line break outside a
+    quoted field, so a record that spans two chunks or has a newline in a
+    quoted value always ends up whole in one block. Parse each block with
+    csv.reader(io.StringIO(block, newline="")).
+
+    Args:
+        byte_chunks: Async iterator of bytes (e.g. response.aiter_bytes())
+        encoding: Text encoding of the file; the default strips a UTF-8 BOM
+    """
+    decoder = codecs.getincrementaldecoder(encoding)(errors="replace")
+    carry = ""
+    
+    async for chunk in byte_chunks:
+        text = carry + decoder.decode(chunk)
+        cut = text.rfind("\n") + 1
+        quotes = text.count('"', 0, cut)
+        # An odd number of quotes means the cut falls inside a quoted field
+        while cut and quotes % 2:
+            previous = text.rfind("\n", 0, cut - 1) + 1
+            quotes -= text.count('"', previous, cut)
+            cut = previous
+        carry = text[cut:]
+        if cut:
+            yield text[:cut]
+    
+    carry += decoder.decode(b"", final=True)
+    if carry:
+        yield carry
+
+async def iter_csv_file(location_type, location_id, file_id):
+    """Yields blocks of complete CSV records from a drive file as it downloads.
+
+    Raises GraphAPIError when the file cannot be downloaded. Close the
+    generator (aclose) when stopping early so the download is released.
+
+    Args:
+        location_type: Either 'onedrive' or 'sharepoint'
+        location_id: User ID for OneDrive, or Site ID for SharePoint
+        file_id: The ID of the CSV file
+    """
+    graph = get_graph_client()
+    
+    async with graph.stream("GET", f"{drive_root(location_type, location_id)}/items/{file_id}/content") as response:
+        if response.status_code != 200:
+            await response.aread()
+            raise GraphAPIError(response)
+        
+        async for block in iter_csv_blocks(response.aiter_bytes()):
+            yield block
+
+class ColumnSummary:
+    """Streaming statistics for one CSV column, fed a block of values at a time.
+
+    Types are inferred as the blocks arrive (integer, number, boolean, date or
+    string; a column that stops fitting its type is widened). Numbers are
+    converted per block into array('q')/array('d') so min/max/sum run in C,
+    distinct values are estimated with a k-minimum-values sketch and the most
+    frequent values are tracked with a bounded space-saving table, so memory
+    per column stays constant however large the file is.
+    """
+    
+    DISTINCT_K = 1024
+    TOP_CAPACITY = 64
+    TOP_VALUES = 5
+    HASH_MASK = (1 << 64) - 1
+    BOOLEAN_VALUES = {"true", "false"}
+    # int() and float() also accept "nan", "inf", "1_000" and padded values
+    INTEGER = re.compile(r"[+-]?[0-9]+")
+    NUMBER = re.compile(r"[+-]?([0-9]+\.?[0-9]*|\.[0-9]+)([eE][+-]?[0-9]+)?")
+    
+    def __init__(self, name):
+        self.name = name
+        self.count = 0
+        self.nulls = 0
+        self.kind = None
+        self.minimum = None
+        self.maximum = None
+        self.total = 0
+        self.text_minimum = None
+        self.text_maximum = None
+        self.hashes = set()
+        self.threshold = None
+        self.top = {}
+        self.top_errors = {}
+        self.top_approximate = False
+    
+    def update(self, values):
+        present = list(filter(None, values))
+        self.nulls += len(values) - len(present)
+        if not present:
+            return
+        self.count += len(present)
+        counts = Counter(present)
+        
+        lo, hi = min(counts), max(counts)
+        self.text_minimum = lo if self.text_minimum is None else min(self.text_minimum, lo)
+        self.text_maximum = hi if self.text_maximum is None else max(self.text_maximum, hi)
+        
+        self._update_kind(present, counts)
+        self._update_distinct(counts)
+        self._update_top(counts)
+    
+    def _update_kind(self, present, counts):
+        if self.kind in (None, "integer", "number"):
+            numbers, kind = self._numeric(present)
+            if numbers is not None:
+                lo, hi = min(numbers), max(numbers)
+                self.minimum = lo if self.minimum is None else min(self.minimum, lo)
+                self.maximum = hi if self.maximum is None else max(self.maximum, hi)
+                self.total += math.fsum(numbers) if kind == "number" else sum(numbers)
+                if self.kind != "number":
+                    self.kind = kind
+                return
+        
+        if self.kind in (None, "boolean") and {value.lower() for value in counts} <= self.BOOLEAN_VALUES:
+            self.kind = "boolean"
+        elif self.kind in (None, "date") and all(map(self._is_date, counts)):
+            self.kind = "date"
+        else:
+            self.kind = "string"
+    
+    def _numeric(self, present):
+        if self.kind in (None, "integer") and all(map(self.INTEGER.fullmatch, present)):
+            try:
+                return array("q", map(int, present)), "integer"
+            except OverflowError:
+                pass
+        if all(map(self.NUMBER.fullmatch, present)):
+            return array("d", map(float, present)), "number"
+        return None, None
+    
+    @staticmethod
+    def _is_date(value):
+        try:
+            datetime.fromisoformat(value.replace("Z", "+00:00"))
+        except ValueError:
+            return False
+        return True
+    
+    def _update_distinct(self, counts):
+        hashes = {hash(value) & self.HASH_MASK for value in counts}
+        if self.threshold is not None:
+            hashes = {h for h in hashes if h <= self.threshold}
+        self.hashes |= hashes
+        # Trimming back to k only once 2k are held keeps the heap work amortized
+        if len(self.hashes) > 2 * self.DISTINCT_K:
+            self._trim()
+    
+    def _trim(self):
+        smallest = heapq.nsmallest(self.DISTINCT_K, self.hashes)
+        self.hashes = set(smallest)
+        self.threshold = smallest[-1]
+    
+    def _update_top(self, counts):
+        if len(counts) > self.TOP_CAPACITY:
+            self.top_approximate = True
+        for value, count in counts.most_common(self.TOP_CAPACITY):
+            if value in self.top:
+                self.top[value] += count
+            elif len(self.top) < self.TOP_CAPACITY:
+                self.top[value] = count
+            else:
+                # Space-saving: the new value inherits the evicted minimum as its error
+                victim = min(self.top, key=self.top.get)
+                floor = self.top.pop(victim)
+                self.top_errors.pop(victim, None)
+                self.top[value] = floor + count
+                self.top_errors[value] = floor
+                self.top_approximate = True
+    
+    def result(self):
+        if len(self.hashes) > self.DISTINCT_K:
+            self._trim()
+        if self.threshold is None:
+            distinct = len(self.hashes)
+        else:
+            distinct = round((self.DISTINCT_K - 1) * (self.HASH_MASK + 1) / (self.threshold + 1))
+        
+        summary = {
+            "column": self.name,
+            "type": self.kind or "empty",
+            "count": self.count,
+            "nulls": self.nulls,
+            "distinct": distinct,
+            "distinct_exact": self.threshold is None
+        }
+        if self.kind in ("integer", "number"):
+            summary.update(min=self.minimum, max=self.maximum, sum=self.total,
+                           mean=self.total / self.count if self.count else None)
+        elif self.count:
+            summary.update(min=self.text_minimum, max=self.text_maximum)
+        
+        # Evicted counts are inherited, so an estimate may overshoot by up to its
+        # error; rank by the guaranteed count and leave out values never seen twice
+        top = []
+        for value, count in self.top.items():
+            guaranteed = count - self.top_errors.get(value, 0)
+            if guaranteed > 1 or not self.top_approximate:
+                entry = {"value": value, "count": count}
+                if self.top_approximate:
+                    entry["min_count"] = guaranteed
+                top.append(entry)
+        top.sort(key=lambda entry: (entry.get("min_count", entry["count"]), entry["count"]), reverse=True)
+        summary["top"] = top[:self.TOP_VALUES]
+        summary["top_exact"] = not self.top_approximate
+        return summary
+
 @mcp.tool()
-def read_csv_file(location_type: str, location_id: str, file_id: str):
+async def read_csv_file(
+    location_type: str,
+    location_id: str,
+    file_id: str,
+    offset: int = 0,
+    limit: Optional[int] = None,
+    columns: Optional[list] = None,
+    count_only: bool = False,
+    summary: bool = False
+):
     """Reads a CSV file from OneDrive or SharePoint and returns the data.
     
+    The file is parsed while it downloads, so memory stays flat regardless of
+    its size and the download stops as soon as the requested rows are read.
+    The first row is treated as the header and always returned first in data.
+    In every mode rows counts the records of the file read, header included,
+    and data_rows the same records without the header. With summary=True the whole file is scanned once and per-column statistics
+    (type, nulls, distinct estimate, min/max/sum/mean, top values) are returned
+    instead of rows.
+    
     Args:
         location_type: Either 'onedrive' or 'sharepoint'
         location_id: User ID for OneDrive, or Site ID for SharePoint
         file_id: The ID of the CSV file to read
+        offset: Number of data rows (after the header) to skip
+        limit: Maximum number of data rows to return (default CSV_READ_MAX_ROWS, 0 for all)
+        columns: Optional list of header names to return, in that order
+        count_only: Only count the rows without returning them
+        summary: Return per-column statistics instead of rows (offset/limit are ignored)
     
     Returns:
-        List of lists representing the CSV data
+        List of lists representing the CSV data, with has_more/next_offset for paging
     """
-    import csv
-    import io
-    
-    access_token = get_access_token()
-    headers = {"Authorization": f"Bearer {access_token}"}
-    
-    # Get file content
-    if location_type == "onedrive":
-        url = f"https://graph.microsoft.com/v1.0/users/{location_id}/drive/items/{file_id}/content"
-    else:  # sharepoint
-        url = f"https://graph.microsoft.com/v1.0/sites/{location_id}/drive/items/{file_id}/content"
-    
-    response = requests.get(url, headers=headers)
-    
-    if response.status_code == 200:
-        csv_content = response.text
-        csv_reader = csv.reader(io.StringIO(csv_content))
-        data = [row for row in csv_reader]
-        return {"data": data, "rows": len(data), "columns": len(data[0]) if data else 0}
-    else:
-        return {"error": response.text, "status_code": response.status_code}
+    if limit is None:
+        limit = CSV_READ_MAX_ROWS
+    offset = max(offset, 0)
+    
+    header = None
+    indexes = None
+    data = []
+    skipped = 0
+    records = 0
+    has_more = False
+    
+    blocks = iter_csv_file(location_type, location_id, file_id)
+    try:
+        async for block in blocks:
+            reader = csv.reader(io.StringIO(block, newline=""))
+            if header is None:
+                header = next(reader, [])
+                if columns and not count_only:
+                    missing = [name for name in columns if name not in header]
+                    if missing:
+                        return {"error": f"Unknown columns: {', '.join(missing)}", "available_columns": header}
+                    indexes = [header.index(name) for name in columns]
+                    header = list(columns)
+                summaries = [ColumnSummary(name) for name in header]
+            
+            if count_only:
+                # Without quotes every line is one record, so counting needs no parsing
+                if '"' in block:
+                    records += sum(1 for _ in csv.reader(io.StringIO(block, newline="")))
+                else:
+                    records += block.count("\n") + (not block.endswith("\n"))
+                continue
+            
+            if summary:
+                # Blank lines are counted but not summarized; short rows count as nulls
+                rows = list(reader)
+                records += len(rows)
+                rows = list(filter(None, rows))
+                if rows:
+                    values = list(zip_longest(*rows, fillvalue=""))
+                    for position, stats in enumerate(summaries):
+                        index = indexes[position] if indexes is not None else position
+                        stats.update(values[index] if index < len(values) else ("",) * len(rows))
+                continue
+            
+            if skipped < offset:
+                skipped += sum(1 for _ in islice(reader, offset - skipped))
+                if skipped < offset:
+                    continue
+            
+            for row in islice(reader, limit - len(data) if limit else None):
+                if indexes is not None:
+                    row = [row[i] if i < len(row) else "" for i in indexes]
+                data.append(row)
+            
+            if limit and len(data) >= limit and next(reader, None) is not None:
+                has_more = True
+                break
+    except GraphAPIError as error:
+        return error.to_dict()
+    finally:
+        await blocks.aclose()
+    
+    if header is None:
+        return {"data": [], "rows": 0, "data_rows": 0, "columns": 0}
+    
+    if count_only:
+        return {"rows": records, "data_rows": records - 1, "columns": len(header), "header": header}
+    
+    if summary:
+        return {"rows": records + 1, "data_rows": records, "columns": len(header), "summary": [stats.result() for stats in summaries]}
+    
+    result = {
+        "data": [header] + data,
+        "rows": len(data) + 1,
+        "data_rows": len(data),
+        "columns": len(header),
+        "offset": offset,
+        "has_more": has_more
+    }
+    if has_more:
+        result["next_offset"] = offset + len(data)
+    return result
 
 @mcp.tool()
-def export_powerpoint_slide_as_image(location_type: str, location_id: str, file_id: str, slide_index: int, image_format: str = "png", output_folder: str = ""):
+async def export_powerpoint_slide_as_image(location_type: str, location_id: str, file_id: str, slide_index: int, image_format: str = "png", output_folder: str = ""):
     """Exports a PowerPoint slide as an image (PNG, JPG, GIF, BMP, TIFF).
     
     Args:
@@ -1495,16 +4204,12 @@ def export_powerpoint_slide_as_image(location_type: str, location_id: str, file_
         image_format: Image format - 'png', 'jpg', 'gif', 'bmp', or 'tiff'
         output_folder: Optional folder path to save the image
     """
-    access_token = get_access_token()
+    graph = get_graph_client()
     
     # First, get file info for naming
-    headers = {"Authorization": f"Bearer {access_token}"}
-    if location_type == "onedrive":
-        info_url = f"https://graph.microsoft.com/v1.0/users/{location_id}/drive/items/{file_id}"
-    else:
-        info_url = f"https://graph.microsoft.com/v1.0/sites/{location_id}/drive/items/{file_id}"
+    info_url = f"{drive_root(location_type, location_id)}/items/{file_id}"
     
-    info_response = requests.get(info_url, headers=headers)
+    info_response = await graph.get(info_url)
     if info_response.status_code != 200:
         return {"error": "Failed to get file info", "status_code": info_response.status_code}
     
@@ -1515,12 +4220,9 @@ def export_powerpoint_slide_as_image(location_type: str, location_id: str, file_
     # Get slide as image (using thumbnail API with high resolution)
     # Note: Full slide export requires PowerPoint Online API which has limitations
     # Using thumbnail API as a workaround
-    if location_type == "onedrive":
-        thumb_url = f"https://graph.microsoft.com/v1.0/users/{location_id}/drive/items/{file_id}/thumbnails/0/large/content"
-    else:
-        thumb_url = f"https://graph.microsoft.com/v1.0/sites/{location_id}/drive/items/{file_id}/thumbnails/0/large/content"
+    thumb_url = f"{drive_root(location_type, location_id)}/items/{file_id}/thumbnails/0/large/content"
     
-    thumb_response = requests.get(thumb_url, headers=headers)
+    thumb_response = await graph.get(thumb_url)
     
     if thumb_response.status_code == 200:
         image_content = thumb_response.content
@@ -1534,23 +4236,10 @@ def export_powerpoint_slide_as_image(location_type: str, location_id: str, file_
             "tiff": "image/tiff"
         }
         
-        upload_headers = {
-            "Authorization": f"Bearer {access_token}",
-            "Content-Type": content_types.get(image_format, "image/png")
-        }
-        
-        if location_type == "onedrive":
-            if output_folder:
-                upload_url = f"https://graph.microsoft.com/v1.0/users/{location_id}/drive/root:/{output_folder}/{image_name}:/content"
-            else:
-                upload_url = f"https://graph.microsoft.com/v1.0/users/{location_id}/drive/root:/{image_name}:/content"
-        else:
-            if output_folder:
-                upload_url = f"https://graph.microsoft.com/v1.0/sites/{location_id}/drive/root:/{output_folder}/{image_name}:/content"
-            else:
-                upload_url = f"https://graph.microsoft.com/v1.0/sites/{location_id}/drive/root:/{image_name}:/content"
-        
-        upload_response = requests.put(upload_url, headers=upload_headers, data=image_content)
+        upload_response = await upload_file(
+            location_type, location_id, image_name, image_content,
+            content_types.get(image_format, "image/png"), output_folder
+        )
         
         if upload_response.status_code in [200, 201]:
             result = upload_response.json()
@@ -1567,30 +4256,24 @@ def export_powerpoint_slide_as_image(location_type: str, location_id: str, file_
     else:
         return {"error": "Failed to get slide image", "status_code": thumb_response.status_code}
 
-@mcp.tool()
-def create_odf_document(location_type: str, location_id: str, file_name: str, doc_type: str, content: str, folder_path: str = ""):
-    """Creates an OpenDocument Format file (.odt, .ods, .odp) in OneDrive or SharePoint.
-    
-    Args:
-        location_type: Either 'onedrive' or 'sharepoint'
-        location_id: User ID for OneDrive, or Site ID for SharePoint
-        file_name: Name of the file (e.g., 'document.odt')
-        doc_type: Type of document - 'text' (.odt), 'spreadsheet' (.ods), or 'presentation' (.odp)
-        content: Text content for the document
-        folder_path: Optional folder path
-    """
+ODF_CONTENT_TYPES = {
+    "text": "application/vnd.oasis.opendocument.text",
+    "spreadsheet": "application/vnd.oasis.opendocument.spreadsheet",
+    "presentation": "application/vnd.oasis.opendocument.presentation"
+}
+
+def render_odf_document(doc_type, content, target):
+    """Writes an .odt, .ods or .odp holding content to target (path or binary file)."""
     from odf.opendocument import OpenDocumentText, OpenDocumentSpreadsheet, OpenDocumentPresentation
     from odf.text import P
     from odf.table import Table, TableRow, TableCell
     from odf.draw import Page, Frame, TextBox
-    import io
     
     # Create ODF document based on type
     if doc_type == "text":
         doc = OpenDocumentText()
         p = P(text=content)
         doc.text.addElement(p)
-        content_type = "application/vnd.oasis.opendocument.text"
     elif doc_type == "spreadsheet":
         doc = OpenDocumentSpreadsheet()
         table = Table(name="Sheet1")
@@ -1602,7 +4285,6 @@ def create_odf_document(location_type: str, location_id: str, file_name: str, do
         tr.addElement(tc)
         table.addElement(tr)
         doc.spreadsheet.addElement(table)
-        content_type = "application/vnd.oasis.opendocument.spreadsheet"
     else:  # presentation
         doc = OpenDocumentPresentation()
         page = Page()
@@ -1613,32 +4295,28 @@ def create_odf_document(location_type: str, location_id: str, file_name: str, do
         frame.addElement(textbox)
         page.addElement(frame)
         doc.presentation.addElement(page)
-        content_type = "application/vnd.oasis.opendocument.presentation"
-    
-    # Save to bytes
-    doc_bytes = io.BytesIO()
-    doc.save(doc_bytes)
-    doc_bytes.seek(0)
     
-    access_token = get_access_token()
-    headers = {
-        "Authorization": f"Bearer {access_token}",
-        "Content-Type": content_type
-    }
+    doc.save(target)
+
+@mcp.tool()
+async def create_odf_document(location_type: str, location_id: str, file_name: str, doc_type: str, content: str, folder_path: str = ""):
+    """Creates an OpenDocument Format file (.odt, .ods, .odp) in OneDrive or SharePoint.
     
-    # Build URL
-    if location_type == "onedrive":
-        if folder_path:
-            url = f"https://graph.microsoft.com/v1.0/users/{location_id}/drive/root:/{folder_path}/{file_name}:/content"
-        else:
-            url = f"https://graph.microsoft.com/v1.0/users/{location_id}/drive/root:/{file_name}:/content"
-    else:  # sharepoint
-        if folder_path:
-            url = f"https://graph.microsoft.com/v1.0/sites/{location_id}/drive/root:/{folder_path}/{file_name}:/content"
-        else:
-            url = f"https://graph.microsoft.com/v1.0/sites/{location_id}/drive/root:/{file_name}:/content"
+    Args:
+        location_type: Either 'onedrive' or 'sharepoint'
+        location_id: User ID for OneDrive, or Site ID for SharePoint
+        file_name: Name of the file (e.g., 'document.odt')
+        doc_type: Type of document - 'text' (.odt), 'spreadsheet' (.ods), or 'presentation' (.odp)
+        content: Text content for the document
+        folder_path: Optional folder path
+    """
+    content_type = ODF_CONTENT_TYPES.get(doc_type, ODF_CONTENT_TYPES["presentation"])
     
-    response = requests.put(url, headers=headers, data=doc_bytes.getvalue())
+    async with rendered_document(render_odf_document, doc_type, content) as (document, size):
+        response = await upload_file(
+            location_type, location_id, file_name, document,
+            content_type, folder_path, size=size
+        )
     
     if response.status_code in [200, 201]:
         result = response.json()
@@ -1653,6 +4331,58 @@ def create_odf_document(location_type: str, location_id: str, file_name: str, do
     else:
         return {"error": response.text, "status_code": response.status_code}
 
+def _field_names(fields):
+    return tuple(field if isinstance(field, str) else field[0] for field in fields)
+
+# Mirrored tables: columns are the tool's projected fields, plus the indexed columns
+INVENTORY_TABLES = {
+    "devices": (_field_names(MANAGED_DEVICE_FIELDS), ("operatingSystem", "complianceState", "userPrincipalName", "enrolledDateTime")),
+    "users": (_field_names(USER_FIELDS), ("userPrincipalName", "accountEnabled")),
+    "groups": (_field_names(GROUP_FIELDS), ("displayName",)),
+    "policies": (_field_names(POLICY_FIELDS) + ("kind",), ("platform", "kind"))
+}
+
+@mcp.tool()
+async def query_inventory(table: str, filters: Optional[dict] = None, columns: Optional[list] = None,
+                          group_by: Optional[str] = None, order_by: Optional[str] = None,
+                          descending: bool = False, limit: int = 100):
+    """Answers filtered or aggregated questions from the local inventory mirror.
+    
+    The mirror (enabled with INVENTORY_DB_PATH) is filled by list_intune_devices,
+    list_users, list_groups and the policy list tools; each result includes when
+    the table was last refreshed. Example - non-compliant Windows devices enrolled
+    since a date: table='devices', filters={"operatingSystem": "Windows",
+    "complianceState": "noncompliant", "enrolledDateTime": {"ge": "2026-10-10"}}
+    
+    Args:
+        table: 'devices', 'users', 'groups' or 'policies'
+        filters: Column to value (equality; a list means any of) or to {operator: value}
+            with operators eq, ne, gt, ge, lt, le, like (only eq and ne take a list)
+        columns: Optional columns to return (all by default)
+        group_by: Optional column to count rows by instead of returning them
+        order_by: Optional column (or 'count' when grouping) to sort by
+        descending: Sort in descending order
+        limit: Maximum number of rows or groups returned
+    """
+    inventory = get_inventory()
+    if inventory is None:
+        return {"error": "Inventory mirror is disabled. Set INVENTORY_DB_PATH to enable it."}
+    
+    try:
+        return await asyncio.to_thread(inventory.query, table, columns, filters, group_by, order_by, descending, limit)
+    except (ValueError, sqlite3.Error) as error:
+        return {"error": str(error)}
+
+@mcp.tool()
+async def get_graph_metrics():
+    """Gets Microsoft Graph client metrics (throttling retries, time spent waiting, coalesced reads, cache hits and token acquisition)."""
+    return {
+        "retries": retry_scheduler.stats(),
+        "coalescing": single_flight.stats(),
+        "cache": response_cache.stats(),
+        "tokens": token_manager.stats()
+    }
+
 async def async_main():
     """Async entry point for MCP server."""
     import sys
@@ -18,7 +18,8 @@ setup(
     install_requires=[
         "fastmcp>=0.1.0",
         "azure-identity>=1.25.0",
-        "requests>=2.31.0",
+        "httpx>=0.27.0",
+        "aiohttp>=3.9.0",
         "python-docx>=1.1.0",
         "openpyxl>=3.1.0",
         "python-pptx>=0.6.23",
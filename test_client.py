@@ -1,5 +1,6 @@
 # Test to call the tools directly (now with real Graph API)
 from mcp_m365_mgmt import list_intune_devices
+import asyncio
 import json
 
 print("Testing list_intune_devices tool...")
@@ -7,7 +8,7 @@ print("-" * 50)
 print("Note: This will prompt you to sign in to your Microsoft tenant")
 print()
 
-result = list_intune_devices()
+result = asyncio.run(list_intune_devices())
 
 print("\nResult:")
 print(json.dumps(result, indent=2))
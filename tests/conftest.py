@@ -0,0 +1,33 @@
+import asyncio
+
+import httpx
+import pytest
+
+import mcp_m365_mgmt as m
+
+
+@pytest.fixture
+def graph(monkeypatch):
+    """Routes Graph traffic to a local handler instead of graph.microsoft.com.
+
+    Returns install(handler, **client_options); call it inside the test's event
+    loop. The handler takes an httpx.Request and may be async (to simulate a
+    slow Graph). Caches, retry state and synced collections start empty.
+    """
+    async def access_token():
+        return "token"
+
+    monkeypatch.setattr(m, "get_access_token", access_token)
+    monkeypatch.setattr(m, "response_cache", m.ResponseCache(ttls=m.GRAPH_CACHE_TTLS))
+    monkeypatch.setattr(m, "single_flight", m.SingleFlight())
+    monkeypatch.setattr(m, "retry_scheduler", m.RetryScheduler(base_delay=0.01, max_delay=0.1))
+    monkeypatch.setattr(m, "_collection_syncs", {})
+
+    def install(handler, **client_options):
+        client = m.GraphClient(base_url="https://graph.test", **client_options)
+        client.session = httpx.AsyncClient(transport=httpx.MockTransport(handler), follow_redirects=True)
+        monkeypatch.setattr(m, "_graph_client", client)
+        monkeypatch.setattr(m, "_graph_client_loop", asyncio.get_running_loop())
+        return client
+
+    return install
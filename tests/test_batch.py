@@ -0,0 +1,219 @@
+"""$batch coalescing tests and round-trip benchmark.
+
+Run this file directly to compare sequential requests with batch_requests
+at a simulated round-trip time (GRAPH_RTT, default 0.15 s):
+
+    python tests/test_batch.py
+"""
+import asyncio
+import json
+import logging
+import os
+import sys
+import time
+
+import httpx
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import mcp_m365_mgmt as m  # noqa: E402
+
+RTT = float(os.getenv("GRAPH_RTT", "0.15"))
+
+
+class BatchGraph:
+    """Answers $batch calls and plain requests with the sub-request path as the body.
+
+    answer(version, sub_request, attempt) may return (status, body, headers) to
+    override a sub-response, or "omit" to leave it out of the reply.
+    """
+
+    def __init__(self, answer=None, rtt=0.0, batch_status=200):
+        self.answer = answer or (lambda version, sub_request, attempt: None)
+        self.rtt = rtt
+        self.batch_status = batch_status
+        self.batches = []
+        self.requests = []
+        self.attempts = {}
+
+    async def __call__(self, request):
+        await asyncio.sleep(self.rtt)
+        if not request.url.path.endswith("/$batch"):
+            self.requests.append(request.url.path)
+            return httpx.Response(200, json={"path": request.url.path})
+
+        version = request.url.path.split("/")[1]
+        sub_requests = json.loads(request.content)["requests"]
+        self.batches.append((version, [sub_request["url"] for sub_request in sub_requests]))
+        if self.batch_status != 200:
+            return httpx.Response(self.batch_status, json={"error": {"code": "ServiceUnavailable", "message": "down"}})
+
+        responses = []
+        for sub_request in sub_requests:
+            url = sub_request["url"]
+            attempt = self.attempts[url] = self.attempts.get(url, -1) + 1
+            override = self.answer(version, sub_request, attempt)
+            if override == "omit":
+                continue
+            status, body, headers = override or (200, {"path": f"/{version}{url}"}, {})
+            responses.append({"id": sub_request["id"], "status": status, "headers": headers, "body": body})
+        return httpx.Response(200, json={"responses": responses})
+
+
+def run(graph, handler, requests, callers=1):
+    async def scenario():
+        graph(handler)
+        results = await asyncio.gather(*(m.batch_requests(requests) for _ in range(callers)))
+        return results if callers > 1 else results[0]
+    return asyncio.run(scenario())
+
+
+def test_requests_are_packed_by_version_in_batches_of_twenty(graph):
+    requests = [{"url": f"/v1.0/users/user-{index}"} for index in range(45)]
+    requests += [{"url": f"/beta/deviceManagement/managedDevices/device-{index}"} for index in range(5)]
+    handler = BatchGraph()
+
+    responses = run(graph, handler, requests)
+
+    assert sorted((version, len(urls)) for version, urls in handler.batches) == [("beta", 5), ("v1.0", 5), ("v1.0", 20), ("v1.0", 20)]
+    # Each response lands at the position of its request, across batches and versions
+    assert [response.json()["path"] for response in responses] == [request["url"] for request in requests]
+
+
+def test_only_throttled_sub_requests_are_retried(graph):
+    def answer(version, sub_request, attempt):
+        if sub_request["url"] in ("/users/user-3", "/users/user-7") and attempt == 0:
+            return 429, {"error": {"code": "TooManyRequests"}}, {"Retry-After": "0"}
+
+    requests = [{"url": f"/v1.0/users/user-{index}"} for index in range(10)]
+    handler = BatchGraph(answer)
+
+    responses = run(graph, handler, requests)
+
+    assert [response.status_code for response in responses] == [200] * 10
+    assert [urls for _, urls in handler.batches] == [[f"/users/user-{index}" for index in range(10)], ["/users/user-3", "/users/user-7"]]
+    # One retry from the budget per retried sub-request
+    assert m.retry_scheduler.retries == 2
+
+
+def test_missing_sub_responses_are_retried(graph):
+    def answer(version, sub_request, attempt):
+        if sub_request["url"] == "/users/user-1" and attempt == 0:
+            return "omit"
+
+    handler = BatchGraph(answer)
+
+    responses = run(graph, handler, [{"url": f"/v1.0/users/user-{index}"} for index in range(3)])
+
+    assert [response.status_code for response in responses] == [200, 200, 200]
+    assert handler.batches[1][1] == ["/users/user-1"]
+
+
+def test_missing_write_responses_are_not_sent_again(graph):
+    handler = BatchGraph(lambda version, sub_request, attempt: "omit")
+
+    responses = run(graph, handler, [{"url": "/v1.0/users", "method": "POST", "body": {"displayName": "New"}}])
+
+    assert responses[0].status_code == 502
+    assert len(handler.batches) == 1
+
+
+def test_failed_batch_call_is_not_retried_again_per_sub_request(graph):
+    handler = BatchGraph(batch_status=503)
+
+    responses = run(graph, handler, [{"url": f"/v1.0/users/user-{index}"} for index in range(3)])
+
+    assert [response.status_code for response in responses] == [503] * 3
+    # Only graph.post's own attempts; the sub-requests are not re-batched on top
+    assert len(handler.batches) == m.retry_scheduler.max_attempts
+
+
+def test_identical_reads_share_one_sub_request_and_the_cache(graph):
+    path = "/v1.0/deviceManagement/deviceCompliancePolicies"
+    handler = BatchGraph()
+
+    async def scenario():
+        graph(handler)
+        concurrent = await asyncio.gather(
+            m.batch_requests([{"url": path}, {"url": path}, {"url": "/v1.0/users/user-1"}]),
+            m.batch_requests([{"url": path}])
+        )
+        later = await m.batch_requests([{"url": path}])
+        return concurrent, later
+
+    (first, second), later = asyncio.run(scenario())
+
+    assert [urls for _, urls in handler.batches] == [["/deviceManagement/deviceCompliancePolicies", "/users/user-1"]]
+    assert first[0].json() == first[1].json() == second[0].json() == later[0].json()
+    assert later[0].extensions["cache_status"] == "hit"
+
+
+def benchmark(graph_install, count=40, rtt=RTT):
+    """Returns (sequential seconds, batched seconds) for count GETs at the given RTT."""
+    requests = [{"url": f"/v1.0/users/user-{index}"} for index in range(count)]
+
+    async def scenario():
+        graph_install(BatchGraph(rtt=rtt))
+        client = m.get_graph_client()
+        started = time.perf_counter()
+        for request in requests:
+            await client.get(request["url"])
+        sequential = time.perf_counter() - started
+        started = time.perf_counter()
+        await m.batch_requests(requests)
+        return sequential, time.perf_counter() - started
+
+    return asyncio.run(scenario())
+
+
+def test_batching_saves_round_trips(graph):
+    sequential, batched = benchmark(graph, count=20, rtt=0.05)
+
+    # One $batch call: about one round trip instead of 20
+    assert batched < 4 * 0.05 < sequential
+
+
+if __name__ == "__main__":
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+
+    async def access_token():
+        return "token"
+    m.get_access_token = access_token
+
+    def install(handler):
+        client = m.GraphClient(base_url="https://graph.test")
+        client.session = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        m._graph_client, m._graph_client_loop = client, asyncio.get_running_loop()
+
+    for count in (20, 100):
+        sequential, batched = benchmark(install, count)
+        print(f"{count} GETs at {RTT * 1000:.0f} ms RTT: sequential {sequential:.2f} s, batched {batched:.2f} s ({sequential / batched:.0f}x)")
+
+
+def test_cancelled_batch_leaves_no_stranded_claims(graph, monkeypatch):
+    path = "/v1.0/deviceManagement/deviceCompliancePolicies"
+
+    async def scenario():
+        graph(BatchGraph())
+        calls = 0
+        blocked = asyncio.Event()
+
+        async def slow_second_token():
+            nonlocal calls
+            calls += 1
+            if calls == 2:
+                blocked.set()
+                await asyncio.sleep(3600)
+            return "token"
+
+        monkeypatch.setattr(m, "get_access_token", slow_second_token)
+        cancelled = asyncio.ensure_future(m.batch_requests([{"url": path}, {"url": "/v1.0/users/user-1"}]))
+        await blocked.wait()
+        cancelled.cancel()
+
+        calls = 10
+        return await asyncio.wait_for(m.batch_requests([{"url": path}]), timeout=2)
+
+    responses = asyncio.run(scenario())
+
+    assert responses[0].status_code == 200
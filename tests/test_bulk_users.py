@@ -0,0 +1,114 @@
+import asyncio
+import json
+import re
+
+import httpx
+
+import mcp_m365_mgmt as m
+
+
+class DirectoryStandIn:
+    """Local stand-in for the users collection behind $batch.
+
+    Answers 'userPrincipalName in (...)' lookups and POST /users. throttle
+    lists UPNs whose first create is answered 429; reject maps UPNs to a 400
+    error message.
+    """
+
+    def __init__(self, existing=(), throttle=(), reject=None):
+        self.users = {upn.lower(): f"id-{upn}" for upn in existing}
+        self.throttle = set(throttle)
+        self.reject = reject or {}
+        self.creates = []
+
+    def respond(self, method, url, body):
+        if method == "GET":
+            upns = re.findall(r"'([^']*)'", httpx.URL(url).params["$filter"])
+            found = [{"id": self.users[upn.lower()], "userPrincipalName": upn} for upn in upns if upn.lower() in self.users]
+            return 200, {"value": found}, {}
+
+        upn = body["userPrincipalName"]
+        self.creates.append(upn)
+        if upn in self.throttle:
+            self.throttle.discard(upn)
+            return 429, {"error": {"code": "TooManyRequests", "message": "throttled"}}, {"Retry-After": "0"}
+        if upn in self.reject:
+            return 400, {"error": {"code": "Request_BadRequest", "message": self.reject[upn]}}, {}
+        if upn.lower() in self.users:
+            return 400, {"error": {"code": "Request_BadRequest", "message": "Another object with the same value for property userPrincipalName already exists."}}, {}
+        self.users[upn.lower()] = f"id-{upn}"
+        return 201, {"id": f"id-{upn}", "userPrincipalName": upn}, {}
+
+    def __call__(self, request):
+        if not request.url.path.endswith("/$batch"):
+            status, body, headers = self.respond(request.method, str(request.url), json.loads(request.content or b"null"))
+            return httpx.Response(status, headers=headers, json=body)
+        responses = []
+        for sub_request in json.loads(request.content)["requests"]:
+            url = f"https://graph.test/v1.0{sub_request['url']}"
+            status, body, headers = self.respond(sub_request["method"], url, sub_request.get("body"))
+            responses.append({"id": sub_request["id"], "status": status, "headers": headers, "body": body})
+        return httpx.Response(200, json={"responses": responses})
+
+
+def create(graph, directory, users, **options):
+    async def scenario():
+        graph(directory)
+        return await m.create_users_bulk(users=users, **options)
+    return asyncio.run(scenario())
+
+
+def statuses(result):
+    return [(row.get("userPrincipalName"), row["status"]) for row in result["results"]]
+
+
+def test_existing_users_are_skipped_so_reruns_create_nothing(graph):
+    directory = DirectoryStandIn(existing=["ann@contoso.test"])
+    users = [{"userPrincipalName": f"{name}@contoso.test"} for name in ("ann", "bob", "cy")]
+
+    first = create(graph, directory, users)
+    second = create(graph, directory, users)
+
+    assert statuses(first) == [("ann@contoso.test", "exists"), ("bob@contoso.test", "created"), ("cy@contoso.test", "created")]
+    assert [status for _, status in statuses(second)] == ["exists"] * 3
+    assert directory.creates == ["bob@contoso.test", "cy@contoso.test"]
+
+
+def test_each_row_reports_its_own_error(graph):
+    directory = DirectoryStandIn(reject={"bad@contoso.test": "Invalid value specified for property 'usageLocation'"})
+    users = [
+        {"userPrincipalName": "ok@contoso.test"},
+        {"displayName": "No UPN"},
+        {"userPrincipalName": "OK@contoso.test"},
+        {"userPrincipalName": "bad@contoso.test", "usageLocation": "XX"},
+        "not an object"
+    ]
+
+    result = create(graph, directory, users)
+
+    assert [row["status"] for row in result["results"]] == ["created", "invalid", "duplicate", "failed", "invalid"]
+    assert [row["row"] for row in result["results"]] == [1, 2, 3, 4, 5]
+    failed = result["results"][3]
+    assert failed["status_code"] == 400 and "usageLocation" in failed["error"]
+    assert result["counts"] == {"created": 1, "invalid": 2, "duplicate": 1, "failed": 1}
+
+
+def test_throttled_creates_are_retried(graph):
+    directory = DirectoryStandIn(throttle=["bob@contoso.test"])
+    users = [{"userPrincipalName": f"{name}@contoso.test"} for name in ("ann", "bob")]
+
+    result = create(graph, directory, users)
+
+    assert [status for _, status in statuses(result)] == ["created", "created"]
+    assert directory.creates == ["ann@contoso.test", "bob@contoso.test", "bob@contoso.test"]
+    assert result["throttled_responses"] == 1
+
+
+def test_passwords_are_only_returned_on_request(graph):
+    users = [{"userPrincipalName": "ann@contoso.test"}]
+
+    hidden = create(graph, DirectoryStandIn(), users)
+    shown = create(graph, DirectoryStandIn(), users, return_passwords=True)
+
+    assert "password" not in hidden["results"][0]
+    assert len(shown["results"][0]["password"]) == 16
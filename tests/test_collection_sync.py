@@ -0,0 +1,191 @@
+"""DeltaSync and WatermarkSync tests and the incremental sync benchmark.
+
+Run this file directly to time a full sync of a large user directory against
+a delta sync of a few changes (SYNC_USERS, default 100000):
+
+    python tests/test_collection_sync.py
+"""
+import asyncio
+import logging
+import os
+import sys
+import time
+
+import httpx
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import mcp_m365_mgmt as m  # noqa: E402
+
+DELTA_LINK = "https://graph.test/v1.0/users/delta?$deltatoken=latest"
+
+
+def user(index, **changes):
+    return {"id": f"user-{index}", "displayName": f"User {index}", "mail": f"user{index}@contoso.test", **changes}
+
+
+class DeltaGraph:
+    """Serves users/delta: full pages of users, then whatever changes are queued."""
+
+    def __init__(self, count, page_size=1000):
+        self.count = count
+        self.page_size = page_size
+        self.changes = []
+        self.expired = False
+        self.requests = []
+
+    def __call__(self, request):
+        self.requests.append(request.url)
+        if "$deltatoken" in request.url.params:
+            if self.expired:
+                return httpx.Response(410, json={"error": {"code": "syncStateNotFound", "message": "expired"}})
+            body = {"value": self.changes, "@odata.deltaLink": DELTA_LINK}
+            self.changes = []
+            return httpx.Response(200, json=body)
+
+        start = int(request.url.params.get("$skiptoken", "0"))
+        end = min(start + self.page_size, self.count)
+        body = {"value": [user(index) for index in range(start, end)]}
+        if end < self.count:
+            body["@odata.nextLink"] = f"https://graph.test/v1.0/users/delta?$skiptoken={end}"
+        else:
+            body["@odata.deltaLink"] = DELTA_LINK
+        return httpx.Response(200, json=body)
+
+
+def run(graph, handler, *steps):
+    async def scenario():
+        graph(handler)
+        return [await step() for step in steps]
+    return asyncio.run(scenario())
+
+
+def test_first_sync_pages_through_the_whole_collection(graph):
+    handler = DeltaGraph(2500)
+    users = m.DeltaSync("/v1.0/users", m.USER_FIELDS)
+
+    status, = run(graph, handler, users.sync)
+
+    assert status == {"mode": "full", "changes": 2500}
+    assert len(users.items) == 2500
+    assert users.delta_link == DELTA_LINK
+    assert handler.requests[0].params["$select"] == m.select_params(m.USER_FIELDS)["$select"]
+    assert len(handler.requests) == 3
+
+
+def test_delta_sync_applies_changes_and_removals(graph):
+    handler = DeltaGraph(10)
+    users = m.DeltaSync("/v1.0/users", m.USER_FIELDS)
+
+    async def change():
+        # Delta pages only carry the properties that changed
+        handler.changes = [{"id": "user-1", "displayName": "Renamed"}, {"id": "user-2", "@removed": {"reason": "deleted"}}, user(10)]
+        return await users.sync()
+
+    _, status = run(graph, handler, users.sync, change)
+
+    assert status == {"mode": "delta", "changes": 3}
+    assert users.items["user-1"] == user(1, displayName="Renamed")
+    assert "user-2" not in users.items
+    assert len(users.items) == 10
+    assert users.changed_ids == {"user-1", "user-10"}
+    assert users.removed_ids == {"user-2"}
+
+
+def test_expired_delta_token_falls_back_to_a_full_sync(graph):
+    handler = DeltaGraph(10)
+    users = m.DeltaSync("/v1.0/users", m.USER_FIELDS)
+
+    async def expire():
+        handler.count = 4
+        handler.expired = True
+        return await users.sync()
+
+    _, status = run(graph, handler, users.sync, expire)
+
+    assert status == {"mode": "full", "changes": 4}
+    # Rebuilt from scratch, so users deleted meanwhile are gone
+    assert sorted(users.items) == ["user-0", "user-1", "user-2", "user-3"]
+
+
+def test_watermark_sync_merges_items_modified_since_the_watermark(graph):
+    devices = {
+        "device-1": {"id": "device-1", "deviceName": "One", "lastSyncDateTime": "2026-01-01T00:00:00Z"},
+        "device-2": {"id": "device-2", "deviceName": "Two", "lastSyncDateTime": "2026-01-02T00:00:00Z"}
+    }
+    filters = []
+
+    def handler(request):
+        filters.append(request.url.params.get("$filter"))
+        since = request.url.params.get("$filter", " ge ").split(" ge ")[1]
+        return httpx.Response(200, json={"value": [item for item in devices.values() if item["lastSyncDateTime"] >= since]})
+
+    sync = m.WatermarkSync("/v1.0/deviceManagement/managedDevices", ("id", "deviceName", "lastSyncDateTime"), "lastSyncDateTime")
+
+    async def change():
+        devices["device-1"] = {**devices["device-1"], "deviceName": "One renamed", "lastSyncDateTime": "2026-01-03T00:00:00Z"}
+        return await sync.sync()
+
+    first, second = run(graph, handler, sync.sync, change)
+
+    assert first == {"mode": "full", "changes": 2}
+    # ge: the item at the watermark itself is fetched again alongside the changed one
+    assert second == {"mode": "incremental", "changes": 2}
+    assert filters == [None, "lastSyncDateTime ge 2026-01-02T00:00:00Z"]
+    assert sync.items["device-1"]["deviceName"] == "One renamed"
+    assert sync.watermark == "2026-01-03T00:00:00Z"
+
+
+def test_watermark_sync_resyncs_fully_after_the_interval(graph):
+    def handler(request):
+        return httpx.Response(200, json={"value": [{"id": "device-1", "lastSyncDateTime": "2026-01-01T00:00:00Z"}]})
+
+    sync = m.WatermarkSync("/v1.0/deviceManagement/managedDevices", ("id", "lastSyncDateTime"), "lastSyncDateTime", resync_interval=0)
+
+    first, second = run(graph, handler, sync.sync, sync.sync)
+
+    assert first["mode"] == second["mode"] == "full"
+
+
+def benchmark(graph_install, count, changes=10):
+    """Returns (full sync seconds, delta sync seconds, requests per sync) for count users."""
+    handler = DeltaGraph(count)
+    users = m.DeltaSync("/v1.0/users", m.USER_FIELDS)
+
+    async def scenario():
+        graph_install(handler)
+        started = time.perf_counter()
+        await users.sync()
+        full = time.perf_counter() - started
+        full_requests = len(handler.requests)
+
+        handler.changes = [user(index, displayName="Changed") for index in range(changes)]
+        started = time.perf_counter()
+        await users.sync()
+        return full, time.perf_counter() - started, (full_requests, len(handler.requests) - full_requests)
+
+    return asyncio.run(scenario())
+
+
+def test_delta_sync_is_a_single_small_request(graph):
+    full, delta, (full_requests, delta_requests) = benchmark(graph, 20000)
+
+    assert (full_requests, delta_requests) == (20, 1)
+    assert delta < full / 10
+
+
+if __name__ == "__main__":
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+
+    async def access_token():
+        return "token"
+    m.get_access_token = access_token
+
+    def install(handler):
+        client = m.GraphClient(base_url="https://graph.test")
+        client.session = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        m._graph_client, m._graph_client_loop = client, asyncio.get_running_loop()
+
+    count = int(os.getenv("SYNC_USERS", "100000"))
+    full, delta, (full_requests, delta_requests) = benchmark(install, count)
+    print(f"{count} users: full sync {full:.2f} s ({full_requests} requests), delta sync of 10 changes {delta * 1000:.1f} ms ({delta_requests} request)")
@@ -0,0 +1,33 @@
+import asyncio
+import time
+
+import httpx
+
+import mcp_m365_mgmt as m
+
+GRAPH_DELAY = 0.5
+
+
+def test_concurrent_tool_calls_overlap(graph):
+    async def slow_graph(request):
+        await asyncio.sleep(GRAPH_DELAY)
+        return httpx.Response(200, json={"value": [{"id": "1", "displayName": "item"}]})
+
+    async def scenario():
+        graph(slow_graph)
+        calls = [
+            m.list_autopilot_devices(),
+            m.list_intune_applications(),
+            m.list_users(max_items=1),
+            m.list_groups(max_items=1),
+            m.list_intune_compliance_policies()
+        ]
+        started = time.perf_counter()
+        results = await asyncio.gather(*calls)
+        return time.perf_counter() - started, results
+
+    elapsed, results = asyncio.run(scenario())
+
+    assert all("error" not in result for result in results)
+    # Sequential calls would take len(calls) * GRAPH_DELAY
+    assert elapsed < 2 * GRAPH_DELAY
@@ -0,0 +1,154 @@
+import asyncio
+import json
+import re
+
+import httpx
+import pytest
+
+import mcp_m365_mgmt as m
+
+USERS = [
+    {"id": f"u{index}", "department": ["Sales", "Sales", "IT", None][index % 4], "accountEnabled": index % 5 != 0}
+    for index in range(40)
+]
+DEVICES = [
+    {"id": f"d{index}", "operatingSystem": ["Windows", "iOS", "Android"][index % 3], "complianceState": ["compliant", "noncompliant"][index % 2]}
+    for index in range(30)
+]
+
+
+def matches(item, odata_filter):
+    """Evaluates the 'property eq literal' conditions of a $filter joined with 'and'."""
+    for name, literal in re.findall(r"(\w+) eq ('[^']*'|true|false|null)", odata_filter or ""):
+        value = {"true": True, "false": False, "null": None}.get(literal, literal.strip("'"))
+        if item.get(name) != value:
+            return False
+    return True
+
+
+class CountingGraph:
+    """Serves users and managed devices, with $count support set per collection.
+
+    count_support is 'count' (reports @odata.count), 'missing' (ignores $count)
+    or 'reject' (400 for $count queries).
+    """
+
+    def __init__(self, count_support="count"):
+        self.count_support = count_support
+        self.requests = []
+
+    def respond(self, url, headers):
+        self.requests.append(url)
+        items = USERS if url.path.endswith("/users") else DEVICES
+        if "$count" in url.params and self.count_support == "reject":
+            return 400, {"error": {"code": "Request_UnsupportedQuery", "message": "$count is not supported"}}
+        selected = [item for item in items if matches(item, url.params.get("$filter"))]
+        body = {"value": selected[:int(url.params.get("$top", len(selected)))]}
+        if "$count" in url.params and self.count_support == "count" and headers.get("ConsistencyLevel") == "eventual":
+            body["@odata.count"] = len(selected)
+        return 200, body
+
+    def __call__(self, request):
+        if not request.url.path.endswith("/$batch"):
+            status, body = self.respond(request.url, request.headers)
+            return httpx.Response(status, json=body)
+        responses = []
+        for sub_request in json.loads(request.content)["requests"]:
+            status, body = self.respond(httpx.URL(f"https://graph.test/v1.0{sub_request['url']}"), sub_request.get("headers", {}))
+            responses.append({"id": sub_request["id"], "status": status, "body": body})
+        return httpx.Response(200, json={"responses": responses})
+
+    def count_requests(self):
+        return [url for url in self.requests if "$count" in url.params]
+
+
+@pytest.fixture(autouse=True)
+def count_support_cache(monkeypatch):
+    monkeypatch.setattr(m, "_count_unsupported", set())
+
+
+def run(graph, handler, *calls):
+    async def scenario():
+        graph(handler)
+        return [await call() for call in calls]
+    return asyncio.run(scenario())
+
+
+def test_values_are_counted_server_side_in_one_batch(graph):
+    handler = CountingGraph()
+
+    result, = run(graph, handler, lambda: m.count_entities("users", filter="accountEnabled eq true", group_by="department", values=["Sales", "IT"]))
+
+    assert result["mode"] == "server"
+    assert result["total"] == 32
+    assert result["groups"] == [{"department": "Sales", "count": 16}, {"department": "IT", "count": 8}]
+    assert result["other_count"] == 8
+    assert len(handler.requests) == 3
+    assert handler.requests[1].params["$filter"] == "(accountEnabled eq true) and department eq 'Sales'"
+
+
+def test_group_by_without_values_is_streamed(graph):
+    handler = CountingGraph()
+
+    result, = run(graph, handler, lambda: m.count_entities("users", group_by="department,accountEnabled", max_groups=2))
+
+    assert result["mode"] == "stream"
+    assert result["total"] == 40
+    assert result["groups"] == [{"department": "Sales", "accountEnabled": True, "count": 16}, {"department": "IT", "accountEnabled": True, "count": 8}]
+    assert (result["other_count"], result["distinct_groups"]) == (16, 6)
+    assert handler.requests[0].params["$select"] == "id,department,accountEnabled"
+
+
+@pytest.mark.parametrize("count_support", ["missing", "reject"])
+def test_collections_without_counts_fall_back_to_streaming_and_are_remembered(graph, count_support):
+    handler = CountingGraph(count_support)
+
+    first, second = run(graph, handler, lambda: m.count_entities("users"), lambda: m.count_entities("users"))
+
+    assert first["mode"] == second["mode"] == "stream"
+    assert first["total"] == second["total"] == 40
+    assert len(handler.count_requests()) == 1
+    assert m._count_unsupported == {"/v1.0/users"}
+
+
+def test_rejected_filter_is_not_remembered_as_missing_count_support(graph):
+    handler = CountingGraph("reject")
+
+    run(graph, handler, lambda: m.count_entities("users", filter="accountEnabled eq true"))
+
+    assert m._count_unsupported == set()
+
+
+def test_managed_devices_skip_the_server_count(graph):
+    handler = CountingGraph()
+
+    result, = run(graph, handler, lambda: m.count_entities("devices", group_by="operatingSystem", values=["Windows"]))
+
+    assert result["mode"] == "stream"
+    assert result["groups"] == [{"operatingSystem": "Windows", "count": 10}]
+    assert result["other_count"] == 20
+    assert handler.count_requests() == []
+
+
+def test_summarize_devices_counts_every_property_in_one_pass(graph):
+    handler = CountingGraph()
+
+    result, = run(graph, handler, lambda: m.summarize_devices(group_by="operatingSystem,complianceState", max_values=2))
+
+    assert result["mode"] == "stream"
+    assert result["requests"] == 1
+    assert result["total"] == 30
+    assert result["summary"]["operatingSystem"] == {
+        "values": [{"value": "Windows", "count": 10}, {"value": "iOS", "count": 10}], "other_count": 10, "distinct": 3
+    }
+    assert result["summary"]["complianceState"]["distinct"] == 2
+
+
+def test_summarize_devices_counts_the_local_copy_once_synced(graph):
+    handler = CountingGraph()
+
+    listed, summary = run(graph, handler, m.list_intune_devices, lambda: m.summarize_devices(group_by="operatingSystem"))
+
+    assert listed["count"] == 30
+    assert summary["mode"] == "local"
+    assert summary["summary"]["operatingSystem"]["distinct"] == 3
@@ -0,0 +1,218 @@
+"""read_csv_file streaming tests and benchmark.
+
+Run this file directly to compare rows/sec and peak RSS of the streaming
+reader against downloading the whole file and parsing it in one go
+(CSV_BENCH_ROWS, default 500000):
+
+    python tests/test_csv.py
+"""
+import asyncio
+import csv
+import io
+import logging
+import os
+import subprocess
+import sys
+import time
+
+import httpx
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import mcp_m365_mgmt as m  # noqa: E402
+
+# Quoted fields with newlines, escaped quotes and multi-byte characters
+TRICKY = (
+    '﻿id,name,notes\r\n'
+    '1,"Ström, Åsa","line one\nline two"\r\n'
+    '2,Bob,"he said ""hi""\r\nthen left"\r\n'
+    '3,Zoë,\r\n'
+    '4,"multi\n\nline",€\r\n'
+)
+
+
+def parse_blocks(blocks):
+    return [row for block in blocks for row in csv.reader(io.StringIO(block, newline=""))]
+
+
+def chunked(data, size):
+    async def chunks():
+        for start in range(0, len(data), size):
+            yield data[start:start + size]
+    return chunks()
+
+
+def test_blocks_hold_whole_records_for_every_chunk_boundary():
+    data = TRICKY.encode("utf-8")
+    expected = list(csv.reader(io.StringIO(TRICKY.lstrip("﻿"), newline="")))
+
+    async def blocks(size):
+        return [block async for block in m.iter_csv_blocks(chunked(data, size))]
+
+    for size in range(1, len(data) + 1):
+        # Every possible cut: inside quotes, between \r and \n, inside a UTF-8 sequence
+        assert parse_blocks(asyncio.run(blocks(size))) == expected, f"chunk size {size}"
+
+
+def test_last_record_without_trailing_newline():
+    async def blocks():
+        return [block async for block in m.iter_csv_blocks(chunked(b'a,b\n1,"x\ny"', 4))]
+
+    assert parse_blocks(asyncio.run(blocks())) == [["a", "b"], ["1", "x\ny"]]
+
+
+def generated_csv(rows):
+    lines = ["id,name,department,salary,active"]
+    lines += [f'{index},"User {index}",Dept {index % 17},{index % 90000 + 30000}.50,{index % 2 == 0}' for index in range(rows)]
+    return ("\r\n".join(lines) + "\r\n").encode()
+
+
+def csv_drive(data, chunk_size=64 * 1024):
+    """Handler serving one CSV file, streamed in chunks like a drive download."""
+    def handler(request):
+        if not request.url.path.endswith("/items/file-1/content"):
+            return httpx.Response(404)
+        return httpx.Response(200, content=chunked(data, chunk_size))
+    return handler
+
+
+def benchmark(graph_install, mode, rows):
+    """Returns (rows/sec, rows counted) for reading a generated CSV by mode.
+
+    'stream' counts the rows with read_csv_file; 'whole' downloads the full
+    text and parses every row into a list first, as the reader used to.
+    """
+    data = generated_csv(rows)
+
+    async def scenario():
+        client = graph_install(csv_drive(data))
+        started = time.perf_counter()
+        if mode == "stream":
+            result = await m.read_csv_file("onedrive", "user-1", "file-1", count_only=True)
+            counted = result["data_rows"]
+        else:
+            response = await client.get("/v1.0/users/user-1/drive/items/file-1/content")
+            counted = len(list(csv.reader(io.StringIO(response.text)))) - 1
+        return counted / (time.perf_counter() - started), counted
+
+    return asyncio.run(scenario())
+
+
+def test_streaming_count_matches_the_whole_file(graph):
+    _, streamed = benchmark(graph, "stream", 20000)
+    _, whole = benchmark(graph, "whole", 20000)
+
+    assert streamed == whole == 20000
+
+
+if __name__ == "__main__":
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+
+    async def access_token():
+        return "token"
+    m.get_access_token = access_token
+
+    def install(handler):
+        client = m.GraphClient(base_url="https://graph.test")
+        client.session = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        m._graph_client, m._graph_client_loop = client, asyncio.get_running_loop()
+        return client
+
+    rows = int(os.getenv("CSV_BENCH_ROWS", "500000"))
+
+    if len(sys.argv) > 1:
+        import resource
+        rate, counted = benchmark(install, sys.argv[1], rows)
+        # ru_maxrss is in KiB on Linux
+        print(f"{sys.argv[1]:>6}: {counted} rows, {rate:,.0f} rows/s, peak RSS {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.0f} MiB")
+    else:
+        # One process per mode, so each peak RSS is its own
+        for mode in ("whole", "stream"):
+            subprocess.run([sys.executable, __file__, mode], check=True)
+
+
+def read(graph, data, chunk_size=64 * 1024, **options):
+    async def scenario():
+        graph(csv_drive(data, chunk_size))
+        return await m.read_csv_file("onedrive", "user-1", "file-1", **options)
+    return asyncio.run(scenario())
+
+
+def test_windows_page_through_the_file(graph):
+    data = generated_csv(25)
+    pages = []
+    offset = 0
+    while True:
+        # Small chunks, so windows end on and across block boundaries
+        result = read(graph, data, chunk_size=50, offset=offset, limit=10, columns=["name", "id"])
+        pages.append([row[1] for row in result["data"][1:]])
+        assert result["data"][0] == ["name", "id"]
+        if not result["has_more"]:
+            break
+        offset = result["next_offset"]
+
+    assert [len(page) for page in pages] == [10, 10, 5]
+    assert sum(pages, []) == [str(index) for index in range(25)]
+
+
+def test_window_ending_on_the_last_row_has_no_more(graph):
+    result = read(graph, generated_csv(10), chunk_size=50, limit=10)
+
+    assert result["has_more"] is False
+    assert "next_offset" not in result
+
+
+def test_rows_count_the_header_in_every_mode(graph):
+    data = generated_csv(30)
+
+    window = read(graph, data, limit=0)
+    counted = read(graph, data, count_only=True)
+    summarized = read(graph, data, summary=True)
+
+    for result in (window, counted, summarized):
+        assert (result["rows"], result["data_rows"]) == (31, 30)
+
+
+def summarize(graph, text):
+    result = read(graph, text.encode(), summary=True)
+    return {column["column"]: column for column in result["summary"]}
+
+
+def test_summary_infers_types_strictly(graph):
+    summary = summarize(graph, (
+        "count,price,odd,flag,day,code\n"
+        "1,1.5,nan,true,2026-01-01,1_000\n"
+        "2,-2e3,inf,False,2026-01-02, 7\n"
+        "3,.25,1,TRUE,2026-01-03,8\n"
+    ))
+
+    assert {name: column["type"] for name, column in summary.items()} == {
+        "count": "integer", "price": "number", "odd": "string", "flag": "boolean", "day": "date", "code": "string"
+    }
+    assert (summary["count"]["min"], summary["count"]["max"], summary["count"]["sum"]) == (1, 3, 6)
+    assert summary["price"]["min"] == -2000.0
+
+
+def test_summary_widens_types_across_blocks(graph):
+    text = "value\n" + "".join(f"{index}\n" for index in range(2000)) + "2.5\nn/a\n"
+
+    summary = read(graph, text.encode(), chunk_size=64, summary=True)["summary"][0]
+
+    assert summary["type"] == "string"
+    assert summary["count"] == 2002
+
+
+def test_summary_estimates_distinct_and_top_values(graph):
+    rows = 60000
+    text = "id,team\n" + "".join(f"{index},{'red' if index % 3 else 'blue'}\n" for index in range(rows))
+
+    summary = summarize(graph, text)
+
+    ids, teams = summary["id"], summary["team"]
+    # k-minimum-values with k=1024: the estimate is within a few percent
+    assert not ids["distinct_exact"]
+    assert abs(ids["distinct"] - rows) / rows < 0.1
+    assert (teams["distinct"], teams["distinct_exact"]) == (2, True)
+    assert [(top["value"], top["count"]) for top in teams["top"]] == [("red", 40000), ("blue", 20000)]
+    assert teams["top_exact"]
+    assert ids["mean"] == (rows - 1) / 2
@@ -0,0 +1,32 @@
+import asyncio
+import os
+import re
+
+import mcp_m365_mgmt as m
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def read(name):
+    with open(os.path.join(ROOT, name), encoding="utf-8") as doc:
+        return doc.read()
+
+
+def registered_tools():
+    return {tool.name for tool in asyncio.run(m.mcp.list_tools())}
+
+
+def test_readme_lists_every_tool():
+    readme = read("README.md")
+    listed = set(re.findall(r"^- `(\w+)` - ", readme, re.MULTILINE))
+
+    assert listed == registered_tools()
+    assert f"Complete Tool List ({len(listed)} Tools)" in readme
+
+
+def test_tools_summary_lists_every_tool():
+    summary = read("TOOLS-SUMMARY.md")
+    listed = set(re.findall(r"^\d+\. `(\w+)` - ", summary, re.MULTILINE))
+
+    assert listed == registered_tools()
+    assert f"Total Tools: {len(listed)}" in summary
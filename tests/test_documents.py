@@ -0,0 +1,254 @@
+"""Document rendering tests and benchmarks.
+
+Run this file directly to compare rows/sec and peak RSS of the write-only
+workbook against building a regular openpyxl workbook in memory, as
+create_excel_workbook used to (DOC_BENCH_ROWS, default 100000):
+
+    python tests/test_documents.py excel
+
+or documents/sec rendered concurrently inline (in threads) and in the
+rendering process pool (DOC_BENCH_DOCUMENTS, default 64):
+
+    python tests/test_documents.py pool
+
+or the time per document with the template parsed on every call and with
+the template cache (DOC_BENCH_DOCUMENTS):
+
+    python tests/test_documents.py templates
+"""
+import asyncio
+import io
+import zipfile
+from collections import OrderedDict
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+from xml.etree.ElementTree import canonicalize
+
+import httpx
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import mcp_m365_mgmt as m  # noqa: E402
+
+ROWS = [
+    ["Name", "Age", "Score", "Active", "Enrolled"],
+    ["Åsa", 30, 1.5, True, datetime(2026, 1, 2, 3, 4, 5)],
+    ["Bob", None, -2e3, False, "2026-01-03"]
+]
+
+
+def test_write_only_workbook_holds_the_rows():
+    from openpyxl import load_workbook
+
+    target = io.BytesIO()
+    m.render_excel_workbook(ROWS, target)
+
+    sheet = load_workbook(io.BytesIO(target.getvalue())).active
+    assert [list(row) for row in sheet.iter_rows(values_only=True)] == ROWS
+
+
+def excel_rows(count):
+    return [["Device", "User", "OS", "Compliant", "Last sync"]] + [
+        [f"DEVICE-{index}", f"user{index}@contoso.test", "Windows", index % 3 != 0, f"2026-10-{index % 28 + 1:02d}"]
+        for index in range(count)
+    ]
+
+
+def excel_benchmark(mode, count):
+    """Returns rows/sec for writing count rows with the write-only renderer or a regular workbook."""
+    data = excel_rows(count)
+    started = time.perf_counter()
+    if mode == "write_only":
+        with tempfile.TemporaryFile() as target:
+            m.render_excel_workbook(data, target)
+    else:
+        from openpyxl import Workbook
+        workbook = Workbook()
+        sheet = workbook.active
+        for row in data:
+            sheet.append(row)
+        buffer = io.BytesIO()
+        workbook.save(buffer)
+        buffer.getvalue()
+    return count / (time.perf_counter() - started)
+
+
+def test_write_only_workbook_memory_does_not_grow_with_rows():
+    data = excel_rows(4000)
+
+    tracemalloc.start()
+    try:
+        with tempfile.TemporaryFile() as target:
+            m.render_excel_workbook(data, target)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    # A regular workbook holds about 6 MB of cell objects for these rows
+    assert peak < 1024 * 1024, f"peak {peak / 2**20:.1f} MiB"
+
+
+# Rendering functions with arguments, as the tools call them
+DOCUMENTS = [
+    (m.render_word_document, ("Quarterly report", None)),
+    (m.render_excel_workbook, (ROWS,)),
+    (m.render_powerpoint_presentation, ("Status", "All green", None)),
+    (m.render_odf_document, ("text", "Notes")),
+    (m.render_odf_document, ("spreadsheet", "Totals"))
+]
+
+# Package parts that carry the creation time
+TIMESTAMPED_PARTS = ("docProps/core.xml", "meta.xml")
+
+
+def package_parts(data):
+    """Returns the parts of a zip package; XML is canonicalized, as odfpy orders namespaces by hash."""
+    parts = {}
+    with zipfile.ZipFile(io.BytesIO(data)) as package:
+        for name in package.namelist():
+            if name in TIMESTAMPED_PARTS:
+                continue
+            part = package.read(name)
+            if name.endswith((".xml", ".rels")):
+                part = canonicalize(part.decode("utf-8"))
+            parts[name] = part
+    return parts
+
+
+async def render_all(documents):
+    rendered = []
+    for render, args in documents:
+        async with m.rendered_document(render, *args) as (document, size):
+            document.seek(0)
+            data = document.read()
+            assert len(data) == size
+            rendered.append(data)
+    return rendered
+
+
+@pytest.fixture
+def render_pool(monkeypatch):
+    monkeypatch.setattr(m, "DOC_RENDER_WORKERS", 2)
+    monkeypatch.setattr(m, "_render_pool", None)
+    yield
+    if m._render_pool is not None:
+        m._render_pool.shutdown()
+
+
+def test_pool_renders_the_same_documents_as_inline(render_pool, monkeypatch):
+    pooled = asyncio.run(render_all(DOCUMENTS))
+    monkeypatch.setattr(m, "DOC_RENDER_WORKERS", 0)
+    inline = asyncio.run(render_all(DOCUMENTS))
+
+    for (render, args), pooled_data, inline_data in zip(DOCUMENTS, pooled, inline):
+        assert package_parts(pooled_data) == package_parts(inline_data), f"{render.__name__}{args[:1]}"
+
+
+def pool_benchmark(workers, count):
+    """Returns documents/sec for rendering count Word documents concurrently."""
+    m.DOC_RENDER_WORKERS = workers
+    m._render_pool = None
+
+    async def render_one(index):
+        async with m.rendered_document(m.render_word_document, f"Report {index}\n" * 200, None):
+            pass
+
+    async def scenario():
+        # Warm up: start the workers and parse the template in each
+        await asyncio.gather(*(render_one(index) for index in range(max(workers, 1))))
+        started = time.perf_counter()
+        await asyncio.gather(*(render_one(index) for index in range(count)))
+        return count / (time.perf_counter() - started)
+
+    try:
+        return asyncio.run(scenario())
+    finally:
+        if m._render_pool is not None:
+            m._render_pool.shutdown()
+
+
+def test_cached_templates_are_copied_per_call(monkeypatch):
+    monkeypatch.setattr(m, "_parsed_templates", OrderedDict())
+
+    first = m.load_template("docx")
+    first.add_paragraph("only in the first document")
+    second = m.load_template("docx")
+
+    assert second is not first
+    assert [paragraph.text for paragraph in second.paragraphs] == []
+    parsed, = m._parsed_templates.values()
+    assert [paragraph.text for paragraph in parsed.paragraphs] == []
+
+
+def test_sharepoint_template_is_downloaded_again_only_when_its_etag_changes(graph, monkeypatch):
+    monkeypatch.setattr(m, "_downloaded_templates", OrderedDict())
+    package = io.BytesIO()
+    m.render_word_document("Corporate letterhead", None, package)
+    item = {"id": "template-1", "eTag": "v1"}
+    downloads = []
+
+    def handler(request):
+        if request.url.path.endswith("/content"):
+            downloads.append(item["eTag"])
+            return httpx.Response(200, content=package.getvalue())
+        return httpx.Response(200, json=item)
+
+    async def scenario():
+        graph(handler)
+        keys = [(await m.fetch_template("onedrive", "user-1", "template-1"))[0] for _ in range(2)]
+        item["eTag"] = "v2"
+        keys.append((await m.fetch_template("onedrive", "user-1", "template-1"))[0])
+        return keys
+
+    keys = asyncio.run(scenario())
+
+    assert downloads == ["v1", "v2"]
+    assert keys == ["user-1/template-1@v1", "user-1/template-1@v1", "user-1/template-1@v2"]
+
+
+def template_benchmark(kind, cached, count):
+    """Returns milliseconds per document, parsing the default template each time or using the cache."""
+    if kind == "docx":
+        from docx import Document as opener
+    else:
+        from pptx import Presentation as opener
+    m.load_template(kind)
+    started = time.perf_counter()
+    for _ in range(count):
+        document = m.load_template(kind) if cached else opener()
+        document.save(io.BytesIO())
+    return (time.perf_counter() - started) / count * 1000
+
+
+def peak_rss_mib():
+    import resource
+    # ru_maxrss is in KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+if __name__ == "__main__":
+    benchmark, mode = (sys.argv[1:] + [None, None])[:2]
+    if benchmark == "excel" and mode:
+        count = int(os.getenv("DOC_BENCH_ROWS", "100000"))
+        rate = excel_benchmark(mode, count)
+        print(f"{mode:>10}: {count} rows, {rate:,.0f} rows/s, peak RSS {peak_rss_mib():.0f} MiB")
+    elif benchmark == "excel":
+        # One process per mode, so each peak RSS is its own
+        for mode in ("in_memory", "write_only"):
+            subprocess.run([sys.executable, __file__, "excel", mode], check=True)
+    elif benchmark == "pool":
+        count = int(os.getenv("DOC_BENCH_DOCUMENTS", "64"))
+        for workers in (0, os.cpu_count() or 1):
+            rate = pool_benchmark(workers, count)
+            print(f"{'inline' if workers == 0 else f'{workers} workers':>10}: {count} documents, {rate:.1f} documents/s")
+    elif benchmark == "templates":
+        count = int(os.getenv("DOC_BENCH_DOCUMENTS", "64"))
+        for kind in ("docx", "pptx"):
+            parsed, cached = (template_benchmark(kind, cache, count) for cache in (False, True))
+            print(f"{kind}: {parsed:.1f} ms per document parsing the template, {cached:.1f} ms with the cache")
@@ -0,0 +1,54 @@
+import asyncio
+import random
+
+import httpx
+
+import mcp_m365_mgmt as m
+
+
+def test_results_keep_item_order_under_bounded_concurrency():
+    in_flight = 0
+    peak = 0
+
+    async def fetch(item):
+        nonlocal in_flight, peak
+        in_flight += 1
+        peak = max(peak, in_flight)
+        # Later items often finish first
+        await asyncio.sleep(random.uniform(0, 0.02))
+        in_flight -= 1
+        return item * 10
+
+    results = asyncio.run(m.fan_out(list(range(25)), fetch, concurrency=4))
+
+    assert results == [item * 10 for item in range(25)]
+    assert peak == 4
+
+
+def test_tunnel_servers_are_fetched_in_parallel_and_failed_sites_skipped(graph):
+    sites = [{"id": f"site-{index}", "displayName": f"Site {index}"} for index in range(6)]
+    in_flight = 0
+    peak = 0
+
+    async def handler(request):
+        nonlocal in_flight, peak
+        path = request.url.path
+        if path.endswith("/microsoftTunnelSites"):
+            return httpx.Response(200, json={"value": sites})
+        site_id = path.split("/")[-2]
+        if site_id == "site-2":
+            return httpx.Response(403, json={"error": {"code": "Forbidden", "message": "denied"}})
+        in_flight += 1
+        peak = max(peak, in_flight)
+        await asyncio.sleep(0.05)
+        in_flight -= 1
+        return httpx.Response(200, json={"value": [{"id": f"server-{site_id}", "displayName": site_id}]})
+
+    async def scenario():
+        graph(handler)
+        return await m.list_microsoft_tunnel_servers(concurrency=3)
+
+    result = asyncio.run(scenario())
+
+    assert [server["siteId"] for server in result["tunnel_servers"]] == ["site-0", "site-1", "site-3", "site-4", "site-5"]
+    assert peak == 3
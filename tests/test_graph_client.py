@@ -0,0 +1,85 @@
+import asyncio
+
+import httpx
+
+import mcp_m365_mgmt as m
+
+
+def test_in_flight_requests_per_host_are_limited_to_pool_maxsize(graph):
+    in_flight = 0
+    peak = 0
+
+    async def handler(request):
+        nonlocal in_flight, peak
+        in_flight += 1
+        peak = max(peak, in_flight)
+        await asyncio.sleep(0.02)
+        in_flight -= 1
+        return httpx.Response(200, json={"value": []})
+
+    async def scenario():
+        client = graph(handler, pool_maxsize=3)
+        # Distinct URLs so single-flight does not merge them
+        await asyncio.gather(*(client.get(f"/v1.0/users/user-{index}") for index in range(12)))
+
+    asyncio.run(scenario())
+
+    assert peak == 3
+
+
+def test_hosts_have_separate_limits(graph):
+    in_flight = {}
+    peak = {}
+
+    async def handler(request):
+        host = request.url.host
+        in_flight[host] = in_flight.get(host, 0) + 1
+        peak[host] = max(peak.get(host, 0), in_flight[host])
+        await asyncio.sleep(0.02)
+        in_flight[host] -= 1
+        return httpx.Response(200, json={})
+
+    async def scenario():
+        client = graph(handler, pool_maxsize=2)
+        await asyncio.gather(*(
+            client.get(f"https://{host}/download/{index}", authenticate=False)
+            for host in ("a.test", "b.test") for index in range(6)
+        ))
+
+    asyncio.run(scenario())
+
+    assert peak == {"a.test": 2, "b.test": 2}
+
+
+def reset_shared_client(monkeypatch):
+    monkeypatch.setattr(m, "_graph_client", None)
+    monkeypatch.setattr(m, "_graph_client_loop", None)
+    monkeypatch.setattr(m, "_graph_client_closer", None)
+
+
+async def current_client():
+    return m.get_graph_client()
+
+
+def test_client_is_closed_when_its_loop_shuts_down(monkeypatch):
+    reset_shared_client(monkeypatch)
+
+    first = asyncio.run(current_client())
+    second = asyncio.run(current_client())
+
+    assert first.session.is_closed
+    assert second is not first
+
+
+def test_client_replaced_on_another_loop_is_closed(monkeypatch):
+    reset_shared_client(monkeypatch)
+    old_loop = asyncio.new_event_loop()
+    try:
+        first = old_loop.run_until_complete(current_client())
+        second = asyncio.run(current_client())
+        # The close was handed to the old loop, which runs it on its next turn
+        old_loop.run_until_complete(asyncio.sleep(0.01))
+        assert first.session.is_closed
+        assert second is not first
+    finally:
+        old_loop.close()
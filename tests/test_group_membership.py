@@ -0,0 +1,108 @@
+import asyncio
+from array import array
+
+import httpx
+
+import mcp_m365_mgmt as m
+
+DELTA_LINK = "https://graph.test/v1.0/groups/delta?$deltatoken=1"
+
+
+def member(object_id, object_type="user", removed=False):
+    entry = {"@odata.type": f"#microsoft.graph.{object_type}", "id": object_id}
+    if removed:
+        entry["@removed"] = {"reason": "deleted"}
+    return entry
+
+
+# all-staff > engineering > platform > all-staff: nested groups with a cycle
+GROUPS = [
+    {"id": "all-staff", "displayName": "All staff", "members@delta": [member("engineering", "group"), member("u1")]},
+    {"id": "engineering", "displayName": "Engineering", "members@delta": [member("platform", "group"), member("u2"), member("laptop-1", "device")]},
+    {"id": "platform", "displayName": "Platform", "members@delta": [member("all-staff", "group"), member("u3")]}
+]
+
+
+class GroupsDelta:
+    """Serves groups/delta: the full membership first, then the queued changes."""
+
+    def __init__(self):
+        self.changes = []
+        self.requests = []
+
+    def __call__(self, request):
+        self.requests.append(request.url)
+        if "$deltatoken" in request.url.params:
+            changes, self.changes = self.changes, []
+            return httpx.Response(200, json={"value": changes, "@odata.deltaLink": DELTA_LINK})
+        # Copies, since the sync consumes members@delta
+        groups = [{**group, "members@delta": list(group["members@delta"])} for group in GROUPS]
+        return httpx.Response(200, json={"value": groups, "@odata.deltaLink": DELTA_LINK})
+
+
+def run(graph, handler, *calls):
+    async def scenario():
+        graph(handler)
+        return [await call() for call in calls]
+    return asyncio.run(scenario())
+
+
+def ids(entries):
+    return [entry["id"] for entry in entries]
+
+
+def test_nested_membership_is_answered_from_the_graph(graph):
+    check, groups = run(
+        graph, GroupsDelta(),
+        lambda: m.check_group_membership("u3", "all-staff"),
+        lambda: m.list_member_groups("u3")
+    )
+
+    assert check["isMember"] and not check["direct"]
+    assert ids(check["path"]) == ["all-staff", "engineering", "platform", "u3"]
+    assert [(entry["id"], entry["direct"]) for entry in groups["groups"]] == [("platform", True), ("engineering", False), ("all-staff", False)]
+
+
+def test_cycles_are_expanded_once(graph):
+    flattened, = run(graph, GroupsDelta(), lambda: m.flatten_group_members("engineering"))
+
+    assert sorted(ids(flattened["members"])) == ["laptop-1", "u1", "u2", "u3"]
+    # all-staff is reached through platform and contains engineering again, which is not revisited
+    assert sorted(ids(flattened["nestedGroups"])) == ["all-staff", "platform"]
+
+    devices, = run(graph, GroupsDelta(), lambda: m.flatten_group_members("engineering", member_type="device"))
+    assert ids(devices["members"]) == ["laptop-1"]
+
+
+def test_delta_adds_and_removes_members(graph):
+    delta = GroupsDelta()
+
+    async def change():
+        delta.changes = [
+            {"id": "all-staff", "members@delta": [member("u1", removed=True)]},
+            {"id": "platform", "members@delta": [member("u4"), member("all-staff", "group", removed=True)]}
+        ]
+        return await m.flatten_group_members("engineering", refresh=True)
+
+    before, after, membership = run(
+        graph, delta,
+        lambda: m.flatten_group_members("engineering"),
+        change,
+        lambda: m.check_group_membership("u1", "engineering")
+    )
+
+    assert before["sync"]["mode"] == "full"
+    assert (after["sync"]["mode"], after["sync"]["changes"], after["sync"]["memberships"]) == ("delta", 2, 6)
+    assert sorted(ids(after["members"])) == ["laptop-1", "u2", "u3", "u4"]
+    assert ids(after["nestedGroups"]) == ["platform"]
+    assert not membership["isMember"]
+
+
+def test_memberships_are_stored_as_interned_integer_arrays(graph):
+    run(graph, GroupsDelta(), lambda: m.check_group_membership("u1", "all-staff"))
+
+    memberships = next(sync for sync in m._collection_syncs.values() if isinstance(sync, m.GroupMembershipSync))
+    members = memberships.items["platform"]["_members"]
+    assert isinstance(members, array) and members.typecode == "l"
+    assert sorted(memberships.ids[number] for number in members) == ["all-staff", "u3"]
+    assert memberships.stats() == {"groups": 3, "objects": 7, "memberships": 7}
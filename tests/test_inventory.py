@@ -0,0 +1,87 @@
+import asyncio
+
+import httpx
+import pytest
+
+import mcp_m365_mgmt as m
+
+TABLES = {"devices": (("id", "deviceName", "operatingSystem", "enrolledDateTime"), ("operatingSystem",))}
+DEVICES = [
+    {"id": "d1", "deviceName": "Laptop 1", "operatingSystem": "Windows", "enrolledDateTime": "2026-10-01"},
+    {"id": "d2", "deviceName": "Laptop 2", "operatingSystem": "Windows", "enrolledDateTime": "2026-10-12"},
+    {"id": "d3", "deviceName": "Phone 1", "operatingSystem": "iOS", "enrolledDateTime": "2026-10-15"}
+]
+
+
+@pytest.fixture
+def mirror(tmp_path):
+    inventory = m.InventoryMirror(str(tmp_path / "inventory.db"), TABLES)
+    inventory.write("devices", DEVICES)
+    return inventory
+
+
+def ids(result):
+    return [row["id"] for row in result["rows"]]
+
+
+def test_filters_bind_values_and_lists_mean_any_of(mirror):
+    assert ids(mirror.query("devices", filters={"operatingSystem": "Windows", "enrolledDateTime": {"ge": "2026-10-10"}})) == ["d2"]
+    assert ids(mirror.query("devices", filters={"id": ["d1", "d3"]}, order_by="id")) == ["d1", "d3"]
+    assert ids(mirror.query("devices", filters={"id": {"ne": ["d1", "d3"]}})) == ["d2"]
+    assert ids(mirror.query("devices", filters={"deviceName": {"like": "Laptop%"}}, order_by="id")) == ["d1", "d2"]
+
+
+def test_group_by_counts_and_sorts_by_count(mirror):
+    result = mirror.query("devices", group_by="operatingSystem")
+
+    assert result["rows"] == [{"operatingSystem": "Windows", "count": 2}, {"operatingSystem": "iOS", "count": 1}]
+
+
+@pytest.mark.parametrize("options", [
+    {"columns": ["id", "count"]},
+    {"filters": {"count": 2}},
+    {"order_by": "count"},
+    {"group_by": "count"},
+    {"group_by": "operatingSystem", "filters": {"count": {"gt": 1}}},
+    {"columns": ['id" FROM devices; --']},
+    {"filters": {"enrolledDateTime": {"gt": ["2026-10-01", "2026-10-12"]}}},
+    {"filters": {"deviceName": {"like": ["Laptop%"]}}},
+    {"filters": {"id": {"between": 1}}}
+])
+def test_invalid_queries_are_rejected(mirror, options):
+    with pytest.raises(ValueError):
+        mirror.query("devices", **options)
+
+
+def test_schema_change_rebuilds_the_table(tmp_path, mirror):
+    path = str(tmp_path / "inventory.db")
+    changed = m.InventoryMirror(path, {"devices": (("id", "deviceName"), ())})
+
+    assert changed.query("devices")["rows"] == []
+    assert changed.freshness()["devices"]["row_count"] == 0
+
+
+def test_list_users_refreshes_the_mirror_with_delta_changes(graph, tmp_path, monkeypatch):
+    inventory = m.InventoryMirror(str(tmp_path / "users.db"), m.INVENTORY_TABLES)
+    monkeypatch.setattr(m, "_inventory", inventory)
+    delta_link = "https://graph.test/v1.0/users/delta?$deltatoken=1"
+    pages = {
+        "full": {"value": [{"id": "u1", "displayName": "One"}, {"id": "u2", "displayName": "Two"}], "@odata.deltaLink": delta_link},
+        "delta": {"value": [{"id": "u1", "displayName": "One renamed"}, {"id": "u2", "@removed": {"reason": "deleted"}}], "@odata.deltaLink": delta_link}
+    }
+
+    def handler(request):
+        return httpx.Response(200, json=pages["delta" if "$deltatoken" in request.url.params else "full"])
+
+    async def scenario():
+        graph(handler)
+        await m.list_users()
+        first = inventory.query("users", order_by="id")
+        await m.list_users()
+        return first, inventory.query("users", order_by="id")
+
+    first, second = asyncio.run(scenario())
+
+    assert [(row["id"], row["displayName"]) for row in first["rows"]] == [("u1", "One"), ("u2", "Two")]
+    assert [(row["id"], row["displayName"]) for row in second["rows"]] == [("u1", "One renamed")]
+    assert second["freshness"]["row_count"] == 1
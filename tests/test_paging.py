@@ -0,0 +1,51 @@
+import asyncio
+
+import httpx
+
+import mcp_m365_mgmt as m
+
+
+def paged_collection(page_count, page_size, requests):
+    """Handler serving a collection of page_count pages linked by @odata.nextLink."""
+    def handler(request):
+        requests.append(request.url)
+        page = int(request.url.params.get("page", "0"))
+        body = {"value": [{"id": f"{page}-{index}"} for index in range(page_size)]}
+        if page + 1 < page_count:
+            body["@odata.nextLink"] = f"https://graph.test/v1.0/users?page={page + 1}&$top={page_size}"
+        return httpx.Response(200, json=body)
+    return handler
+
+
+def collect(graph, handler, **options):
+    async def scenario():
+        graph(handler)
+        return [page async for page in m.iter_pages("/v1.0/users", **options)]
+    return asyncio.run(scenario())
+
+
+def test_follows_next_links_until_exhausted(graph):
+    requests = []
+    pages = collect(graph, paged_collection(3, 5, requests), page_size=5)
+
+    assert [len(page) for page in pages] == [5, 5, 5]
+    assert requests[0].params["$top"] == "5"
+    assert len(requests) == 3
+
+
+def test_max_items_truncates_across_pages(graph):
+    requests = []
+    pages = collect(graph, paged_collection(3, 5, requests), max_items=7)
+
+    assert [len(page) for page in pages] == [5, 2]
+    assert [item["id"] for item in pages[1]] == ["1-0", "1-1"]
+    # The third page is never requested
+    assert len(requests) == 2
+
+
+def test_max_items_on_a_page_boundary_stops_without_another_request(graph):
+    requests = []
+    pages = collect(graph, paged_collection(3, 5, requests), max_items=5)
+
+    assert [len(page) for page in pages] == [5]
+    assert len(requests) == 1
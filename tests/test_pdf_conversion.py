@@ -0,0 +1,178 @@
+import asyncio
+import gzip
+import json
+import re
+import tracemalloc
+
+import httpx
+import pytest
+
+import mcp_m365_mgmt as m
+
+DRIVE = "/v1.0/users/user-1/drive"
+PDF_SIZE = 64 * 1024
+
+
+class PdfDriveStandIn:
+    """Local stand-in for a drive that renders files as PDF.
+
+    ?format=pdf redirects to a download on the same host whose body trickles
+    in, so conversions overlap and keep their download open while uploading.
+    """
+
+    def __init__(self, files, content_encoding=None):
+        self.files = files
+        self.content_encoding = content_encoding
+        self.uploaded = {}
+
+    def respond(self, method, url, body=b""):
+        path = httpx.URL(url).path
+        if path.endswith("/root/children"):
+            return httpx.Response(200, json={"value": [
+                {"id": name, "name": name, "file": {}, "lastModifiedDateTime": "2026-01-01T00:00:00Z"} for name in self.files
+            ]})
+        if path.startswith("/download/") and self.content_encoding == "gzip":
+            body = gzip.compress(b"%" * PDF_SIZE)
+            return httpx.Response(200, headers={"Content-Length": str(len(body)), "Content-Encoding": "gzip"}, content=body)
+        if path.startswith("/download/"):
+            return httpx.Response(200, headers={"Content-Length": str(PDF_SIZE)}, content=self.trickle())
+        if "/items/" in path and path.endswith("/content"):
+            return httpx.Response(302, headers={"Location": f"https://graph.test/download{path}"})
+        if "/items/" in path:
+            return httpx.Response(200, json={"id": path.rsplit("/", 1)[-1], "name": path.rsplit("/", 1)[-1]})
+        if method == "PUT" and path.endswith(":/content"):
+            name = path.split("root:/", 1)[1][:-len(":/content")]
+            self.uploaded[name] = len(body)
+            return httpx.Response(201, json={"id": f"pdf-{name}", "name": name, "size": len(body)})
+        return httpx.Response(404)
+
+    async def trickle(self):
+        for _ in range(4):
+            await asyncio.sleep(0.01)
+            yield b"%" * (PDF_SIZE // 4)
+
+    async def __call__(self, request):
+        body = await request.aread()
+        if request.url.path.endswith("/$batch"):
+            version = request.url.path.split("/")[1]
+            responses = []
+            for sub_request in json.loads(body)["requests"]:
+                sub_response = self.respond(sub_request["method"], f"https://graph.test/{version}{sub_request['url']}")
+                item = {"id": sub_request["id"], "status": sub_response.status_code, "headers": dict(sub_response.headers)}
+                if sub_response.status_code == 200:
+                    item["body"] = sub_response.json()
+                responses.append(item)
+            return httpx.Response(200, json={"responses": responses})
+        return self.respond(request.method, str(request.url), body)
+
+
+def run(graph, drive, call, pool_maxsize, timeout=10):
+    async def scenario():
+        graph(drive, pool_maxsize=pool_maxsize)
+        # A deadlock shows up as a timeout instead of a hung test run
+        return await asyncio.wait_for(call(), timeout)
+    return asyncio.run(scenario())
+
+
+@pytest.mark.parametrize("pool_maxsize", [1, 2, 20])
+def test_concurrent_conversions_do_not_exhaust_host_slots(graph, pool_maxsize):
+    files = [f"deck-{index}.pptx" for index in range(pool_maxsize * 2)]
+    drive = PdfDriveStandIn(files)
+
+    async def convert_all():
+        return await asyncio.gather(*(m.convert_file_to_pdf("onedrive", "user-1", name) for name in files))
+
+    results = run(graph, drive, convert_all, pool_maxsize)
+
+    assert all("error" not in result for result in results)
+    assert drive.uploaded == {name.replace(".pptx", ".pdf"): PDF_SIZE for name in files}
+
+
+@pytest.mark.parametrize("pool_maxsize, concurrency", [(2, 2), (2, 8), (20, 20), (20, 40)])
+def test_folder_conversion_with_concurrency_at_or_above_pool_size(graph, pool_maxsize, concurrency):
+    files = [f"report-{index}.docx" for index in range(pool_maxsize * 2)] + ["notes.txt"]
+    drive = PdfDriveStandIn(files)
+
+    result = run(graph, drive, lambda: m.convert_folder_to_pdf("onedrive", "user-1", concurrency=concurrency), pool_maxsize)
+
+    assert result["converted"] == len(files) - 1
+    assert result["failed"] == 0
+    assert result["concurrency"] == max(1, pool_maxsize // 2)
+    assert len(drive.uploaded) == len(files) - 1
+
+
+def test_concurrent_folder_conversions_share_the_pool(graph):
+    files = [f"report-{index}.docx" for index in range(6)]
+    drive = PdfDriveStandIn(files)
+
+    async def convert_folders():
+        return await asyncio.gather(*(m.convert_folder_to_pdf("onedrive", "user-1", overwrite=True) for _ in range(3)))
+
+    results = run(graph, drive, convert_folders, pool_maxsize=4)
+
+    assert [result["converted"] for result in results] == [6, 6, 6]
+
+
+def test_gzip_download_is_uploaded_in_full(graph):
+    drive = PdfDriveStandIn(["deck.pptx"], content_encoding="gzip")
+
+    result = run(graph, drive, lambda: m.convert_file_to_pdf("onedrive", "user-1", "deck.pptx"), pool_maxsize=4)
+
+    assert "error" not in result
+    # Content-Length is the compressed size; the upload must carry the decoded PDF
+    assert drive.uploaded == {"deck.pdf": PDF_SIZE}
+
+
+class LargePdfDrive(httpx.AsyncBaseTransport):
+    """Serves one large PDF rendition in 1 MB pieces and counts uploaded session bytes without keeping them.
+
+    A transport rather than a MockTransport handler: MockTransport reads every
+    request body into memory first, which would hide what the client holds.
+    """
+
+    PIECE = 1024 * 1024
+
+    def __init__(self, size):
+        self.size = size
+        self.received = 0
+
+    async def pieces(self):
+        for _ in range(self.size // self.PIECE):
+            yield b"%" * self.PIECE
+
+    async def handle_async_request(self, request):
+        path = request.url.path
+        if path.endswith("/content") and "/items/" in path:
+            return httpx.Response(200, headers={"Content-Length": str(self.size)}, content=self.pieces())
+        if path.endswith(":/createUploadSession"):
+            return httpx.Response(200, json={"uploadUrl": "https://upload.test/session"})
+        if path == "/session":
+            async for part in request.stream:
+                self.received += len(part)
+            total = int(re.match(r"bytes \d+-\d+/(\d+)", request.headers["Content-Range"]).group(1))
+            if self.received == total:
+                return httpx.Response(201, json={"id": "pdf-1", "size": total})
+            return httpx.Response(202, json={"nextExpectedRanges": [f"{self.received}-"]})
+        return httpx.Response(404)
+
+
+def test_large_conversion_streams_with_bounded_memory(graph):
+    size = 48 * 1024 * 1024
+    drive = LargePdfDrive(size)
+
+    async def convert():
+        client = graph(drive)
+        client.session = httpx.AsyncClient(transport=drive, follow_redirects=True)
+        tracemalloc.start()
+        try:
+            response = await m.convert_item_to_pdf("onedrive", "user-1", "deck.pptx", "deck.pdf")
+            return response, tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+    response, peak = asyncio.run(convert())
+
+    assert response.status_code == 201
+    assert drive.received == size
+    # A few upload chunks in memory, not the whole file
+    assert peak < 4 * m.GRAPH_UPLOAD_CHUNK_SIZE + 2 * LargePdfDrive.PIECE, f"peak {peak / 2**20:.1f} MiB"
@@ -0,0 +1,84 @@
+import asyncio
+import gzip
+import json
+
+import httpx
+
+import mcp_m365_mgmt as m
+
+POLICIES = {"value": [{"id": "policy-1", "displayName": "Baseline", "@odata.type": "#microsoft.graph.windows10CompliancePolicy"}]}
+
+
+def gzip_graph(requests):
+    """Answers like Graph does for httpx's default Accept-Encoding: gzip bodies with an ETag."""
+    def handler(request):
+        requests.append(request)
+        if request.headers.get("If-None-Match") == 'W/"1"':
+            return httpx.Response(304, headers={"ETag": 'W/"1"'})
+        body = gzip.compress(json.dumps(POLICIES).encode())
+        return httpx.Response(200, headers={"Content-Encoding": "gzip", "Content-Type": "application/json", "ETag": 'W/"1"'}, content=body)
+    return handler
+
+
+def test_gzip_response_is_replayed_from_cache(graph):
+    requests = []
+
+    async def scenario():
+        graph(gzip_graph(requests))
+        first = await m.list_intune_compliance_policies()
+        second = await m.list_intune_compliance_policies()
+        return first, second
+
+    first, second = asyncio.run(scenario())
+
+    assert first["cache_status"] == "miss"
+    assert second["cache_status"] == "hit"
+    assert second["policies"] == first["policies"]
+    assert first["policies"][0]["displayName"] == "Baseline"
+    assert len(requests) == 1
+
+
+def test_gzip_response_is_replayed_after_revalidation(graph):
+    requests = []
+
+    async def scenario():
+        graph(gzip_graph(requests))
+        first = await m.list_intune_compliance_policies()
+        for entry in m.response_cache._entries.values():
+            entry["expires_at"] = 0
+        second = await m.list_intune_compliance_policies()
+        return first, second
+
+    first, second = asyncio.run(scenario())
+
+    assert second["cache_status"] == "revalidated"
+    assert second["policies"] == first["policies"]
+    assert requests[-1].headers["If-None-Match"] == 'W/"1"'
+
+
+def test_not_modified_after_eviction_replays_the_revalidated_entry(graph):
+    requests = []
+    serve = gzip_graph(requests)
+
+    def evicting_graph(request):
+        if "If-None-Match" in request.headers:
+            # Other reads pushed the entry out while this one was in flight
+            m.response_cache._entries.clear()
+        return serve(request)
+
+    async def scenario():
+        graph(evicting_graph)
+        first = await m.list_intune_compliance_policies()
+        for entry in m.response_cache._entries.values():
+            entry["expires_at"] = 0
+        second = await m.list_intune_compliance_policies()
+        third = await m.list_intune_compliance_policies()
+        return first, second, third
+
+    first, second, third = asyncio.run(scenario())
+
+    assert second["cache_status"] == "revalidated"
+    assert second["policies"] == first["policies"]
+    # The revalidated entry is stored again
+    assert third["cache_status"] == "hit"
+    assert len(requests) == 2
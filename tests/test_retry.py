@@ -0,0 +1,64 @@
+import asyncio
+
+import httpx
+import pytest
+
+import mcp_m365_mgmt as m
+
+
+def run_tool(graph, handler, call):
+    async def scenario():
+        graph(handler)
+        return await call()
+    return asyncio.run(scenario())
+
+
+@pytest.mark.parametrize("failure", ["500", "502", "504", "read_timeout"])
+def test_post_is_not_retried_after_it_may_have_been_processed(graph, failure):
+    posts = []
+
+    def handler(request):
+        posts.append(request)
+        if failure == "read_timeout":
+            raise httpx.ReadTimeout("timed out", request=request)
+        return httpx.Response(int(failure), json={"error": {"code": "serviceError"}})
+
+    call = lambda: m.create_user("Ada", "ada", "ada@contoso.com")
+    if failure == "read_timeout":
+        with pytest.raises(httpx.ReadTimeout):
+            run_tool(graph, handler, call)
+    else:
+        result = run_tool(graph, handler, call)
+        assert result["status_code"] == int(failure)
+    assert len(posts) == 1
+
+
+@pytest.mark.parametrize("status", [429, 503])
+def test_post_is_retried_when_throttled(graph, status):
+    posts = []
+
+    def handler(request):
+        posts.append(request)
+        if len(posts) == 1:
+            return httpx.Response(status, headers={"Retry-After": "0"}, json={"error": {"code": "throttled"}})
+        return httpx.Response(201, json={"id": "user-1", "userPrincipalName": "ada@contoso.com"})
+
+    result = run_tool(graph, handler, lambda: m.create_user("Ada", "ada", "ada@contoso.com"))
+
+    assert "error" not in result
+    assert len(posts) == 2
+
+
+def test_get_is_retried_after_server_error(graph):
+    attempts = []
+
+    def handler(request):
+        attempts.append(request)
+        if len(attempts) < 3:
+            return httpx.Response(502)
+        return httpx.Response(200, json={"value": [{"id": "1"}]})
+
+    result = run_tool(graph, handler, m.list_autopilot_devices)
+
+    assert "error" not in result
+    assert len(attempts) == 3
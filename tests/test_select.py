@@ -0,0 +1,77 @@
+import asyncio
+import json
+
+import httpx
+import pytest
+
+import mcp_m365_mgmt as m
+
+# (tool call, Graph resource path, field list the tool projects)
+CASES = [
+    (lambda: m.list_intune_devices(), "/v1.0/deviceManagement/managedDevices", m.MANAGED_DEVICE_FIELDS),
+    (lambda: m.list_intune_compliance_policies(), "/v1.0/deviceManagement/deviceCompliancePolicies", m.POLICY_FIELDS),
+    (lambda: m.list_intune_configuration_policies(), "/v1.0/deviceManagement/deviceConfigurations", m.POLICY_FIELDS),
+    (lambda: m.list_intune_filters(), "/beta/deviceManagement/assignmentFilters", m.ASSIGNMENT_FILTER_FIELDS),
+    (lambda: m.list_intune_scripts(), "/beta/deviceManagement/deviceManagementScripts", m.POWERSHELL_SCRIPT_FIELDS),
+    (lambda: m.list_intune_scripts(), "/beta/deviceManagement/deviceShellScripts", m.SHELL_SCRIPT_FIELDS),
+    (lambda: m.list_intune_applications(), "/beta/deviceAppManagement/mobileApps", m.MOBILE_APP_FIELDS),
+    (lambda: m.list_autopilot_profiles(), "/beta/deviceManagement/windowsAutopilotDeploymentProfiles", m.AUTOPILOT_PROFILE_FIELDS),
+    (lambda: m.list_autopilot_devices(), "/beta/deviceManagement/windowsAutopilotDeviceIdentities", m.AUTOPILOT_DEVICE_FIELDS),
+    (lambda: m.list_android_management_profiles(), "/beta/deviceManagement/deviceConfigurations", m.PLATFORM_CONFIGURATION_FIELDS),
+    (lambda: m.list_android_management_profiles(), "/beta/deviceManagement/deviceEnrollmentConfigurations", m.PLATFORM_ENROLLMENT_FIELDS),
+    (lambda: m.list_ios_management_profiles(), "/beta/deviceManagement/deviceConfigurations", m.PLATFORM_CONFIGURATION_FIELDS),
+    (lambda: m.list_microsoft_tunnel_sites(), "/beta/deviceManagement/microsoftTunnelSites", m.TUNNEL_SITE_FIELDS),
+    (lambda: m.list_microsoft_tunnel_servers(), "/beta/deviceManagement/microsoftTunnelSites/site-1/microsoftTunnelServers", m.TUNNEL_SERVER_FIELDS),
+    (lambda: m.list_intune_ad_connectors(), "/beta/deviceManagement/domainJoinConnectors", m.AD_CONNECTOR_FIELDS),
+    (lambda: m.list_intune_certificate_connectors(), "/beta/deviceManagement/ndesConnectors", m.CERTIFICATE_CONNECTOR_FIELDS),
+    (lambda: m.get_user_info("user-1"), "/v1.0/users/user-1", m.USER_DETAIL_FIELDS),
+    (lambda: m.list_users(), "/v1.0/users/delta", m.USER_FIELDS),
+    (lambda: m.list_groups(), "/v1.0/groups/delta", m.GROUP_FIELDS),
+    (lambda: m.get_group_details("group-1"), "/v1.0/groups/group-1", m.GROUP_DETAIL_FIELDS),
+    (lambda: m.get_group_members("group-1"), "/v1.0/groups/group-1/members", m.GROUP_MEMBER_FIELDS),
+    (lambda: m.list_sharepoint_sites(), "/v1.0/sites", m.SITE_FIELDS),
+]
+
+
+def expected_select(fields):
+    return {field for field in fields if isinstance(field, str) and not field.startswith("@")}
+
+
+def capture_selects(graph, call):
+    """Runs a tool and returns {Graph path: $select} for every request it sent, including $batch sub-requests."""
+    selects = {}
+
+    def record(url):
+        url = httpx.URL(url)
+        path = url.path if url.path.startswith(("/v1.0", "/beta")) else None
+        if path is not None:
+            selects[path] = url.params.get("$select")
+
+    def handler(request):
+        if request.url.path.endswith("/$batch"):
+            version = request.url.path.split("/")[1]
+            responses = []
+            for sub_request in json.loads(request.content)["requests"]:
+                record(f"https://graph.test/{version}{sub_request['url']}")
+                responses.append({"id": sub_request["id"], "status": 200, "body": {"value": []}})
+            return httpx.Response(200, json={"responses": responses})
+        record(str(request.url))
+        item = {"id": "site-1", "displayName": "item"}
+        if request.url.path.endswith(("/users/user-1", "/groups/group-1")):
+            return httpx.Response(200, json=item)
+        return httpx.Response(200, json={"value": [item]})
+
+    async def scenario():
+        graph(handler)
+        result = await call()
+        assert "error" not in result
+    asyncio.run(scenario())
+    return selects
+
+
+@pytest.mark.parametrize("call, path, fields", CASES, ids=[f"{path.rsplit('/', 1)[-1]}-{index}" for index, (_, path, _) in enumerate(CASES)])
+def test_tool_selects_projected_fields(graph, call, path, fields):
+    selects = capture_selects(graph, call)
+
+    assert path in selects, f"no request to {path}; saw {sorted(selects)}"
+    assert set(selects[path].split(",")) == expected_select(fields)
@@ -0,0 +1,59 @@
+"""Startup benchmark for the server module.
+
+The MCP host spawns the server per session, so import time is cold-start
+time. Run this file directly to print the slowest imports:
+
+    python tests/test_startup.py
+"""
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Cumulative `python -X importtime` budget for `import mcp_m365_mgmt`, in milliseconds
+IMPORT_BUDGET_MS = float(os.getenv("IMPORT_BUDGET_MS", "1500"))
+
+# Imported on first use only; none of them may load when the module is imported
+DEFERRED_MODULES = ("azure.identity", "aiohttp", "docx", "openpyxl", "pptx", "odf")
+
+
+def import_times():
+    """Imports the module in a fresh interpreter; returns {module: (self_us, cumulative_us)}."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import mcp_m365_mgmt"],
+        cwd=ROOT, capture_output=True, text=True, check=True
+    )
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        self_us, cumulative_us, name = (part.strip() for part in line[len("import time:"):].split("|"))
+        if self_us.isdigit():
+            times[name.strip()] = (int(self_us), int(cumulative_us))
+    return times
+
+
+def test_import_time_within_budget():
+    # Best of three runs, so a busy machine does not fail the check on noise
+    best = min(import_times()["mcp_m365_mgmt"][1] for _ in range(3)) / 1000
+
+    assert best < IMPORT_BUDGET_MS, f"import took {best:.0f} ms (budget {IMPORT_BUDGET_MS:.0f} ms)"
+
+
+def test_heavy_modules_are_not_imported_at_startup():
+    imported = import_times()
+
+    assert [module for module in DEFERRED_MODULES if module in imported] == []
+
+
+def test_credential_is_not_created_at_import():
+    code = "import mcp_m365_mgmt as m; assert m.token_manager._credential is None"
+    subprocess.run([sys.executable, "-c", code], cwd=ROOT, check=True)
+
+
+if __name__ == "__main__":
+    times = import_times()
+    print(f"import mcp_m365_mgmt: {times['mcp_m365_mgmt'][1] / 1000:.0f} ms (budget {IMPORT_BUDGET_MS:.0f} ms)")
+    for name, (self_us, cumulative_us) in sorted(times.items(), key=lambda item: -item[1][1])[:15]:
+        print(f"{cumulative_us / 1000:8.1f} ms {self_us / 1000:8.1f} ms  {name}")
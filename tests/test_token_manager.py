@@ -0,0 +1,119 @@
+import asyncio
+import time
+from collections import namedtuple
+
+import mcp_m365_mgmt as m
+
+AccessToken = namedtuple("AccessToken", ["token", "expires_on"])
+
+
+class CachingCredential:
+    """Returns its cached token until it is within 300 s of expiry, like azure-identity.
+
+    Each new token lives for the next value of lifetimes (the last one repeats).
+    """
+
+    def __init__(self, *lifetimes):
+        self.lifetimes = list(lifetimes)
+        self.calls = 0
+        self.token = None
+
+    async def get_token(self, scope):
+        self.calls += 1
+        if self.token is None or self.token.expires_on - time.time() <= 300:
+            lifetime = self.lifetimes.pop(0) if len(self.lifetimes) > 1 else self.lifetimes[0]
+            self.token = AccessToken(f"token-{self.calls}", time.time() + lifetime)
+        return self.token
+
+
+def run_manager(manager, seconds):
+    async def scenario():
+        token = await manager.get_token()
+        await asyncio.sleep(seconds)
+        manager._refresh_task.cancel()
+        return token
+    return asyncio.run(scenario())
+
+
+def test_refresh_backs_off_when_margin_exceeds_credential_window():
+    credential = CachingCredential(500)
+    manager = m.TokenManager(lambda: credential, refresh_margin=600)
+
+    assert run_manager(manager, 0.5) == "token-1"
+
+    # One inline acquisition and one background attempt that got the cached token back
+    assert credential.calls == 2
+    assert manager.background_refreshes == 0
+
+
+def test_refresh_backs_off_when_tokens_are_shorter_than_margin():
+    credential = CachingCredential(120)
+    manager = m.TokenManager(lambda: credential, refresh_margin=300)
+
+    run_manager(manager, 0.5)
+
+    assert credential.calls == 2
+    assert manager.background_refreshes == 1
+
+
+def test_background_refresh_renews_before_expiry():
+    credential = CachingCredential(150, 3600)
+    manager = m.TokenManager(lambda: credential, refresh_margin=200)
+
+    run_manager(manager, 0.2)
+
+    assert credential.calls == 2
+    assert manager.background_refreshes == 1
+    assert manager._token.token == "token-2"
+
+
+class AsyncCredential:
+    """An aio credential: its HTTP session belongs to the loop it was created on."""
+
+    instances = []
+
+    def __init__(self):
+        self.closed = False
+        AsyncCredential.instances.append(self)
+
+    async def get_token(self, scope):
+        return AccessToken("token", time.time() + 3600)
+
+    async def close(self):
+        self.closed = True
+
+
+def test_async_credential_is_closed_and_recreated_per_loop():
+    AsyncCredential.instances = []
+    manager = m.TokenManager(AsyncCredential)
+
+    async def acquire():
+        manager._token = None
+        return await manager.get_token()
+
+    asyncio.run(acquire())
+    asyncio.run(acquire())
+
+    first, second = AsyncCredential.instances
+    assert first.closed
+    assert second.closed
+
+
+def test_refresh_task_is_restarted_on_a_new_loop():
+    manager = m.TokenManager(lambda: CachingCredential(3600))
+    old_loop = asyncio.new_event_loop()
+    try:
+        old_loop.run_until_complete(manager.get_token())
+        old_task = manager._refresh_task
+
+        async def on_new_loop():
+            await manager.get_token()
+            task = manager._refresh_task
+            assert task.get_loop() is asyncio.get_running_loop()
+            task.cancel()
+
+        asyncio.run(on_new_loop())
+        old_loop.run_until_complete(asyncio.sleep(0))
+        assert old_task.cancelled()
+    finally:
+        old_loop.close()
@@ -0,0 +1,60 @@
+import asyncio
+import json
+
+import httpx
+
+import mcp_m365_mgmt as m
+
+ESP_PATH = "/beta/deviceManagement/deviceEnrollmentConfigurations"
+PROFILES = [
+    {"@odata.type": "#microsoft.graph.windows10EnrollmentCompletionPageConfiguration", "id": "esp-1", "displayName": "ESP"},
+    {"@odata.type": "#microsoft.graph.deviceEnrollmentLimitConfiguration", "id": "limit-1", "displayName": "Limit"}
+]
+
+
+def rejecting_filter(requests):
+    """Handler that rejects isof() filters with a 400, like some Intune endpoints."""
+    def answer(url):
+        requests.append(url)
+        if "$filter" in url.params:
+            return 400, {"error": {"code": "BadRequest", "message": "isof is not supported"}}
+        return 200, {"value": PROFILES}
+
+    def handler(request):
+        if request.url.path.endswith("/$batch"):
+            version = request.url.path.split("/")[1]
+            responses = []
+            for sub_request in json.loads(request.content)["requests"]:
+                status, body = answer(httpx.URL(f"https://graph.test/{version}{sub_request['url']}"))
+                responses.append({"id": sub_request["id"], "status": status, "body": body})
+            return httpx.Response(200, json={"responses": responses})
+        status, body = answer(request.url)
+        return httpx.Response(status, json=body)
+    return handler
+
+
+def test_rejected_filter_falls_back_and_is_remembered(graph, monkeypatch):
+    monkeypatch.setattr(m, "_type_filter_unsupported", set())
+    requests = []
+
+    async def scenario():
+        graph(rejecting_filter(requests))
+        first = await m.list_enrollment_status_page_profiles()
+        # A cold cache, so the second call goes back to Graph
+        monkeypatch.setattr(m, "response_cache", m.ResponseCache(ttls=m.GRAPH_CACHE_TTLS))
+        second = await m.list_enrollment_status_page_profiles()
+        return first, second
+
+    first, second = asyncio.run(scenario())
+
+    for result in (first, second):
+        assert [profile["id"] for profile in result["esp_profiles"]] == ["esp-1"]
+    assert ["$filter" in url.params for url in requests] == [True, False, False]
+    assert m._type_filter_unsupported == {ESP_PATH}
+
+
+def test_type_filter_params_skips_unsupported_paths(monkeypatch):
+    monkeypatch.setattr(m, "_type_filter_unsupported", {ESP_PATH})
+
+    assert m.type_filter_params(ESP_PATH, ("windows10EnrollmentCompletionPageConfiguration",), {"$top": 5}) == {"$top": 5}
+    assert m.type_filter_params("/beta/other", ("a", "b"))["$filter"] == "isof('microsoft.graph.a') or isof('microsoft.graph.b')"
@@ -0,0 +1,154 @@
+import asyncio
+import os
+import re
+
+import httpx
+import pytest
+
+import mcp_m365_mgmt as m
+
+ITEM = "/v1.0/users/user-1/drive/root:/report.bin:"
+
+
+class DriveStandIn:
+    """Local stand-in for OneDrive uploads.
+
+    Enforces Graph's 4 MB limit on simple PUT uploads and keeps upload
+    sessions that accept chunks in order. drop_after_receiving lists chunk
+    numbers whose connection drops after the bytes were stored, so the client
+    never sees the acknowledgement; drop_from_chunk drops every chunk from
+    that number on before it is stored.
+    """
+
+    def __init__(self, drop_after_receiving=(), drop_from_chunk=None):
+        self.sessions = {}
+        self.sessions_created = 0
+        self.files = {}
+        self.requests = []
+        self.chunks = 0
+        self.drop_after_receiving = set(drop_after_receiving)
+        self.drop_from_chunk = drop_from_chunk
+
+    async def __call__(self, request):
+        body = await request.aread()
+        self.requests.append((request.method, request.url.path, request.headers.get("Content-Range")))
+        path = request.url.path
+
+        if path.endswith(":/content"):
+            if len(body) > m.GRAPH_SIMPLE_UPLOAD_LIMIT:
+                return httpx.Response(413, json={"error": {"code": "requestEntityTooLarge"}})
+            self.files[path[:-len("/content")]] = body
+            return httpx.Response(201, json={"id": "item-1", "size": len(body)})
+
+        if path.endswith(":/createUploadSession"):
+            session = f"session-{self.sessions_created}"
+            self.sessions_created += 1
+            self.sessions[session] = {"item": path[:-len("/createUploadSession")], "data": bytearray()}
+            return httpx.Response(200, json={"uploadUrl": f"https://upload.test/{session}"})
+
+        session = self.sessions.get(path.strip("/"))
+        if session is None:
+            return httpx.Response(404, json={"error": {"code": "itemNotFound"}})
+        if request.method == "GET":
+            return httpx.Response(200, json={"nextExpectedRanges": [f"{len(session['data'])}-"]})
+
+        self.chunks += 1
+        if self.drop_from_chunk is not None and self.chunks >= self.drop_from_chunk:
+            raise httpx.RemoteProtocolError("Server disconnected", request=request)
+        start, end, total = map(int, re.match(r"bytes (\d+)-(\d+)/(\d+)", request.headers["Content-Range"]).groups())
+        if start != len(session["data"]) or len(body) != end - start + 1:
+            return httpx.Response(416, json={"error": {"code": "invalidRange"}})
+        session["data"] += body
+        if self.chunks in self.drop_after_receiving:
+            raise httpx.RemoteProtocolError("Server disconnected", request=request)
+        if len(session["data"]) == total:
+            self.files[session["item"]] = bytes(session["data"])
+            return httpx.Response(201, json={"id": "item-1", "size": total})
+        return httpx.Response(202, json={"nextExpectedRanges": [f"{len(session['data'])}-"]})
+
+    def chunk_starts(self):
+        return [int(content_range.split()[1].split("-")[0]) for method, _, content_range in self.requests if method == "PUT" and content_range]
+
+
+def upload(graph, drive, content):
+    async def scenario():
+        graph(drive)
+        return await m.upload_file("onedrive", "user-1", "report.bin", content, "application/octet-stream")
+    return asyncio.run(scenario())
+
+
+@pytest.fixture(autouse=True)
+def no_interrupted_uploads(monkeypatch):
+    monkeypatch.setattr(m, "_interrupted_uploads", {})
+
+
+def test_small_file_uses_simple_upload(graph):
+    drive = DriveStandIn()
+    content = os.urandom(1024)
+
+    response = upload(graph, drive, content)
+
+    assert response.status_code == 201
+    assert drive.files[ITEM] == content
+    assert drive.sessions == {}
+
+
+def test_large_file_uses_upload_session_in_aligned_chunks(graph):
+    drive = DriveStandIn()
+    content = os.urandom(9 * 1024 * 1024)
+
+    response = upload(graph, drive, content)
+
+    assert response.status_code == 201
+    assert drive.files[ITEM] == content
+    assert all(start % m.UPLOAD_CHUNK_ALIGNMENT == 0 for start in drive.chunk_starts())
+    assert not any(path.endswith(":/content") for _, path, _ in drive.requests)
+
+
+def test_lost_chunk_acknowledgement_resumes_from_session(graph):
+    drive = DriveStandIn(drop_after_receiving={2})
+    content = os.urandom(9 * 1024 * 1024)
+
+    response = upload(graph, drive, content)
+
+    assert response.status_code == 201
+    assert drive.files[ITEM] == content
+    # The retried second chunk is rejected and the upload continues where the session is
+    assert ("GET", "/session-0", None) in drive.requests
+
+
+def test_interrupted_upload_resumes_without_resending(graph):
+    content = os.urandom(9 * 1024 * 1024)
+    drive = DriveStandIn(drop_from_chunk=2)
+    with pytest.raises(httpx.TransportError):
+        upload(graph, drive, content)
+    received = len(drive.sessions["session-0"]["data"])
+    assert received == m.GRAPH_UPLOAD_CHUNK_SIZE
+
+    drive.drop_from_chunk = None
+    drive.requests.clear()
+    response = upload(graph, drive, content)
+
+    assert response.status_code == 201
+    assert drive.files[ITEM] == content
+    assert len(drive.sessions) == 1
+    assert drive.requests[0] == ("GET", "/session-0", None)
+    assert drive.chunk_starts()[0] == received
+
+
+def test_expired_session_falls_back_to_new_session(graph):
+    content = os.urandom(9 * 1024 * 1024)
+    drive = DriveStandIn(drop_from_chunk=2)
+    with pytest.raises(httpx.TransportError):
+        upload(graph, drive, content)
+
+    drive.sessions.clear()
+    drive.drop_from_chunk = None
+    drive.requests.clear()
+    response = upload(graph, drive, content)
+
+    assert response.status_code == 201
+    assert drive.files[ITEM] == content
+    assert drive.requests[0] == ("GET", "/session-0", None)
+    assert "session-1" in drive.sessions
+    assert drive.chunk_starts()[0] == 0